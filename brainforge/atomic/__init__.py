@@ -1,6 +1,6 @@
 from .core_op import ReshapeOp, DenseOp
-from .tensor_op import ConvolutionOp, MaxPoolOp
+from .tensor_op import ConvolutionOp, DepthwiseConvolutionOp, MaxPoolOp
 from .activation_op import (
     Sigmoid, Tanh, ReLU, Linear, SoftMax, activations
 )
-from .recurrent_op import RecurrentOp, LSTMOp
+from .recurrent_op import RecurrentOp, LSTMOp, GRUOp
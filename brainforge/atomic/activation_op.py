@@ -1,7 +1,6 @@
 import numpy as np
 
-from ..util.typing import scalX, zX_like
-from ..config import floatX
+from ..util.typing import scalX
 
 s0 = scalX(0.)
 s05 = scalX(0.5)
@@ -9,17 +8,25 @@ s1 = scalX(1.)
 s2 = scalX(2.)
 
 
+def _output(X, out):
+    return np.empty_like(X) if out is None else out
+
+
 class ActivationFunction:
 
+    """Elementwise nonlinearity. forward and backward write into out if it is given,
+    which may be the input array itself for an in-place evaluation. Activations with a
+    constant slope return it from backward as a scalar and leave out untouched."""
+
     type = ""
 
-    def forward(self, Z: np.ndarray) -> np.ndarray:
+    def forward(self, Z: np.ndarray, out=None) -> np.ndarray:
         raise NotImplementedError
     
     def __str__(self):
         return self.type
 
-    def backward(self, Z: np.ndarray) -> np.ndarray:
+    def backward(self, A: np.ndarray, out=None) -> np.ndarray:
         raise NotImplementedError
 
 
@@ -27,56 +34,69 @@ class Sigmoid(ActivationFunction):
 
     type = "sigmoid"
 
-    def forward(self, Z: np.ndarray):
-        return s1 / (s1 + np.exp(-Z))
+    def forward(self, Z: np.ndarray, out=None):
+        out = np.negative(Z, out=out)
+        np.exp(out, out=out)
+        out += s1
+        return np.reciprocal(out, out=out)
     
-    def backward(self, A: np.ndarray) -> np.ndarray:
-        return A * (s1 - A)
+    def backward(self, A: np.ndarray, out=None) -> np.ndarray:
+        return np.multiply(A, s1 - A, out=out)
 
 
 class HardSigmoid(ActivationFunction):
 
     type = "hardsigmoid"
 
-    def forward(self, Z: np.ndarray):
-        return np.clip((Z+s1)*s05, s0, s1)
+    def forward(self, Z: np.ndarray, out=None):
+        out = np.add(Z, s1, out=out)
+        out *= s05
+        return np.clip(out, s0, s1, out=out)
 
-    def backward(self, A: np.ndarray):
-        mask = zX_like(A)
-        mask[np.logical_and(A > 0., A < 1.)] = s05
-        return A * mask
+    def backward(self, A: np.ndarray, out=None):
+        # The slope is 0.5 inside the linear region 0 < A < 1, that is where |A - 0.5| < 0.5
+        out = np.subtract(A, s05, out=out)
+        np.abs(out, out=out)
+        np.less(out, s05, out=out)
+        out *= s05
+        return out
 
 
 class Tanh(ActivationFunction):
 
     type = "tanh"
 
-    def forward(self, Z) -> np.ndarray:
-        return np.tanh(Z)
+    def forward(self, Z, out=None) -> np.ndarray:
+        return np.tanh(Z, out=out)
     
-    def backward(self, A: np.ndarray) -> np.ndarray:
-        return s1 - A**2
+    def backward(self, A: np.ndarray, out=None) -> np.ndarray:
+        out = np.square(A, out=out)
+        return np.subtract(s1, out, out=out)
 
 
 class Sqrt(ActivationFunction):
 
     type = "sqrt"
 
-    def forward(self, Z) -> np.ndarray:
-        return np.sqrt(Z)
+    def forward(self, Z, out=None) -> np.ndarray:
+        return np.sqrt(Z, out=out)
     
-    def backward(self, A: np.ndarray) -> np.ndarray:
-        return s1 / (s2*A)
+    def backward(self, A: np.ndarray, out=None) -> np.ndarray:
+        out = np.multiply(A, s2, out=out)
+        return np.reciprocal(out, out=out)
 
 
 class Linear(ActivationFunction):
 
     type = "linear"
 
-    def forward(self, Z) -> np.ndarray:
-        return Z
+    def forward(self, Z, out=None) -> np.ndarray:
+        if out is None or out is Z:
+            return Z
+        out[...] = Z
+        return out
     
-    def backward(self, Z) -> np.ndarray:
+    def backward(self, Z, out=None):
         return s1
 
 
@@ -84,11 +104,11 @@ class ReLU(ActivationFunction):
 
     type = "relu"
 
-    def forward(self, Z) -> np.ndarray:
-        return np.maximum(s0, Z)
+    def forward(self, Z, out=None) -> np.ndarray:
+        return np.maximum(Z, s0, out=out)
     
-    def backward(self, A) -> np.ndarray:
-        return (A > 0.).astype(A.dtype)
+    def backward(self, A, out=None) -> np.ndarray:
+        return np.greater(A, s0, out=_output(A, out))
 
 
 class LeakyReLU(ActivationFunction):
@@ -98,18 +118,20 @@ class LeakyReLU(ActivationFunction):
     def __init__(self, alpha=0.3):
         self.alpha = alpha
 
-    def forward(self, Z: np.ndarray) -> np.ndarray:
-        output = np.empty_like(Z)
-        p = Z > 0.
-        n = ~p
-        output[p] = Z[p]
-        output[n] = self.alpha * Z[n]
-        return output
+    def forward(self, Z: np.ndarray, out=None) -> np.ndarray:
+        if out is Z:
+            # Z itself is overwritten, so only its negative entries are scaled
+            return np.multiply(Z, self.alpha, out=Z, where=Z < s0)
+        # max(Z, alpha*Z) for alpha < 1, min(Z, alpha*Z) otherwise, alpha*Z is computed in out
+        out = np.multiply(Z, self.alpha, out=_output(Z, out))
+        select = np.maximum if self.alpha <= 1. else np.minimum
+        return select(Z, out, out=out)
 
-    def backward(self, A: np.ndarray) -> np.ndarray:
-        J = np.ones_like(A)
-        J[A <= 0.] = self.alpha
-        return J
+    def backward(self, A: np.ndarray, out=None) -> np.ndarray:
+        out = np.greater(A, s0, out=_output(A, out))
+        out *= s1 - self.alpha
+        out += self.alpha
+        return out
 
 
 class SoftMax(ActivationFunction):
@@ -117,27 +139,31 @@ class SoftMax(ActivationFunction):
     type = "softmax"
 
     def __init__(self, temperature=1.):
+        self.temperature = None
         if temperature != 1.:
             self.temperature = scalX(temperature)
-            self.__call__ = self.tn
-
-    def tn(self, Z):
-        return self.t1(Z / self.temperature)
 
     @staticmethod
-    def t1(Z) -> np.ndarray:
-        eZ = np.exp(Z - Z.max(axis=1, keepdims=True))
-        return eZ / np.sum(eZ, axis=1, keepdims=True)
-
-    forward = t1
-
-    def backward(self, A: np.ndarray) -> np.ndarray:
+    def t1(Z, out=None) -> np.ndarray:
+        out = np.subtract(Z, Z.max(axis=1, keepdims=True), out=out)
+        np.exp(out, out=out)
+        out /= np.sum(out, axis=1, keepdims=True)
+        return out
+
+    def forward(self, Z, out=None):
+        if self.temperature is not None:
+            out = np.divide(Z, self.temperature, out=out)
+            return self.t1(out, out=out)
+        return self.t1(Z, out=out)
+
+    def backward(self, A: np.ndarray, out=None):
+        # The derivative is folded into the cross-entropy cost
         return s1
 
     @staticmethod
     def true_backward(A: np.ndarray):
         # TODO: test this with numerical gradient testing!
-        I = np.eye(A.shape[1], dtype=floatX)
+        I = np.eye(A.shape[1], dtype=A.dtype)
         idx, idy = np.diag_indices(I)
         return A * (A[..., None] - I[None, ...])[:, idx, idy]
 
@@ -146,12 +172,16 @@ class OnePlus(ActivationFunction):
 
     type = "oneplus"
 
-    def forward(self, Z):
-        return 1. + np.log(1. + np.exp(Z))
+    def forward(self, Z, out=None):
+        out = np.logaddexp(s0, Z, out=out)
+        out += s1
+        return out
     
-    def backward(self, Z: np.ndarray):
-        eZ = np.exp(Z)
-        return eZ / (eZ + 1.)
+    def backward(self, Z: np.ndarray, out=None):
+        out = np.negative(Z, out=out)
+        np.exp(out, out=out)
+        out += s1
+        return np.reciprocal(out, out=out)
 
 
 activations = {"sigmoid": Sigmoid, "tanh": Tanh, "sqrt": Sqrt,
@@ -1,152 +1,384 @@
 import numpy as np
 
 from .activation_op import activations
-from ..util.typing import zX, zX_like, scalX
+from ..util.typing import zX, scalX
 
 sigmoid = activations["sigmoid"]()
 s0 = scalX(0.)
 
 
-class RecurrentOp:
+def _project_inputs(X, Wx, b):
+    """X.Wx + b for every timestep as a single GEMM, the input half of the recurrence has no time dependency"""
+    time, batch, indim = X.shape
+    P = np.dot(X.reshape(time*batch, indim), Wx).reshape(time, batch, Wx.shape[-1])
+    P += b
+    return P
 
-    def __init__(self, activation):
-        self.actfn = activations[activation]()
 
-    def forward(self, X, W, b):
-        outdim = W.shape[-1]
-        time, batch, indim = X.shape
+def _sequence_dot(A, B):
+    """The sum of A[t].T.B[t] over all timesteps as a single GEMM"""
+    return np.dot(A.reshape(-1, A.shape[-1]).T, B.reshape(-1, B.shape[-1]))
 
-        Z = zX(time, batch, indim+outdim)
-        O = zX(time, batch, outdim)
 
-        for t in range(time):
-            Z[t] = np.concatenate((X[t], O[t-1]), axis=-1)
-            O[t] = self.actfn.forward(np.dot(Z[t], W) + b)
+def _backproject(X, dP, W, nablaW):
+    """Input gradient and the input half of nablaW from the preactivation deltas of all timesteps.
 
-        return O, Z
+    nablaW is filled in place, the input gradient is returned."""
+    time, batch, indim = X.shape
+    flatdP = dP.reshape(time*batch, -1)
+    nablaW[:indim] = np.dot(X.reshape(time*batch, indim).T, flatdP)
+    return np.dot(flatdP, W[:indim].T).reshape(time, batch, indim)
 
-    def backward(self, Z, O, E, W):
-        outdim = W.shape[-1]
-        time, batch, zdim = Z.shape
-        indim = zdim - outdim
 
-        bwO = self.actfn.backward(O)
+def _hidden_gradient(O, dP, h0):
+    """The hidden half of nablaW, the first timestep sees the initial state h0"""
+    return _sequence_dot(O[:-1], dP[1:]) + np.dot(h0.T, dP[0])
 
-        for t in range(time-1, -1, -1):
-            E[t] *= bwO[t]
-            deltaZ = np.dot(E[t], W.T)
-            E[t-1] += deltaZ[:, indim:] if t else 0.
 
-        dX = E[:, :, :indim]
-        nablaW = np.matmul(Z.transpose(0, 2, 1), E).sum(axis=0)
-        nablab = E.sum(axis=(0, 1))
-        return dX, nablaW, nablab
+def _activation_backward(actfn, A, out):
+    """Writes the derivative of actfn at A into out, also for activations returning a constant slope"""
+    slope = actfn.backward(A, out=out)
+    if slope is not out:
+        out[...] = slope
 
 
-class LSTMOp:
+def _initial_state(state, n, batch, outdim, dtype):
+    """The carried state arrays in the dtype of the computation, zeros if there is no carried state"""
+    if state is None:
+        return tuple(zX(n, batch, outdim, dtype=dtype))
+    return tuple(np.asarray(s, dtype=dtype) for s in state)
 
-    def __init__(self, activation):
-        self.actfn = activations[activation]()
 
-    def forward(self, X, W, b):
-        outdim = W.shape[-1] // 4
-        time, batch, indim = X.shape
+def lstm_preactivations(X, O, W, b, h0):
+    """The gate preactivations of every timestep, recomputed from the outputs of a finished forward pass.
 
-        Z = zX(time, batch, indim+outdim)
-        O = zX(time, batch, outdim)
-        C, f, i, o, cand, Ca = zX(6, time, batch, outdim)
+    Both halves are single GEMMs, O[t-1] (h0 at the first timestep) is the state each timestep saw."""
+    indim, outdim = X.shape[-1], O.shape[-1]
+    G = _project_inputs(X, W[:indim], b)
+    H = np.concatenate((h0[None].astype(O.dtype), O[:-1]))
+    G += np.dot(H.reshape(-1, outdim), W[indim:]).reshape(G.shape)
+    return G
 
-        for t in range(time):
-            Z[t] = np.concatenate((X[t], O[t-1]), axis=-1)
 
-            p = np.dot(Z[t], W) + b
-            p[:, :outdim] = self.actfn.forward(p[:, :outdim])
-            p[:, outdim:] = sigmoid.forward(p[:, outdim:])
+def active_rows(lengths, time, batch):
+    """The number of sequences still running at each timestep.
 
-            cand[t] = p[:, :outdim]
-            f[t] = p[:, outdim:2*outdim]
-            i[t] = p[:, 2*outdim:3*outdim]
-            o[t] = p[:, 3*outdim:]
-            # cand[t], f[t], i[t], o[t] = np.split(p, 4, axis=1)
+    The lengths must be sorted in descending order, so the running sequences are always the
+    leading rows of the batch. Without lengths every sequence runs for all timesteps."""
+    if lengths is None:
+        return np.full(time, batch, dtype=int)
+    return (np.asarray(lengths)[None, :] > np.arange(time)[:, None]).sum(axis=1)
 
-            C[t] = C[t-1] * f[t] + cand[t] * i[t]
 
-            Ca[t] = self.actfn.forward(C[t])
-            O[t] = Ca[t] * o[t]
+class RecurrentOp:
 
-        return O, Z, np.stack((C, Ca, cand, f, i, o))
+    """Simple recurrence, h = f(X.Wx + h.Wh + b).
 
-    def backward(self, Z, O, E, W, cache):
-        outdim = W.shape[-1] // 4
-        time, batch, zdim = Z.shape
-        indim = zdim - outdim
+    The optional state is a tuple (h0,) holding the hidden state the sequence starts from.
+    The optional lengths (sorted in descending order) mask the padding at the end of shorter
+    sequences: their state is carried through the padded timesteps unchanged and nothing is
+    computed there. Deltas arriving at the carried state flow back to the end of the sequence."""
 
-        C, Ca, cand, f, i, o = cache
-        bwgates = np.concatenate(cache[2:], axis=-1)
-        bwgates[..., outdim:] = sigmoid.backward(bwgates[..., outdim:])
-        bwgates[..., :outdim] = self.actfn.backward(bwgates[..., :outdim])
-        bwCa = np.atleast_2d(self.actfn.backward(Ca))
+    def __init__(self, activation):
+        self.actfn = activations[activation]()
 
-        deltaC = zX_like(O[-1])
-        deltaZ = zX_like(Z)
-        dgates = zX(time, batch, outdim*4)
+    def forward(self, X, W, b, state=None, lengths=None):
+        indim = X.shape[-1]
+        Wh = W[indim:]
+        O = _project_inputs(X, W[:indim], b)
+        h0, = _initial_state(state, 1, *O.shape[1:], dtype=O.dtype)
+        active = active_rows(lengths, *O.shape[:2])
+        p = np.empty_like(O[0])
 
-        for t in range(time-1, -1, -1):
-            deltaC += E[t] * o[t] * bwCa[t]
+        for t, n in enumerate(active):
+            h = O[t-1] if t else h0
+            O[t, :n] += np.dot(h[:n], Wh, out=p[:n])
+            self.actfn.forward(O[t, :n], out=O[t, :n])
+            O[t, n:] = h[n:]
 
-            dcand = deltaC * i[t]
-            df = deltaC * (C[t-1] if t else s0)
-            di = deltaC * cand[t]
-            do = Ca[t] * E[t]
+        return O
 
-            dgates[t] = np.concatenate((dcand, df, di, do), axis=-1) * bwgates[t]
+    def predict(self, X, W, b, return_seq=False, state=None, lengths=None):
+        """Forward pass keeping only the output sequence or the last output, and the final state"""
+        time, batch, indim = X.shape
+        XW = _project_inputs(X, W[:indim], b)
+        Wh = W[indim:]
+        # Without return_seq only the last state is returned, no output sequence is allocated
+        O = zX(time, batch, W.shape[-1], dtype=XW.dtype) if return_seq else None
+        h0, = _initial_state(state, 1, batch, W.shape[-1], dtype=XW.dtype)
+        h, p = h0.astype(XW.dtype), np.empty_like(XW[0])
+        for t, n in enumerate(active_rows(lengths, time, batch)):
+            np.dot(h[:n], Wh, out=p[:n])
+            p[:n] += XW[t, :n]
+            self.actfn.forward(p[:n], out=p[:n])
+            p[n:] = h[n:]
+            # The previous state is no longer needed, its array becomes the next preactivation buffer
+            h, p = p, h
+            if return_seq:
+                O[t] = h
+        return (O if return_seq else h), (h,)
+
+    def backward(self, X, O, E, W, state=None, lengths=None):
+        indim = X.shape[-1]
+        Wh = W[indim:]
+        h0, = _initial_state(state, 1, *O.shape[1:], dtype=O.dtype)
+        active = active_rows(lengths, *O.shape[:2])
+
+        # E is turned into the preactivation deltas in place
+        bwO = self.actfn.backward(O)
+        dh = np.empty(E.shape[1:], dtype=np.result_type(E, W))
+        for t in range(len(E)-1, -1, -1):
+            n = active[t]
+            if t:
+                # The carried state of finished sequences passes its delta on unchanged
+                E[t-1, n:] += E[t, n:]
+            E[t, n:] = s0
+            E[t, :n] *= bwO[t, :n]
+            if t:
+                E[t-1, :n] += np.dot(E[t, :n], Wh.T, out=dh[:n])
+
+        nablaW = np.empty(W.shape, dtype=dh.dtype)
+        nablaW[indim:] = _hidden_gradient(O, E, h0)
+        dX = _backproject(X, E, W, nablaW)
+        nablab = E.sum(axis=(0, 1))
+        return dX, nablaW, nablab
 
-            deltaC *= f[t]
 
-            deltaZ[t] = np.dot(dgates[t], W.T)
-            E[t-1] += deltaZ[t, :, indim:] if t else s0
+class LSTMOp:
 
-        nablaW = np.matmul(Z.transpose(0, 2, 1), dgates).sum(axis=0)
-        nablab = np.sum(dgates, axis=(0, 1))
-        deltaX = deltaZ[:, :, :indim]
-        return deltaX, nablaW, nablab
+    """LSTM with the gates ordered as candidate, forget, input, output.
 
-    def backward_o(self, Z, O, E, W, cache):
-        C, f, i, o, cand, Ca = cache
-        outdim = W.shape[-1] // 4
-        time, batch, zdim = Z.shape
-        indim = zdim - outdim
+    The cache of the forward pass is (C, Ca, G): the cell states, the activated cell states
+    and the activated gates of every timestep. The optional state is a tuple (h0, C0) of the
+    output and cell state the sequence starts from, lengths are handled like in RecurrentOp.
 
-        bwgates = np.concatenate((f, i, o, cand), axis=-1)
-        bwgates[:, :, :-outdim] = sigmoid.backward(bwgates[:, :, :-outdim])
-        bwgates[:, :, -outdim:] = self.actfn.backward(bwgates[:, :, -outdim:])
-        bwCa = self.actfn.backward(Ca)
+    With checkpoint set the cache is only (C,), backward recomputes the gates from the outputs
+    and the biases, which must be passed to it then."""
 
-        nablaW = zX_like(W)
-        nablab = zX(outdim*4)
+    def __init__(self, activation, checkpoint=False):
+        self.actfn = activations[activation]()
+        self.checkpoint = checkpoint
 
-        delta = zX_like(O[-1])
-        deltaC = zX_like(O[-1])
-        deltaX = zX(time, batch, indim)
-        dgates = zX(time, batch, outdim*4)
+    def forward(self, X, W, b, state=None, lengths=None):
+        indim = X.shape[-1]
+        outdim = W.shape[-1] // 4
+        Wh = W[indim:]
+
+        G = _project_inputs(X, W[:indim], b)
+        time, batch = G.shape[:2]
+        h0, C0 = _initial_state(state, 2, batch, outdim, dtype=G.dtype)
+        O = zX(time, batch, outdim, dtype=G.dtype)
+        C = zX(time, batch, outdim, dtype=G.dtype)
+        Ca = zX(time, batch, outdim, dtype=G.dtype)
+        p = np.empty_like(G[0])
+
+        for t, n in enumerate(active_rows(lengths, time, batch)):
+            h, Cprev = (O[t-1], C[t-1]) if t else (h0, C0)
+            G[t, :n] += np.dot(h[:n], Wh, out=p[:n])
+            cand, f, i, o = np.split(G[t, :n], 4, axis=1)
+            self.actfn.forward(cand, out=cand)
+            sigmoid.forward(G[t, :n, outdim:], out=G[t, :n, outdim:])
+
+            np.multiply(cand, i, out=C[t, :n])
+            C[t, :n] += Cprev[:n] * f
+
+            self.actfn.forward(C[t, :n], out=Ca[t, :n])
+            np.multiply(Ca[t, :n], o, out=O[t, :n])
+            O[t, n:] = h[n:]
+            C[t, n:] = Cprev[n:]
+
+        if self.checkpoint:
+            return O, (C,)
+        return O, (C, Ca, G)
+
+    def _recompute(self, X, O, W, b, C, h0):
+        """The (C, Ca, G) cache of forward, only the rows of running sequences are exact"""
+        outdim = O.shape[-1]
+        G = lstm_preactivations(X, O, W, b, h0)
+        self.actfn.forward(G[..., :outdim], out=G[..., :outdim])
+        sigmoid.forward(G[..., outdim:], out=G[..., outdim:])
+        return C, self.actfn.forward(C), G
+
+    def predict(self, X, W, b, return_seq=False, state=None, lengths=None):
+        """Forward pass without the gate cache, only the cell state and the output are carried"""
+        outdim = W.shape[-1] // 4
+        time, batch, indim = X.shape
+        XW = _project_inputs(X, W[:indim], b)
+        Wh = W[indim:]
+        O = zX(time, batch, outdim, dtype=XW.dtype) if return_seq else None
+        h, C = (s.astype(XW.dtype) for s in _initial_state(state, 2, batch, outdim, dtype=XW.dtype))
+        Ca = np.empty_like(C)
+        P = np.empty((batch, outdim*4), dtype=XW.dtype)
+        for t, n in enumerate(active_rows(lengths, time, batch)):
+            p = P[:n]
+            np.dot(h[:n], Wh, out=p)
+            p += XW[t, :n]
+            cand, f, i, o = np.split(p, 4, axis=1)
+            self.actfn.forward(cand, out=cand)
+            sigmoid.forward(p[:, outdim:], out=p[:, outdim:])
+            C[:n] *= f
+            C[:n] += cand * i
+            self.actfn.forward(C[:n], out=Ca[:n])
+            np.multiply(Ca[:n], o, out=h[:n])
+            if return_seq:
+                O[t] = h
+        return (O if return_seq else h), (h, C)
+
+    def backward(self, X, O, E, W, cache, state=None, lengths=None, b=None):
+        indim = X.shape[-1]
+        outdim = W.shape[-1] // 4
+        Wh = W[indim:]
+        h0, C0 = _initial_state(state, 2, *O.shape[1:], dtype=O.dtype)
+        if len(cache) == 1:
+            cache = self._recompute(X, O, W, b, cache[0], h0)
+        C, Ca, G = cache
+        active = active_rows(lengths, *O.shape[:2])
+
+        # The gate derivatives are multiplied with the incoming deltas in place, giving the preactivation deltas
+        dG = sigmoid.backward(G)
+        _activation_backward(self.actfn, G[..., :outdim], dG[..., :outdim])
+        bwCa = np.broadcast_to(self.actfn.backward(Ca), Ca.shape)
+
+        deltaC = np.zeros_like(O[-1])
+        dh = np.empty(O.shape[1:], dtype=np.result_type(dG, W))
+
+        for t in range(len(G)-1, -1, -1):
+            n = active[t]
+            if t:
+                # The carried state of finished sequences passes its delta on unchanged
+                E[t-1, n:] += E[t, n:]
+            dG[t, n:] = s0
+
+            cand, f, i, o = np.split(G[t, :n], 4, axis=1)
+            dcand, df, di, do = np.split(dG[t, :n], 4, axis=1)
+            dC = deltaC[:n]
+
+            dC += E[t, :n] * o * bwCa[t, :n]
+
+            dcand *= dC
+            dcand *= i
+            df *= dC
+            df *= C[t-1, :n] if t else C0[:n]
+            di *= dC
+            di *= cand
+            do *= Ca[t, :n]
+            do *= E[t, :n]
+
+            dC *= f
+            if t:
+                E[t-1, :n] += np.dot(dG[t, :n], Wh.T, out=dh[:n])
+
+        nablaW = np.empty(W.shape, dtype=dh.dtype)
+        nablaW[indim:] = _hidden_gradient(O, dG, h0)
+        dX = _backproject(X, dG, W, nablaW)
+        nablab = dG.sum(axis=(0, 1))
+        return dX, nablaW, nablab
 
-        for t in range(time-1, -1, -1):
-            E[t] += delta
-            deltaC += E[t] * o[t] * bwCa[t]
-            state_yesterday = 0. if not t else C[t-1]
-            df = state_yesterday * deltaC
-            di = cand[t] * deltaC
-            do = Ca[t] * E[t]
-            dcand = i[t] * deltaC
 
-            dgates[t] = np.concatenate((df, di, do, dcand), axis=-1) * bwgates[t]
+class GRUOp:
 
-            deltaC *= f[t]
+    """GRU with the gates ordered as update, reset, candidate.
 
-            nablaW += np.dot(Z[t].T, dgates[t])
-            nablab += np.sum(dgates[t], axis=0)
+    The candidate sees the reset-gated state, h = U * h + (1 - U) * f(X.Wx + (R * h).Wh + b).
+    The cache of the forward pass is G, the activated gates of every timestep.
+    The optional state is a tuple (h0,) holding the hidden state the sequence starts from,
+    lengths are handled like in RecurrentOp."""
 
-            deltaZ = np.dot(dgates[t], W.T)
-            deltaX[t] = deltaZ[:, :-outdim]
+    def __init__(self, activation):
+        self.actfn = activations[activation]()
 
-        return deltaX, nablaW, nablab
+    @staticmethod
+    def _split_weights(W, indim):
+        outdim = W.shape[-1] // 3
+        return np.ascontiguousarray(W[indim:, :2*outdim]), np.ascontiguousarray(W[indim:, 2*outdim:])
+
+    def forward(self, X, W, b, state=None, lengths=None):
+        indim = X.shape[-1]
+        outdim = W.shape[-1] // 3
+        Wur, Wo = self._split_weights(W, indim)
+
+        G = _project_inputs(X, W[:indim], b)
+        h0, = _initial_state(state, 1, G.shape[1], outdim, dtype=G.dtype)
+        O = zX(*G.shape[:2], outdim, dtype=G.dtype)
+
+        for t, n in enumerate(active_rows(lengths, *G.shape[:2])):
+            h = O[t-1] if t else h0
+            U, R, cand = np.split(G[t, :n], 3, axis=1)
+            UR = G[t, :n, :2*outdim]
+            UR += np.dot(h[:n], Wur)
+            sigmoid.forward(UR, out=UR)
+            cand += np.dot(R * h[:n], Wo)
+            self.actfn.forward(cand, out=cand)
+
+            # h = U * h + (1 - U) * cand, written as cand + U * (h - cand)
+            np.subtract(h[:n], cand, out=O[t, :n])
+            O[t, :n] *= U
+            O[t, :n] += cand
+            O[t, n:] = h[n:]
+
+        return O, G
+
+    def predict(self, X, W, b, return_seq=False, state=None, lengths=None):
+        """Forward pass without the gate cache, only the state is carried"""
+        time, batch, indim = X.shape
+        outdim = W.shape[-1] // 3
+        Wur, Wo = self._split_weights(W, indim)
+        XW = _project_inputs(X, W[:indim], b)
+        O = zX(time, batch, outdim, dtype=XW.dtype) if return_seq else None
+        h0, = _initial_state(state, 1, batch, outdim, dtype=XW.dtype)
+        h = h0.astype(XW.dtype)
+        for t, n in enumerate(active_rows(lengths, time, batch)):
+            hn = h[:n]
+            UR = sigmoid.forward(XW[t, :n, :2*outdim] + np.dot(hn, Wur))
+            U, R = np.split(UR, 2, axis=1)
+            cand = self.actfn.forward(XW[t, :n, 2*outdim:] + np.dot(R * hn, Wo))
+            hn -= cand
+            hn *= U
+            hn += cand
+            if return_seq:
+                O[t] = h
+        return (O if return_seq else h), (h,)
+
+    def backward(self, X, O, E, W, cache, state=None, lengths=None):
+        indim = X.shape[-1]
+        outdim = W.shape[-1] // 3
+        Wur, Wo = self._split_weights(W, indim)
+        G = cache
+        h0, = _initial_state(state, 1, *O.shape[1:], dtype=O.dtype)
+        active = active_rows(lengths, *O.shape[:2])
+
+        # The gate derivatives are multiplied with the incoming deltas in place, giving the preactivation deltas
+        dG = sigmoid.backward(G)
+        _activation_backward(self.actfn, G[..., 2*outdim:], dG[..., 2*outdim:])
+        dh = np.zeros(O.shape[1:], dtype=np.result_type(dG, W))
+
+        for t in range(len(G)-1, -1, -1):
+            n = active[t]
+            # The carried state of finished sequences passes its delta on unchanged in dh
+            dG[t, n:] = s0
+            h = (O[t-1] if t else h0)[:n]
+            U, R, cand = np.split(G[t, :n], 3, axis=1)
+            dU, dR, dcand = np.split(dG[t, :n], 3, axis=1)
+            dh += E[t]
+            dhn = dh[:n]
+
+            dU *= dhn
+            dU *= h - cand
+            dcand *= dhn
+            dcand *= 1. - U
+
+            dK = np.dot(dcand, Wo.T)
+            dR *= dK
+            dR *= h
+            if t:
+                dhn *= U
+                dhn += dK * R
+                dhn += np.dot(dG[t, :n, :2*outdim], Wur.T)
+
+        K = G[:, :, outdim:2*outdim] * np.concatenate((h0[None], O[:-1]))
+        nablaW = np.empty(W.shape, dtype=dh.dtype)
+        nablaW[indim:, :2*outdim] = _hidden_gradient(O, dG[..., :2*outdim], h0)
+        nablaW[indim:, 2*outdim:] = _sequence_dot(K, dG[..., 2*outdim:])
+        dX = _backproject(X, dG, W, nablaW)
+        nablab = dG.sum(axis=(0, 1))
+        return dX, nablaW, nablab
@@ -1,122 +1,486 @@
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
-from ..util.typing import zX, zX_like
+from ..config import numeric
+
+
+def _receptive_fields(A, fy, fx, stride=1):
+    """Zero-copy sliding-window view of A with shape (im, ic, fy, fx, oy, ox)"""
+    im, ic, iy, ix = A.shape
+    oy, ox = (iy - fy) // stride + 1, (ix - fx) // stride + 1
+    sm, sc, sy, sx = A.strides
+    return as_strided(A, shape=(im, ic, fy, fx, oy, ox),
+                      strides=(sm, sc, sy, sx, sy*stride, sx*stride), writeable=False)
+
+
+def _receptive_fields_nhwc(A, fy, fx, stride=1):
+    """Zero-copy sliding-window view of channels-last A with shape (im, oy, ox, fy, fx, ic)"""
+    im, iy, ix, ic = A.shape
+    oy, ox = (iy - fy) // stride + 1, (ix - fx) // stride + 1
+    sm, sy, sx, sc = A.strides
+    return as_strided(A, shape=(im, oy, ox, fy, fx, ic),
+                      strides=(sm, sy*stride, sx*stride, sy, sx, sc), writeable=False)
+
+
+def check_layout(layout):
+    if layout not in ("NCHW", "NHWC"):
+        raise ValueError("Unsupported tensor layout: {}".format(layout))
+    return layout
+
+
+def spatial_shape(shape, layout="NCHW"):
+    """(iy, ix) of an image tensor or image shape in the given layout"""
+    return tuple(shape[-3:-1]) if layout == "NHWC" else tuple(shape[-2:])
+
+
+def conv_padding(mode, fy, fx, iy, ix, stride=1):
+    """Resolves a padding mode to ((top, bottom), (left, right)) zero-padding.
+
+    mode can be "valid", "same", "full", an int or a (py, px) tuple of ints.
+    "same" produces ceil(input / stride) outputs, padding more at the bottom/right
+    if the required padding is odd."""
+    if mode == "valid":
+        return (0, 0), (0, 0)
+    if mode == "full":
+        return (fy - 1, fy - 1), (fx - 1, fx - 1)
+    if mode == "same":
+        py = max((-(-iy // stride) - 1) * stride + fy - iy, 0)
+        px = max((-(-ix // stride) - 1) * stride + fx - ix, 0)
+        return (py // 2, py - py // 2), (px // 2, px - px // 2)
+    if isinstance(mode, (int, np.integer)):
+        mode = mode, mode
+    if isinstance(mode, (tuple, list)) and len(mode) == 2:
+        py, px = map(int, mode)
+        return (py, py), (px, px)
+    raise ValueError("Unsupported padding mode: {}".format(mode))
+
+
+def pad_input(A, pady, padx, layout="NCHW"):
+    if not any(pady + padx):
+        return A
+    pad_width = ((0, 0), pady, padx, (0, 0)) if layout == "NHWC" else ((0, 0), (0, 0), pady, padx)
+    return np.pad(A, pad_width=pad_width, mode="constant", constant_values=0.)
+
+
+def dilate(E, stride, oy, ox):
+    """Spreads E out to (oy, ox) by inserting stride-1 zeros between its elements"""
+    if stride == 1 and E.shape[-2:] == (oy, ox):
+        return E
+    dE = np.zeros(E.shape[:2] + (oy, ox), dtype=E.dtype)
+    dE[:, :, :E.shape[2]*stride:stride, :E.shape[3]*stride:stride] = E
+    return dE
+
+
+def _col2im(cols, shape, stride=1):
+    """Scatter-adds unrolled receptive fields [im, ic, fy, fx, oy, ox] back into an image of shape"""
+    im, ic, fy, fx, oy, ox = cols.shape
+    A = np.zeros(shape, dtype=cols.dtype)
+    for i in range(fy):
+        for j in range(fx):
+            A[:, :, i:i + stride*oy:stride, j:j + stride*ox:stride] += cols[:, :, i, j]
+    return A
+
+
+def _col2im_nhwc(cols, shape, stride=1):
+    """Scatter-adds unrolled receptive fields [im, oy, ox, fy, fx, ic] back into a channels-last image"""
+    im, oy, ox, fy, fx, ic = cols.shape
+    A = np.zeros(shape, dtype=cols.dtype)
+    for i in range(fy):
+        for j in range(fx):
+            A[:, i:i + stride*oy:stride, j:j + stride*ox:stride] += cols[:, :, :, i, j]
+    return A
+
+
+def _correlate_im2col(A, F, stride=1):
+    im, ic, iy, ix = A.shape
+    nf, fc, fy, fx = F.shape
+    recfield_size = fx * fy * fc
+    oy, ox = (iy - fy) // stride + 1, (ix - fx) // stride + 1
+
+    # rfields: [im, fc*fy*fx, oy*ox], built in a single vectorized copy
+    rfields = _receptive_fields(A, fy, fx, stride).reshape(im, recfield_size, oy*ox)
+    Frsh = F.reshape(nf, recfield_size)
+
+    # [nf, K] @ [im, K, oy*ox] -> [im, nf, oy*ox], already in NCHW order
+    output = np.matmul(Frsh, rfields)
+    return output.reshape((im, nf, oy, ox))
+
+
+def _correlate_fft(A, F, stride=1):
+    im, ic, iy, ix = A.shape
+    nf, fc, fy, fx = F.shape
+
+    # Circular convolution over (iy, ix) is exact on the valid region,
+    # so no padding to (iy + fy - 1, ix + fx - 1) is needed.
+    shape = iy, ix
+    fA = np.fft.rfft2(A, s=shape)
+    fF = np.fft.rfft2(F[..., ::-1, ::-1], s=shape)
+
+    # For every frequency: [im, ic] @ [ic, nf] -> [im, nf]
+    fZ = np.matmul(fA.transpose(2, 3, 0, 1), fF.transpose(2, 3, 1, 0)).transpose(2, 3, 0, 1)
+    Z = np.fft.irfft2(fZ, s=shape)
+    return Z[:, :, fy-1::stride, fx-1::stride].astype(A.dtype, copy=False)
+
+
+def winograd_tiles(oy, ox):
+    """Number of 2x2 output tiles covering an (oy, ox) output"""
+    return (oy + 1) // 2, (ox + 1) // 2
+
+
+def _winograd_filter_transform(F):
+    """U = G g G^T for every 3x3 filter slice g, laid out as [4, 4, nf, fc]"""
+    g0, g1, g2 = F[:, :, 0], F[:, :, 1], F[:, :, 2]
+    Gg = np.stack((g0, (g0 + g1 + g2) * 0.5, (g0 - g1 + g2) * 0.5, g2), axis=2)
+    c0, c1, c2 = Gg[..., 0], Gg[..., 1], Gg[..., 2]
+    U = np.stack((c0, (c0 + c1 + c2) * 0.5, (c0 - c1 + c2) * 0.5, c2), axis=3)
+    return np.ascontiguousarray(U.transpose(2, 3, 0, 1), dtype=F.dtype)
+
+
+def _correlate_winograd(A, U):
+    """Winograd F(2x2, 3x3) valid correlation with a pre-transformed filter U"""
+    im, ic, iy, ix = A.shape
+    nf = U.shape[2]
+    oy, ox = iy - 2, ix - 2
+    ty, tx = winograd_tiles(oy, ox)
+    A = pad_input(A, (0, 2*ty + 2 - iy), (0, 2*tx + 2 - ix))
+
+    # d: [im, ic, ty, tx, 4, 4] overlapping input tiles with a step of 2
+    sm, sc, sy, sx = A.strides
+    d = as_strided(A, shape=(im, ic, ty, tx, 4, 4),
+                   strides=(sm, sc, 2*sy, 2*sx, sy, sx), writeable=False)
+
+    # V = B^T d B -> [4, 4, ic, im*ty*tx]
+    t = np.stack((d[..., 0, :] - d[..., 2, :], d[..., 1, :] + d[..., 2, :],
+                  d[..., 2, :] - d[..., 1, :], d[..., 1, :] - d[..., 3, :]))
+    V = np.stack((t[..., 0] - t[..., 2], t[..., 1] + t[..., 2],
+                  t[..., 2] - t[..., 1], t[..., 1] - t[..., 3]), axis=1)
+    V = V.transpose(0, 1, 3, 2, 4, 5).reshape(4, 4, ic, im*ty*tx)
+
+    # 16 independent GEMMs, one per tile element: [nf, ic] @ [ic, im*ty*tx]
+    M = np.matmul(U, V)
+
+    # Y = A^T M A -> [2, 2, nf, im*ty*tx]
+    t = np.stack((M[0] + M[1] + M[2], M[1] - M[2] - M[3]))
+    Y = np.stack((t[:, 0] + t[:, 1] + t[:, 2], t[:, 1] - t[:, 2] - t[:, 3]), axis=1)
+    Y = Y.reshape(2, 2, nf, im, ty, tx).transpose(3, 2, 4, 0, 5, 1)
+    return Y.reshape(im, nf, 2*ty, 2*tx)[:, :, :oy, :ox]
+
+
+def batch_chunks(m, sample_bytes, budget):
+    """Slices splitting a batch of m samples so that each chunk needs at most budget bytes.
+
+    A falsy budget disables chunking, a single sample is never split further."""
+    if not budget:
+        return [slice(0, m)]
+    size = int(max(1, min(m, budget // max(sample_bytes, 1))))
+    return [slice(start, min(start + size, m)) for start in range(0, m, size)]
+
+
+def chunked_backward(backward, X, E, chunks):
+    """Accumulates (dF, db, dX) of a backward pass evaluated chunk-by-chunk along the batch"""
+    dF, db, dX = backward(X[chunks[0]], E[chunks[0]])
+    dXs = [dX]
+    for chunk in chunks[1:]:
+        cdF, cdb, dX = backward(X[chunk], E[chunk])
+        dF += cdF
+        db += cdb
+        dXs.append(dX)
+    return dF, db, np.concatenate(dXs)
+
+
+def resolve_memory_budget(memory_budget=None):
+    """Bytes available for the unrolled input of a convolution, config.numeric.memory_budget is in MiB"""
+    if memory_budget is None:
+        memory_budget = int(numeric.memory_budget * 2**20)
+    return memory_budget
+
+
+class FilterTransformCache:
+
+    """Keeps transformed filters around until the filter values change"""
+
+    def __init__(self, transform, size=4):
+        self.transform = transform
+        self.size = size
+        self.entries = {}
+
+    def __call__(self, F):
+        key = F.__array_interface__["data"][0], F.shape, F.strides
+        entry = self.entries.get(key)
+        if entry is None or not np.array_equal(entry[0], F):
+            if len(self.entries) >= self.size:
+                self.entries.clear()
+            entry = self.entries[key] = F.copy(), self.transform(F)
+        return entry[1]
 
 
 class ConvolutionOp:
 
-    @staticmethod
-    def valid(A, F):
-        im, ic, iy, ix = A.shape
-        nf, fc, fy, fx = F.shape
-        # fx, fy, fc, nf = F.shape
-        recfield_size = fx * fy * fc
-        oy, ox = iy - fy + 1, ix - fx + 1
-        rfields = np.zeros((im, oy*ox, recfield_size))
-        Frsh = F.reshape(nf, recfield_size)
+    """Convolution (cross-correlation) of image batches with a filter bank.
+
+    In the default NCHW layout images are [m, c, y, x] and filters are [nf, c, fy, fx].
+    In the channels-last NHWC layout images are [m, y, x, c] and filters are stored
+    as [fy, fx, c, nf], so the im2col GEMM produces its output in place."""
+
+    algorithms = ("im2col", "fft", "winograd")
+    fft_threshold = 7
 
+    def __init__(self, algorithm="im2col", layout="NCHW", memory_budget=None):
+        if algorithm not in self.algorithms:
+            raise ValueError("Unsupported convolution algorithm: {}".format(algorithm))
+        if check_layout(layout) == "NHWC" and algorithm != "im2col":
+            raise ValueError("Only the im2col algorithm supports the NHWC layout!")
+        self.algorithm = algorithm
+        self.layout = layout
+        self.memory_budget = resolve_memory_budget(memory_budget)
+        self.transformed_filter = FilterTransformCache(_winograd_filter_transform)
+
+    @classmethod
+    def choose_algorithm(cls, fy, fx, layout="NCHW"):
+        if layout == "NHWC":
+            return "im2col"
+        return "fft" if max(fy, fx) >= cls.fft_threshold else "im2col"
+
+    def valid(self, A, F, stride=1):
+        ic, fc = A.shape[1], F.shape[1]
         if fc != ic:
             err = "Supplied filter (F) is incompatible with supplied input! (X)\n"
             err += "input depth: {} != {} :filter depth".format(ic, fc)
             raise ValueError(err)
+        if self.algorithm == "fft":
+            return _correlate_fft(A, F, stride)
+        if self.algorithm == "winograd" and F.shape[-2:] == (3, 3) and stride == 1:
+            return _correlate_winograd(A, self.transformed_filter(F))
+        return _correlate_im2col(A, F, stride)
 
-        for i, sy, sx in ((idx, shy, shx) for shx in range(ox) for shy in range(oy) for idx in range(im)):
-            rfields[i][sy*ox + sx] = A[i, :, sy:sy+fy, sx:sx+fx].ravel()
+    def full(self, A, F):
+        nf, fc, fy, fx = F.shape
+        py, px = fy - 1, fx - 1
+        return self.valid(pad_input(A, (py, py), (px, px)), F)
 
-        # output = np.zeros((im, oy*ox, nf))
-        # for m in range(im):
-        #     output[m] = np.dot(rfields[m], Frsh.T)
+    def batch_chunks(self, inshape, fshape, mode="valid", stride=1, itemsize=8):
+        """Splits the batch so the unrolled receptive fields of a chunk fit into the memory budget"""
+        nf = fshape[-1] if self.layout == "NHWC" else fshape[0]
+        oshape = self.outshape(inshape, fshape, mode, stride, self.layout)
+        sample_bytes = int(np.prod(oshape)) // nf * (int(np.prod(fshape)) // nf) * itemsize
+        return batch_chunks(inshape[0], sample_bytes, self.memory_budget)
 
-        output = np.matmul(rfields, Frsh.T)
-        output = output.transpose((0, 2, 1)).reshape((im, nf, oy, ox))
-        return output
+    def forward(self, A, F, mode="valid", stride=1):
+        chunks = self.batch_chunks(A.shape, F.shape, mode, stride, A.itemsize)
+        if len(chunks) == 1:
+            return self._forward(A, F, mode, stride)
+        return np.concatenate([self._forward(A[chunk], F, mode, stride) for chunk in chunks])
 
-    @staticmethod
-    def full(A, F):
+    def backward(self, X, E, F, mode="valid", stride=1):
+        chunks = self.batch_chunks(X.shape, F.shape, mode, stride, X.itemsize)
+        if len(chunks) == 1:
+            return self._backward(X, E, F, mode, stride)
+        return chunked_backward(lambda x, e: self._backward(x, e, F, mode, stride), X, E, chunks)
+
+    def _forward(self, A, F, mode="valid", stride=1):
+        if self.layout == "NHWC":
+            outshape = self.outshape(A.shape, F.shape, mode, stride, self.layout)
+            return self.forward_fields(self.receptive_fields(A, F, mode, stride), F, outshape)
         nf, fc, fy, fx = F.shape
-        py, px = fy - 1, fx - 1
-        pA = np.pad(A, pad_width=((0, 0), (0, 0), (py, py), (px, px)),
-                    mode="constant", constant_values=0.)
-        return ConvolutionOp.valid(pA, F)
+        pady, padx = conv_padding(mode, fy, fx, *A.shape[-2:], stride=stride)
+        return self.valid(pad_input(A, pady, padx), F, stride)
 
-    @staticmethod
-    def forward(A, F, mode="valid"):
-        if mode == "valid":
-            return ConvolutionOp.valid(A, F)
-        return ConvolutionOp.full(A, F)
+    def _backward(self, X, E, F, mode="valid", stride=1):
+        if self.layout == "NHWC":
+            return self.backward_fields(self.receptive_fields(X, F, mode, stride), E, F, X.shape, mode, stride)
+        nf, fc, fy, fx = F.shape
+        im, ic, iy, ix = X.shape
+        pady, padx = conv_padding(mode, fy, fx, iy, ix, stride=stride)
+        pX = pad_input(X, pady, padx)
+        py, px = pX.shape[-2:]
 
-    @staticmethod
-    def backward(X, E, F):
-        dF = ConvolutionOp.forward(
-            A=X.transpose(1, 0, 2, 3),
-            F=E.transpose(1, 0, 2, 3),
-            mode="valid"
+        # With E dilated to the stride-1 valid extent, both gradients come out exactly sized
+        dE = dilate(E, stride, py - fy + 1, px - fx + 1)
+        dF = self.valid(
+            A=pX.transpose(1, 0, 2, 3),
+            F=dE.transpose(1, 0, 2, 3)
         ).transpose(1, 0, 2, 3)
         db = E.sum(axis=(0, 2, 3), keepdims=True)
-        dX = ConvolutionOp.forward(
-            A=E,
-            F=F[:, :, ::-1, ::-1].transpose(1, 0, 2, 3),
-            mode="full"
+        dX = self.full(
+            A=dE,
+            F=F[:, :, ::-1, ::-1].transpose(1, 0, 2, 3)
         )
-        return dF, db, dX
+        return dF, db, dX[:, :, pady[0]:pady[0]+iy, padx[0]:padx[0]+ix]
+
+    def receptive_fields(self, A, F, mode="valid", stride=1):
+        """Unrolled receptive fields of the padded input.
+
+        [im, fc*fy*fx, oy*ox] in NCHW, [im, oy*ox, fy*fx*fc] in NHWC"""
+        if self.layout == "NHWC":
+            fy, fx, fc, nf = F.shape
+            pady, padx = conv_padding(mode, fy, fx, *A.shape[1:3], stride=stride)
+            rfields = _receptive_fields_nhwc(pad_input(A, pady, padx, self.layout), fy, fx, stride)
+            return rfields.reshape(len(A), -1, fy*fx*fc)
+        nf, fc, fy, fx = F.shape
+        pady, padx = conv_padding(mode, fy, fx, *A.shape[-2:], stride=stride)
+        return _receptive_fields(pad_input(A, pady, padx), fy, fx, stride).reshape(len(A), fc*fy*fx, -1)
+
+    def forward_fields(self, rfields, F, outshape):
+        if self.layout == "NHWC":
+            oy, ox, nf = outshape
+            im, P, K = rfields.shape
+            # [im*oy*ox, K] @ [K, nf] is already the [im, oy, ox, nf] output
+            return np.dot(rfields.reshape(im*P, K), F.reshape(K, nf)).reshape(im, oy, ox, nf)
+        nf, oy, ox = outshape
+        return np.matmul(F.reshape(nf, -1), rfields).reshape(-1, nf, oy, ox)
+
+    def backward_fields(self, rfields, E, F, inshape, mode="valid", stride=1):
+        """Backward pass reusing the receptive fields of the forward pass.
+
+        dF is a single (batched) GEMM against the cached fields,
+        dX is scattered back from the unrolled error with col2im."""
+        if self.layout == "NHWC":
+            return self._backward_fields_nhwc(rfields, E, F, inshape, mode, stride)
+        nf, fc, fy, fx = F.shape
+        im, ic, iy, ix = inshape
+        em, ec, oy, ox = E.shape
+        pady, padx = conv_padding(mode, fy, fx, iy, ix, stride=stride)
+
+        E3 = E.reshape(em, ec, oy*ox)
+        dF = np.matmul(E3, rfields.transpose(0, 2, 1)).sum(axis=0).reshape(F.shape)
+        db = E.sum(axis=(0, 2, 3), keepdims=True)
+        dcols = np.matmul(F.reshape(nf, -1).T, E3).reshape(im, fc, fy, fx, oy, ox)
+        dX = _col2im(dcols, (im, ic, iy + sum(pady), ix + sum(padx)), stride)
+        return dF, db, dX[:, :, pady[0]:pady[0]+iy, padx[0]:padx[0]+ix]
 
     @staticmethod
-    def outshape(inshape, fshape, mode="valid"):
-        ic, iy, ix = inshape[-3:]
-        fx, fy, fc, nf = fshape
-        if mode == "valid":
-            return nf, iy - fy + 1, ix - fx + 1
-        elif mode == "full":
-            return nf, iy + fy - 1, ix + fx - 1
+    def _backward_fields_nhwc(rfields, E, F, inshape, mode="valid", stride=1):
+        fy, fx, fc, nf = F.shape
+        im, iy, ix, ic = inshape
+        em, oy, ox, ec = E.shape
+        im, P, K = rfields.shape
+        pady, padx = conv_padding(mode, fy, fx, iy, ix, stride=stride)
+
+        E2 = E.reshape(im*P, nf)
+        dF = np.dot(rfields.reshape(im*P, K).T, E2).reshape(F.shape)
+        db = E2.sum(axis=0)
+        dcols = np.dot(E2, F.reshape(K, nf).T).reshape(im, oy, ox, fy, fx, fc)
+        dX = _col2im_nhwc(dcols, (im, iy + sum(pady), ix + sum(padx), ic), stride)
+        return dF, db, dX[:, pady[0]:pady[0]+iy, padx[0]:padx[0]+ix]
+
+    @staticmethod
+    def outshape(inshape, fshape, mode="valid", stride=1, layout="NCHW"):
+        if layout == "NHWC":
+            iy, ix, ic = inshape[-3:]
+            fy, fx, fc, nf = fshape
         else:
-            raise RuntimeError("Unsupported mode:", mode)
+            ic, iy, ix = inshape[-3:]
+            nf, fc, fy, fx = fshape
+        (pt, pb), (pl, pr) = conv_padding(mode, fy, fx, iy, ix, stride=stride)
+        oy, ox = (iy + pt + pb - fy) // stride + 1, (ix + pl + pr - fx) // stride + 1
+        return (oy, ox, nf) if layout == "NHWC" else (nf, oy, ox)
 
     def __str__(self):
         return "Convolution"
 
 
+class DepthwiseConvolutionOp:
+
+    """Correlates every input channel with its own filter, channels are not mixed.
+
+    Filters are [c, fy, fx] in the NCHW layout and [fy, fx, c] in the NHWC layout."""
+
+    def __init__(self, layout="NCHW"):
+        self.layout = check_layout(layout)
+
+    def _fields(self, A, fy, fx, mode, stride):
+        iy, ix = spatial_shape(A.shape, self.layout)
+        pady, padx = conv_padding(mode, fy, fx, iy, ix, stride=stride)
+        pA = pad_input(A, pady, padx, self.layout)
+        if self.layout == "NHWC":
+            return _receptive_fields_nhwc(pA, fy, fx, stride), pA.shape, pady, padx
+        return _receptive_fields(pA, fy, fx, stride), pA.shape, pady, padx
+
+    def forward(self, A, F, mode="valid", stride=1):
+        if self.layout == "NHWC":
+            fy, fx, fc = F.shape
+            rfields = self._fields(A, fy, fx, mode, stride)[0]
+            return np.einsum("myxijc,ijc->myxc", rfields, F, optimize=True)
+        fc, fy, fx = F.shape
+        rfields = self._fields(A, fy, fx, mode, stride)[0]
+        return np.einsum("mcijyx,cij->mcyx", rfields, F, optimize=True)
+
+    def backward(self, X, E, F, mode="valid", stride=1):
+        if self.layout == "NHWC":
+            fy, fx, fc = F.shape
+            im, iy, ix, ic = X.shape
+            rfields, pshape, pady, padx = self._fields(X, fy, fx, mode, stride)
+            dF = np.einsum("myxijc,myxc->ijc", rfields, E, optimize=True)
+            db = E.sum(axis=(0, 1, 2))
+            dX = _col2im_nhwc(E[:, :, :, None, None, :] * F, pshape, stride)
+            return dF, db, dX[:, pady[0]:pady[0]+iy, padx[0]:padx[0]+ix]
+        fc, fy, fx = F.shape
+        im, ic, iy, ix = X.shape
+        rfields, pshape, pady, padx = self._fields(X, fy, fx, mode, stride)
+        dF = np.einsum("mcijyx,mcyx->cij", rfields, E, optimize=True)
+        db = E.sum(axis=(0, 2, 3), keepdims=True)
+        dX = _col2im(E[:, :, None, None, :, :] * F[None, :, :, :, None, None], pshape, stride)
+        return dF, db, dX[:, :, pady[0]:pady[0]+iy, padx[0]:padx[0]+ix]
+
+    @staticmethod
+    def outshape(inshape, fshape, mode="valid", stride=1, layout="NCHW"):
+        if layout == "NHWC":
+            iy, ix, ic = inshape[-3:]
+            fy, fx, fc = fshape
+        else:
+            ic, iy, ix = inshape[-3:]
+            fc, fy, fx = fshape
+        (pt, pb), (pl, pr) = conv_padding(mode, fy, fx, iy, ix, stride=stride)
+        oy, ox = (iy + pt + pb - fy) // stride + 1, (ix + pl + pr - fx) // stride + 1
+        return (oy, ox, ic) if layout == "NHWC" else (ic, oy, ox)
+
+    def __str__(self):
+        return "DepthwiseConvolution"
+
+
+def pool_argmax_dtype(fdim):
+    """Smallest integer type able to index into a fdim x fdim pooling window"""
+    return np.int8 if fdim * fdim <= np.iinfo(np.int8).max else np.intp
+
+
 class MaxPoolOp:
 
+    def __init__(self, layout="NCHW"):
+        self.layout = check_layout(layout)
+
     def __str__(self):
         return "MaxPool"
 
-    @staticmethod
-    def predict(A):
-        return np.max([
-            A[:, :, 0::2, 0::2],
-            A[:, :, 0::2, 1::2],
-            A[:, :, 1::2, 0::2],
-            A[:, :, 1::2, 1::2],
-        ], axis=0)
-
-    @staticmethod
-    def forward(A, fdim):
+    def predict(self, A, fdim):
+        # Inference only needs the maxima, the argmax mask for backward is not computed
+        if self.layout == "NHWC":
+            im, iy, ix, ic = A.shape
+            return A.reshape(im, iy // fdim, fdim, ix // fdim, fdim, ic).max(axis=(2, 4))
         im, ic, iy, ix = A.shape
-        oy, ox = iy // fdim, ix // fdim
-        output = zX(im, ic, oy, ox)
-        filt = zX_like(A)
-        for m in range(im):
-            for c in range(ic):
-                for y, sy in enumerate(range(0, iy, fdim)):
-                    for x, sx in enumerate(range(0, ix, fdim)):
-                        recfield = A[m, c, sy:sy+fdim, sx:sx+fdim]
-                        value = recfield.max()
-                        output[m, c, y, x] = value
-                        ffield = np.equal(recfield, value)
-                        filt[m, c, sy:sy+fdim, sx:sx+fdim] += ffield
-        return output, filt
+        return A.reshape(im, ic, iy // fdim, fdim, ix // fdim, fdim).max(axis=(3, 5))
 
-    @staticmethod
-    def backward(E, filt):
+    def forward(self, A, fdim):
+        # windows: [im, ic, oy, ox, fdim*fdim] or [im, oy, ox, ic, fdim*fdim]
+        if self.layout == "NHWC":
+            im, iy, ix, ic = A.shape
+            windows = A.reshape(im, iy // fdim, fdim, ix // fdim, fdim, ic).transpose(0, 1, 3, 5, 2, 4)
+        else:
+            im, ic, iy, ix = A.shape
+            windows = A.reshape(im, ic, iy // fdim, fdim, ix // fdim, fdim).transpose(0, 1, 2, 4, 3, 5)
+        windows = windows.reshape(windows.shape[:4] + (fdim*fdim,))
+        argmax = windows.argmax(axis=-1)
+        output = np.take_along_axis(windows, argmax[..., None], axis=-1)[..., 0]
+        return output, argmax.astype(pool_argmax_dtype(fdim))
+
+    def backward(self, E, argmax, fdim):
+        dX = np.zeros(E.shape + (fdim*fdim,), dtype=E.dtype)
+        np.put_along_axis(dX, argmax[..., None].astype(np.intp), E[..., None], axis=-1)
+        dX = dX.reshape(E.shape + (fdim, fdim))
+        if self.layout == "NHWC":
+            em, ey, ex, ec = E.shape
+            return dX.transpose(0, 1, 4, 2, 5, 3).reshape(em, ey*fdim, ex*fdim, ec)
         em, ec, ey, ex = E.shape
-        fm, fc, fy, fx = filt.shape
-        fdim = fy // ey
-        for m in range(em):
-            for c in range(ec):
-                for i, y in enumerate(range(0, fy, fdim)):
-                    for j, x in enumerate(range(0, fx, fdim)):
-                        filt[m, c, y:y+fdim, x:x+fdim] *= E[m, c, i, j]
-        return filt
+        return dX.transpose(0, 1, 2, 4, 3, 5).reshape(em, ec, ey*fdim, ex*fdim)
 
     @staticmethod
     def outshape(inshape, fdim):
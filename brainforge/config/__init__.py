@@ -1,2 +1,2 @@
 from .parser import set_globals
-from .numeric import floatX, compiled
+from .numeric import floatX, compiled, parallel, threads, memory_budget
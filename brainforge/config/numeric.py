@@ -1,2 +1,5 @@
 floatX = "float64"
 compiled = False
+parallel = False
+threads = 0
+memory_budget = 512
@@ -19,6 +19,9 @@ def _create_configfile(cfg, path):
     cfg.add_section("numeric")
     cfg["numeric"]["floatX"] = "float64"
     cfg["numeric"]["compiled"] = "False"
+    cfg["numeric"]["parallel"] = "False"
+    cfg["numeric"]["threads"] = "0"
+    cfg["numeric"]["memory_budget"] = "512"
     with open(expanduser(path) + (".txt" if sys == "win32" else ""), "w") as handle:
         cfg.write(handle)
 
@@ -33,3 +36,6 @@ def set_globals():
     config.read([expanduser(configpath)], encoding="utf8")
     numeric.floatX = config["numeric"].get("floatX", "float64").lower()
     numeric.compiled = config["numeric"].get("compiled", "false").lower() == "true"
+    numeric.parallel = config["numeric"].get("parallel", "false").lower() == "true"
+    numeric.threads = int(config["numeric"].get("threads", "0"))
+    numeric.memory_budget = float(config["numeric"].get("memory_budget", "512"))
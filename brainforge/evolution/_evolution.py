@@ -2,7 +2,7 @@ import warnings
 
 import numpy as np
 
-from ..config.numeric import floatX
+from ..config import numeric
 from ..util.typing import zX, zX_like
 
 
@@ -57,7 +57,7 @@ class Population:
 
         self.fitnesses = zX(limit, len(fitness_weights))
         self.fitness_w = fitness_weights
-        self.individuals = np.random.uniform(size=(limit, loci)).astype(floatX)
+        self.individuals = np.random.uniform(size=(limit, loci)).astype(numeric.floatX)
 
         self.age = 0
 
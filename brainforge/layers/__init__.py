@@ -1,4 +1,4 @@
 from .core import Dense, Activation, Reshape, Flatten
 from .fancy import Highway, DropOut
 from .recurrent import RLayer, LSTM, GRU, ClockworkLayer, Reservoir
-from .tensor import PoolLayer, ConvLayer, GlobalAveragePooling
+from .tensor import PoolLayer, ConvLayer, DepthwiseConv, SeparableConv, GlobalAveragePooling
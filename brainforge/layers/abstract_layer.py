@@ -5,9 +5,43 @@ from .. import atomic, config
 from ..util import zX_like, white_like
 
 
+class Parameter:
+
+    """Descriptor for the parameter and gradient attributes of a layer.
+
+    Once a LayerStack binds the layer into its flat parameter arena, assignments
+    are copied into the arena views instead of rebinding the attribute."""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.slot = "_" + name
+
+    def __get__(self, layer, owner=None):
+        if layer is None:
+            return self
+        return layer.__dict__.get(self.slot)
+
+    def __set__(self, layer, value):
+        view = layer.__dict__.get(self.slot)
+        if not layer.__dict__.get("arena_bound") or view is None or value is view:
+            layer.__dict__[self.slot] = value
+            return
+        if np.size(value) != view.size:
+            raise ValueError("Cannot resize {} of a layer bound to a parameter arena: {} -> {}"
+                             .format(self.name, view.shape, np.shape(value)))
+        view[...] = np.reshape(value, view.shape)
+
+
 class LayerBase(abc.ABC):
 
     trainable = True
+    # Attributes feedforward keeps only for backpropagate, see release
+    caches = ("inputs", "output")
+
+    weights = Parameter()
+    biases = Parameter()
+    nabla_w = Parameter()
+    nabla_b = Parameter()
 
     def __init__(self, activation="linear", **kw):
 
@@ -17,6 +51,9 @@ class LayerBase(abc.ABC):
         self.inshape = None
         self.op = None
         self.opb = None
+        self.layout = "NCHW"
+        self.arena_bound = False
+        self._buffers = {}
 
         self.weights = None
         self.biases = None
@@ -26,12 +63,21 @@ class LayerBase(abc.ABC):
         self.compiled = kw.get("compiled", config.compiled)
         self.trainable = kw.get("trainable", self.trainable)
 
-        self.activation = atomic.activations[activation]() \
-            if isinstance(activation, str) else activation
+        if isinstance(activation, str):
+            activation = self._activations()[activation]()
+        self.activation = activation
+
+    def _activations(self):
+        """Compiled layers evaluate their activation with the numba kernels"""
+        if self.compiled:
+            from ..llatomic import llactivations
+            return llactivations
+        return atomic.activations
 
     def connect(self, brain):
         self.brain = brain
         self.inshape = brain.outshape
+        self.layout = getattr(brain, "layout", "NCHW")
 
     def shuffle(self) -> None:
         self.weights = white_like(self.weights)
@@ -50,6 +96,22 @@ class LayerBase(abc.ABC):
         else:
             self.weights, self.biases = w
 
+    def bind_parameters(self, params, grads):
+        """Moves weights, biases and their gradients into the flat buffers, keeping views into them"""
+        self.arena_bound = False
+        start = 0
+        for name, gname in (("weights", "nabla_w"), ("biases", "nabla_b")):
+            value, grad = getattr(self, name), getattr(self, gname)
+            end = start + value.size
+            pview = params[start:end].reshape(value.shape)
+            gview = grads[start:end].reshape(value.shape)
+            pview[...] = value
+            gview[...] = 0. if grad is None else grad
+            setattr(self, name, pview)
+            setattr(self, gname, gview)
+            start = end
+        self.arena_bound = True
+
     def get_gradients(self, unfold=True):
         nabla = [self.nabla_w, self.nabla_b]
         return nabla if not unfold else np.concatenate([grad.ravel() for grad in nabla])
@@ -69,6 +131,31 @@ class LayerBase(abc.ABC):
     def num_params(self):
         return self.weights.size + self.biases.size
 
+    def buffer(self, name, shape, dtype):
+        """Scratch array reused by every call with the same shape, eg. the output of the inference pass"""
+        key = name, shape
+        buffer = self._buffers.get(key)
+        if buffer is None or buffer.dtype != dtype:
+            buffer = self._buffers[key] = np.empty(shape, dtype=dtype)
+        return buffer
+
+    def activation_backward(self, delta):
+        """Multiplies delta in place with the derivative of the activation at the layer output"""
+        slope = self.activation.backward(self.output, out=self.buffer("backward", delta.shape, delta.dtype))
+        # Linear and softmax activations have the constant slope 1, delta is left as it is
+        if np.ndim(slope) or slope != 1.:
+            delta *= slope
+        return delta
+
+    def release(self):
+        """Drops the activations kept for backpropagate, the next feedforward recomputes them"""
+        for name in self.caches:
+            setattr(self, name, None)
+
+    def predict(self, X):
+        """Inference pass, layers override it to skip everything only backpropagate needs"""
+        return self.feedforward(X)
+
     @abc.abstractmethod
     def feedforward(self, X): raise NotImplementedError
 
@@ -20,20 +20,38 @@ class Dense(FFBase):
         if self.compiled:
             from .. import llatomic
             print("Compiling DenseLayer...")
-            self.op = llatomic.DenseOp()
+            self.op = llatomic.DenseOp(self.activation)
         else:
             self.op = atomic.DenseOp()
 
+    @property
+    def fused(self):
+        """Whether the activation runs inside the compiled dense kernels"""
+        return getattr(self.op, "fused", False)
+
     def feedforward(self, X):
         self.inputs = X
-        self.output = self.activation.forward(self.op.forward(
-            X, self.weights, self.biases
-        ))
+        if self.fused:
+            self.output = self.op.forward_activated(X, self.weights, self.biases)
+            return self.output
+        Z = self.op.forward(X, self.weights, self.biases)
+        self.output = self.activation.forward(Z, out=Z)
         return self.output
 
+    def predict(self, X):
+        if self.fused:
+            return self.op.forward_activated(X, self.weights, self.biases)
+        Z = self.buffer("output", (len(X), self.neurons), np.result_type(X, self.weights))
+        np.dot(X, self.weights, out=Z)
+        Z += self.biases
+        return self.activation.forward(Z, out=Z)
+
     def backpropagate(self, delta):
-        delta *= self.activation.backward(self.output)
-        nabla_w, nabla_b, dX = self.op.backward(self.inputs, delta, self.weights)
+        if self.fused:
+            nabla_w, nabla_b, dX = self.op.backward_activated(self.inputs, delta, self.weights, self.output)
+        else:
+            delta = self.activation_backward(delta)
+            nabla_w, nabla_b, dX = self.op.backward(self.inputs, delta, self.weights)
         self.nabla_w += nabla_w
         self.nabla_b += nabla_b
         return dX
@@ -48,8 +66,11 @@ class Activation(NoParamMixin, LayerBase):
         self.output = self.activation.forward(X)
         return self.output
 
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.activation.forward(X)
+
     def backpropagate(self, delta) -> np.ndarray:
-        return delta * self.activation.backward(self.output)
+        return self.activation_backward(delta)
 
     @property
     def outshape(self):
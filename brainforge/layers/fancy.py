@@ -3,7 +3,6 @@ import numpy as np
 from .abstract_layer import LayerBase, NoParamMixin, FFBase
 from ..atomic import Sigmoid
 from ..util import rtm, scalX, zX, white
-from ..config import floatX
 
 sigmoid = Sigmoid()
 
@@ -13,6 +12,8 @@ class Highway(FFBase):
     Neural Highway Layer based on Srivastava et al., 2015
     """
 
+    caches = FFBase.caches + ("gates",)
+
     def __init__(self, activation="tanh", **kw):
         FFBase.__init__(self, 1, activation, **kw)
         self.gates = None
@@ -59,6 +60,8 @@ class Highway(FFBase):
 
 class DropOut(NoParamMixin, LayerBase):
 
+    caches = LayerBase.caches + ("mask",)
+
     def __init__(self, dropchance):
         super().__init__()
         self.dropchance = scalX(1. - dropchance)
@@ -72,11 +75,13 @@ class DropOut(NoParamMixin, LayerBase):
 
     def feedforward(self, X: np.ndarray) -> np.ndarray:
         self.inputs = X
-        self.mask = np.random.uniform(0, 1, self.inshape) < self.dropchance  # type: np.ndarray
-        self.mask.astype(floatX)
+        self.mask = (np.random.uniform(0, 1, self.inshape) < self.dropchance).astype(X.dtype)  # type: np.ndarray
         self.output = X * (self.mask if self.brain.learning else self.dropchance)
         return self.output
 
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return X * self.dropchance
+
     def backpropagate(self, delta: np.ndarray) -> np.ndarray:
         output = delta * self.mask
         self.mask = np.ones_like(self.mask) * self.dropchance
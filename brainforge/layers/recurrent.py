@@ -4,14 +4,27 @@ import numpy as np
 
 from .abstract_layer import FFBase
 from .. import atomic
-from ..util import ctx1, zX, zX_like, white, white_like
+from ..util import zX, zX_like, white, white_like
 
 sigmoid = atomic.Sigmoid()
 
 
 class RecurrentBase(FFBase):
 
-    def __init__(self, neurons, activation, return_seq=False, **kw):
+    """Base of the recurrent layers.
+
+    Stateful layers carry their final state over to the next batch instead of starting from
+    zeros, consecutive batches are treated as the continuation of the same sequences.
+    If bptt_window is set, only its last timesteps are cached and backpropagated through,
+    the timesteps before the window are run without caching.
+    If mask_value is set, trailing timesteps filled with it are treated as padding: the ops
+    stop updating the state of a sequence at its length and nothing is backpropagated from
+    the padding."""
+
+    caches = FFBase.caches + ("cache", "head", "Zs", "gates")
+
+    def __init__(self, neurons, activation, return_seq=False, stateful=False, bptt_window=None, mask_value=None,
+                 **kw):
         super().__init__(neurons, activation, **kw)
         self.Z = 0
         self.Zs = []
@@ -20,6 +33,15 @@ class RecurrentBase(FFBase):
 
         self.time = 0
         self.return_seq = return_seq
+        self.stateful = stateful
+        self.bptt_window = bptt_window
+        self.state = None
+        self.initial_state = None
+        self.head = None
+        self.skipped = 0
+        self.mask_value = mask_value
+        self.lengths = None
+        self.order = None
 
     @abc.abstractmethod
     def feedforward(self, X):
@@ -28,12 +50,88 @@ class RecurrentBase(FFBase):
         self.Zs, self.gates, self.cache = [], [], []
         return zX(len(X), self.neurons)
 
+    def predict(self, X):
+        if self.op is None:
+            # ClockworkLayer implements its loop in the layer, without an op
+            return self.feedforward(X)
+        X, state, lengths = self._sort_batch(X.transpose(1, 0, 2), self._carried_state(len(X)))
+        O, state = self.op.predict(X, self.weights, self.biases, self.return_seq, state, lengths)
+        if self.stateful:
+            self.state = tuple(map(self._restore_order, state))
+        return self._restore_order(O.transpose(1, 0, 2) if self.return_seq else O)
+
+    def reset_state(self):
+        """Forgets the state carried over from the previous batch"""
+        self.state = None
+
+    def _carried_state(self, batch):
+        # A batch of a different size can't continue the previous sequences
+        if not self.stateful or self.state is None or len(self.state[0]) != batch:
+            return None
+        return self.state
+
+    def _sort_batch(self, X, state):
+        """Time-major inputs, state and lengths ordered by decreasing length, as the masked ops expect them"""
+        if self.mask_value is None:
+            self.order = None
+            return X, state, None
+        # The length of a sequence ends after its last timestep not entirely filled with mask_value
+        valid = (X != self.mask_value).any(axis=-1)
+        lengths = np.where(valid.any(axis=0), len(X) - valid[::-1].argmax(axis=0), 0)
+        self.order = np.argsort(-lengths, kind="stable")
+        if state is not None:
+            state = tuple(s[self.order] for s in state)
+        return X[:, self.order], state, lengths[self.order]
+
+    def _restore_order(self, A):
+        """Undoes the ordering of _sort_batch on a batch-major array"""
+        if self.order is None:
+            return A
+        return A[np.argsort(self.order)]
+
+    def _window(self, X):
+        """Time-major inputs of the BPTT window and the state they start from"""
+        X, state, lengths = self._sort_batch(X.transpose(1, 0, 2), self._carried_state(len(X)))
+        self.head, self.skipped = None, 0
+        if self.bptt_window and len(X) > self.bptt_window:
+            self.skipped = len(X) - self.bptt_window
+            self.head, state = self.op.predict(
+                X[:self.skipped], self.weights, self.biases, self.return_seq, state,
+                None if lengths is None else np.minimum(lengths, self.skipped)
+            )
+            X = X[self.skipped:]
+            if lengths is not None:
+                lengths = np.maximum(lengths - self.skipped, 0)
+        self.inputs, self.time, self.initial_state, self.lengths = X, len(X), state, lengths
+        return X, state
+
+    def _emit(self, state):
+        """Keeps the final state of stateful layers and returns the output in batch-major layout"""
+        if self.stateful:
+            self.state = tuple(self._restore_order(s.copy()) for s in state)
+        if not self.return_seq:
+            return self._restore_order(self.output[-1])
+        O = self.output if self.head is None else np.concatenate((self.head, self.output))
+        return self._restore_order(O.transpose(1, 0, 2))
+
+    def _unwindow(self, dX):
+        """Batch-major input gradient, the timesteps before the BPTT window get no gradient"""
+        if self.skipped:
+            dX = np.concatenate((zX(self.skipped, *dX.shape[1:], dtype=dX.dtype), dX))
+        return self._restore_order(dX.transpose(1, 0, 2))
+
     @abc.abstractmethod
     def backpropagate(self, delta):
         self.nabla_w = zX_like(self.weights)
         self.nabla_b = zX_like(self.biases)
+        if self.order is not None:
+            delta = delta[self.order]
         if self.return_seq:
-            return delta.transpose(1, 0, 2)
+            delta = delta.transpose(1, 0, 2)[self.skipped:]
+            if self.lengths is not None:
+                # The outputs at the padding are not part of the sequences, their deltas are dropped
+                delta = delta * (np.arange(self.time)[:, None] < self.lengths)[..., None]
+            return delta
         else:
             error_tensor = zX(self.time, len(delta), self.neurons)
             error_tensor[-1] = delta
@@ -59,135 +157,86 @@ class RLayer(RecurrentBase):
             self.op = atomic.RecurrentOp(activation)
 
     def connect(self, brain):
-        self.Z = brain.outshape[-1] + self.neurons
-        self.weights = white(self.Z, self.neurons)
+        self.weights = white(brain.outshape[-1] + self.neurons, self.neurons)
         self.biases = zX(self.neurons)
         super().connect(brain)
 
     def feedforward(self, X):
-        super().feedforward(X)
-        self.output, self.Z = self.op.forward(self.inputs, self.weights, self.biases)
-        return self.output.transpose(1, 0, 2) if self.return_seq else self.output[-1]
+        X, state = self._window(X)
+        self.output = self.op.forward(X, self.weights, self.biases, state, self.lengths)
+        return self._emit((self.output[-1],))
 
     def backpropagate(self, delta):
         delta = super().backpropagate(delta)
         dX, self.nabla_w, self.nabla_b = self.op.backward(
-            Z=self.Z, O=self.output, E=delta, W=self.weights
+            X=self.inputs, O=self.output, E=delta, W=self.weights, state=self.initial_state, lengths=self.lengths
         )
-        return dX.transpose(1, 0, 2)
+        return self._unwindow(dX)
 
 
 class LSTM(RecurrentBase):
 
-    def __init__(self, neurons, activation, bias_init_factor=7., return_seq=False, **kw):
+    def __init__(self, neurons, activation, bias_init_factor=7., return_seq=False, checkpoint=False, **kw):
         super().__init__(neurons, activation, return_seq, **kw)
         self.G = neurons * 3
         self.Zs = []
         self.gates = []
         self.bias_init_factor = bias_init_factor
+        # With checkpoint the op keeps only the cell states and recomputes the gates in backpropagate
         if self.compiled:
             from .. import llatomic
             print("Compiling LSTM...")
-            self.op = llatomic.LSTMOp(activation)
+            self.op = llatomic.LSTMOp(activation, checkpoint)
         else:
-            self.op = atomic.LSTMOp(activation)
+            self.op = atomic.LSTMOp(activation, checkpoint)
 
     def connect(self, brain):
-        self.Z = brain.outshape[-1] + self.neurons
-        self.weights = white(self.Z, self.neurons * 4)
+        self.weights = white(brain.outshape[-1] + self.neurons, self.neurons * 4)
         self.biases = zX(self.neurons * 4) + self.bias_init_factor
         super().connect(brain)
 
     def feedforward(self, X):
-        super().feedforward(X)
-        self.output, self.Z, self.cache = self.op.forward(
-            X=self.inputs, W=self.weights, b=self.biases
-        )
-        return self.output.transpose(1, 0, 2) if self.return_seq else self.output[-1]
+        X, state = self._window(X)
+        self.output, self.cache = self.op.forward(X, self.weights, self.biases, state, self.lengths)
+        return self._emit((self.output[-1], self.cache[0][-1]))
 
     def backpropagate(self, delta):
         delta = super().backpropagate(delta)
         dX, self.nabla_w, self.nabla_b = self.op.backward(
-            Z=self.Z, O=self.output, E=delta, W=self.weights, cache=self.cache
+            X=self.inputs, O=self.output, E=delta, W=self.weights, cache=self.cache,
+            state=self.initial_state, lengths=self.lengths, b=self.biases
         )
-        return dX.transpose(1, 0, 2)
+        return self._unwindow(dX)
 
 
 class GRU(RecurrentBase):
 
+    def __init__(self, neurons, activation, return_seq=False, **kw):
+        super().__init__(neurons, activation, return_seq, **kw)
+        if self.compiled:
+            from .. import llatomic
+            print("Compiling GRU...")
+            self.op = llatomic.GRUOp(activation)
+        else:
+            self.op = atomic.GRUOp(activation)
+
     def connect(self, brain):
         self.weights = white(brain.outshape[-1] + self.neurons, self.neurons * 3)
         self.biases = zX(self.neurons * 3)
         super().connect(brain)
 
     def feedforward(self, X):
-        output = super().feedforward(X)
-        neu = self.neurons
-
-        self.inputs = X.transpose(1, 0, 2)
-        self.time = self.inputs.shape[0]
-        self.cache = []
-
-        Wur, Wo = self.weights[:, :-neu], self.weights[:, -neu:]
-        bur, bo = self.biases[:-neu], self.biases[-neu:]
-
-        cache = []
-
-        for t in range(self.time):
-            Z = ctx1(self.inputs[t], output)
-            U, R = np.split(sigmoid.forward(Z @ Wur + bur), 2, axis=1)
-            K = R * output
-
-            Zk = ctx1(self.inputs[t], K)
-            O = self.activation.forward(Zk @ Wo + bo)
-            output = U * output + (1. - U) * O
-
-            cache.append(output)
-            self.gates.append([U, R, O])
-            self.Zs.append([Z, Zk])
-
-        if self.return_seq:
-            self.output = np.stack(cache, axis=1)
-        else:
-            self.output = cache[-1]
-
-        return self.output
+        X, state = self._window(X)
+        self.output, self.cache = self.op.forward(X, self.weights, self.biases, state, self.lengths)
+        return self._emit((self.output[-1],))
 
     def backpropagate(self, delta):
-        # alias these
-        ct = np.concatenate
-        dact = self.activation.backward
-        dsig = sigmoid.backward
-
         delta = super().backpropagate(delta)
-
-        dh = zX_like(delta[-1])
-        dX = zX_like(self.inputs)
-
-        Wu, Wr, Wo = np.split(self.weights, 3, axis=1)
-        neu = self.neurons
-
-        for t in range(-1, -(self.time + 1), -1):
-            (U, R, O), (Z, Zk) = self.gates[t], self.Zs[t]
-            prevout = Z[:, -neu:]
-            dh += delta[t]
-            dU = (prevout - O) * dsig(U) * dh
-            dO = (1. - U) * dact(O) * dh  # type: np.ndarray
-            dZk = dO @ Wo.T
-            dK = dZk[:, -neu:]
-            dR = prevout * dsig(R) * dK
-            dZ = ct((dU, dR), axis=1) @ ct((Wu, Wr), axis=1).T
-
-            nWur = Z.T @ ct((dU, dR), axis=1)
-            nWo = Zk.T @ dO
-
-            dh = dZ[:, -neu:] + R * dK + U * dh
-            dX[t] = dZ[:, :-neu] + dZk[:, :-neu]
-
-            self.nabla_w += ct((nWur, nWo), axis=1)
-            self.nabla_b += ct((dU, dR, dO), axis=1).sum(axis=0)
-
-        return dX.transpose(1, 0, 2)
+        dX, self.nabla_w, self.nabla_b = self.op.backward(
+            X=self.inputs, O=self.output, E=delta, W=self.weights, cache=self.cache,
+            state=self.initial_state, lengths=self.lengths
+        )
+        return self._unwindow(dX)
 
 
 class ClockworkLayer(RecurrentBase):
@@ -246,7 +295,9 @@ class ClockworkLayer(RecurrentBase):
             Z = np.concatenate((self.inputs[t - 1], output), axis=-1)
             gated_W = self.weights * time_gate[None, :]
             gated_b = self.biases * time_gate
-            output = self.activation.forward(Z.dot(gated_W) + gated_b)
+            output = Z.dot(gated_W)
+            output += gated_b
+            self.activation.forward(output, out=output)
 
             self.Zs.append(Z)
             self.gates.append([time_gate, gated_W])
@@ -295,7 +346,7 @@ class Reservoir(RLayer):
         super().connect(brain)
         wx, wy = self.weights.shape
         # Create a sparse weight matrix (biases are included)
-        W = np.random.binomial(1, self.r, size=(wx, wy + 1)).astype(float)
+        W = np.random.binomial(1, self.r, size=(wx, wy + 1)).astype(self.weights.dtype)
         W *= np.random.randn(wx, wy + 1)
         S = np.linalg.svd(W, compute_uv=False)  # compute singular values
         W /= S[0] ** 2  # scale to unit spectral radius
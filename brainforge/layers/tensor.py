@@ -1,11 +1,16 @@
 import numpy as np
 
 from .abstract_layer import LayerBase, NoParamMixin
+from .. import atomic
+from ..atomic.tensor_op import conv_padding, spatial_shape
 from ..util import zX, zX_like, white, scalX
 
 
 class PoolLayer(NoParamMixin, LayerBase):
 
+    # The output is kept, it defines outshape
+    caches = ("argmax",)
+
     def __init__(self, filter_size, compiled=True):
         LayerBase.__init__(self, activation="linear", trainable=False)
         if compiled:
@@ -13,24 +18,34 @@ class PoolLayer(NoParamMixin, LayerBase):
         else:
             from ..atomic import MaxPoolOp
         self.fdim = filter_size
-        self.filter = None
-        self.op = MaxPoolOp()
+        self.argmax = None
+        self.opclass = MaxPoolOp
+        self.op = None
 
     def connect(self, brain):
-        ic, iy, ix = brain.outshape[-3:]
+        layout = getattr(brain, "layout", "NCHW")
+        iy, ix = spatial_shape(brain.outshape, layout)
         if any((iy % self.fdim, ix % self.fdim)):
             raise RuntimeError(
                 "Incompatible shapes: {} % {}".format((ix, iy), self.fdim)
             )
         LayerBase.connect(self, brain)
-        self.output = zX(ic, iy // self.fdim, ix // self.fdim)
+        self.op = self.opclass(layout=layout)
+        oy, ox = iy // self.fdim, ix // self.fdim
+        if layout == "NHWC":
+            self.output = zX(oy, ox, brain.outshape[-1])
+        else:
+            self.output = zX(brain.outshape[-3], oy, ox)
 
     def feedforward(self, questions):
-        self.output, self.filter = self.op.forward(questions, self.fdim)
+        self.output, self.argmax = self.op.forward(questions, self.fdim)
         return self.output
 
+    def predict(self, X):
+        return self.op.predict(X, self.fdim)
+
     def backpropagate(self, delta):
-        return self.op.backward(delta, self.filter)
+        return self.op.backward(delta, self.argmax, self.fdim)
 
     @property
     def outshape(self):
@@ -42,56 +57,253 @@ class PoolLayer(NoParamMixin, LayerBase):
 
 class ConvLayer(LayerBase):
 
-    def __init__(self, nfilters, filterx=3, filtery=3, compiled=True, **kw):
+    caches = LayerBase.caches + ("rfields",)
+
+    def __init__(self, nfilters, filterx=3, filtery=3, compiled=True, stride=1, padding="valid",
+                 algorithm="auto", **kw):
         super().__init__(compiled=compiled, **kw)
         self.nfilters = nfilters
         self.fx = filterx
         self.fy = filtery
         self.depth = 0
-        self.stride = 1
+        self.stride = stride
+        self.padding = padding
+        self.algorithm = algorithm
+        self.rfields = None
         self.inshape = None
         self.op = None
 
-    def connect(self, brain):
+    def _make_op(self):
+        if self.algorithm == "auto":
+            self.algorithm = atomic.ConvolutionOp.choose_algorithm(self.fy, self.fx, self.layout)
+        if self.algorithm == "fft":
+            # The FFT path is vectorized numpy, there is no compiled variant of it
+            return atomic.ConvolutionOp(self.algorithm, layout=self.layout)
         if self.compiled:
             from ..llatomic import ConvolutionOp
-        else:
-            from ..atomic import ConvolutionOp
-        depth, iy, ix = brain.outshape[-3:]
-        if any((iy < self.fy, ix < self.fx)):
+            return ConvolutionOp(self.algorithm, layout=self.layout)
+        return atomic.ConvolutionOp(self.algorithm, layout=self.layout)
+
+    def connect(self, brain):
+        layout = getattr(brain, "layout", "NCHW")
+        iy, ix = spatial_shape(brain.outshape, layout)
+        depth = brain.outshape[-1] if layout == "NHWC" else brain.outshape[-3]
+        (pt, pb), (pl, pr) = conv_padding(self.padding, self.fy, self.fx, iy, ix, self.stride)
+        if any((iy + pt + pb < self.fy, ix + pl + pr < self.fx)):
             raise RuntimeError(
                 "Incompatible shapes: iy ({}) < fy ({}) OR ix ({}) < fx ({})"
-                .format(iy, self.fy, ix, self.fx)
+                .format(iy + pt + pb, self.fy, ix + pl + pr, self.fx)
             )
         super().connect(brain)
-        self.op = ConvolutionOp()
+        self.op = self._make_op()
         self.inshape = brain.outshape
         self.depth = depth
-        self.weights = white(self.nfilters, self.depth, self.fx, self.fy)
-        self.biases = zX(self.nfilters)[None, :, None, None]
+        self.weights = white(self.nfilters, self.depth, self.fy, self.fx)
+        if self.layout == "NHWC":
+            # Filters are stored as [fy, fx, depth, nfilters], biases broadcast over the last axis
+            self.weights = self.weights.transpose((2, 3, 1, 0)).copy()
+            self.biases = zX(self.nfilters)
+        else:
+            self.biases = zX(self.nfilters)[None, :, None, None]
         self.nabla_b = zX_like(self.biases)
         self.nabla_w = zX_like(self.weights)
 
     def feedforward(self, X):
         self.inputs = X
-        self.output = self.activation.forward(self.op.forward(X, self.weights, "valid"))
-        self.output += self.biases
+        self.rfields = None
+        if self.algorithm == "im2col" and len(
+                self.op.batch_chunks(X.shape, self.weights.shape, self.padding, self.stride, X.itemsize)) == 1:
+            # The unrolled receptive fields are kept for backpropagate if they fit into the memory budget
+            self.rfields = self.op.receptive_fields(X, self.weights, self.padding, self.stride)
+            Z = self.op.forward_fields(self.rfields, self.weights, self.outshape)
+        else:
+            Z = self.op.forward(X, self.weights, self.padding, self.stride)
+        Z += self.biases
+        self.output = self.activation.forward(Z, out=Z)
         return self.output
 
+    def predict(self, X):
+        Z = self.op.forward(X, self.weights, self.padding, self.stride)
+        Z += self.biases
+        return self.activation.forward(Z, out=Z)
+
     def backpropagate(self, delta):
-        delta *= self.activation.backward(self.output)
-        self.nabla_w, self.nabla_b, dX = self.op.backward(X=self.inputs, E=delta, F=self.weights)
+        delta = self.activation_backward(delta)
+        if self.rfields is not None:
+            self.nabla_w, self.nabla_b, dX = self.op.backward_fields(
+                self.rfields, E=delta, F=self.weights, inshape=self.inputs.shape,
+                mode=self.padding, stride=self.stride
+            )
+        else:
+            self.nabla_w, self.nabla_b, dX = self.op.backward(
+                X=self.inputs, E=delta, F=self.weights, mode=self.padding, stride=self.stride
+            )
         return dX
 
     @property
     def outshape(self):
-        oy, ox = tuple(ix - fx + 1 for ix, fx in zip(self.inshape[-2:], (self.fx, self.fy)))
-        return self.nfilters, ox, oy
+        return self.op.outshape(self.inshape, self.weights.shape, self.padding, self.stride, self.layout)
 
     def __str__(self):
         return "Conv({}x{}x{})-{}".format(self.nfilters, self.fy, self.fx, str(self.activation)[:4])
 
 
+class DepthwiseConv(LayerBase):
+
+    """Convolves every input channel with a separate filter, without mixing channels"""
+
+    def __init__(self, filterx=3, filtery=3, compiled=True, stride=1, padding="valid", **kw):
+        super().__init__(compiled=compiled, **kw)
+        self.fx = filterx
+        self.fy = filtery
+        self.depth = 0
+        self.stride = stride
+        self.padding = padding
+        self.inshape = None
+        self.op = None
+
+    def _make_op(self):
+        if self.compiled:
+            from ..llatomic import DepthwiseConvolutionOp
+            return DepthwiseConvolutionOp(layout=self.layout)
+        return atomic.DepthwiseConvolutionOp(layout=self.layout)
+
+    def connect(self, brain):
+        layout = getattr(brain, "layout", "NCHW")
+        iy, ix = spatial_shape(brain.outshape, layout)
+        (pt, pb), (pl, pr) = conv_padding(self.padding, self.fy, self.fx, iy, ix, self.stride)
+        if any((iy + pt + pb < self.fy, ix + pl + pr < self.fx)):
+            raise RuntimeError(
+                "Incompatible shapes: iy ({}) < fy ({}) OR ix ({}) < fx ({})"
+                .format(iy + pt + pb, self.fy, ix + pl + pr, self.fx)
+            )
+        super().connect(brain)
+        self.op = self._make_op()
+        self.depth = brain.outshape[-1] if layout == "NHWC" else brain.outshape[-3]
+        self.weights = white(self.depth, self.fy, self.fx)
+        if self.layout == "NHWC":
+            self.weights = self.weights.transpose((1, 2, 0)).copy()
+        self.biases = self._zero_biases(self.depth)
+        self.nabla_b = zX_like(self.biases)
+        self.nabla_w = zX_like(self.weights)
+
+    def _zero_biases(self, nchannels):
+        return zX(nchannels) if self.layout == "NHWC" else zX(nchannels)[None, :, None, None]
+
+    def feedforward(self, X):
+        self.inputs = X
+        Z = self.op.forward(X, self.weights, self.padding, self.stride)
+        Z += self.biases
+        self.output = self.activation.forward(Z, out=Z)
+        return self.output
+
+    def predict(self, X):
+        Z = self.op.forward(X, self.weights, self.padding, self.stride)
+        Z += self.biases
+        return self.activation.forward(Z, out=Z)
+
+    def backpropagate(self, delta):
+        delta = self.activation_backward(delta)
+        self.nabla_w, self.nabla_b, dX = self.op.backward(
+            X=self.inputs, E=delta, F=self.weights, mode=self.padding, stride=self.stride
+        )
+        return dX
+
+    @property
+    def outshape(self):
+        return self.op.outshape(self.inshape, self._depthwise_fshape, self.padding, self.stride, self.layout)
+
+    @property
+    def _depthwise_fshape(self):
+        return (self.fy, self.fx, self.depth) if self.layout == "NHWC" else (self.depth, self.fy, self.fx)
+
+    def __str__(self):
+        return "DepthwiseConv({}x{})-{}".format(self.fy, self.fx, str(self.activation)[:4])
+
+
+class SeparableConv(DepthwiseConv):
+
+    """Depthwise convolution followed by a pointwise (1x1) convolution mixing the channels.
+
+    Weights are packed into a [depth, fy*fx + nfilters] matrix, each row holding
+    the depthwise filter of an input channel and its pointwise weights."""
+
+    caches = DepthwiseConv.caches + ("depthwise_output",)
+
+    def __init__(self, nfilters, filterx=3, filtery=3, compiled=True, stride=1, padding="valid", **kw):
+        super().__init__(filterx, filtery, compiled, stride, padding, **kw)
+        self.nfilters = nfilters
+        self.depthwise_output = None
+
+    def connect(self, brain):
+        super().connect(brain)
+        self.weights = np.concatenate(
+            (white(self.depth, self.fy, self.fx).reshape(self.depth, -1), white(self.depth, self.nfilters)), axis=1
+        )
+        self.biases = self._zero_biases(self.nfilters)
+        self.nabla_b = zX_like(self.biases)
+        self.nabla_w = zX_like(self.weights)
+
+    def _split_weights(self, W):
+        k = self.fy * self.fx
+        if self.layout == "NHWC":
+            return W[:, :k].T.reshape(self._depthwise_fshape), W[:, k:]
+        return W[:, :k].reshape(self._depthwise_fshape), W[:, k:]
+
+    def _separable_forward(self, X):
+        Fd, Wp = self._split_weights(self.weights)
+        D = self.op.forward(X, Fd, self.padding, self.stride)
+        # The pointwise convolution is a GEMM over the channel axis
+        if self.layout == "NHWC":
+            Z = np.dot(D.reshape(-1, self.depth), Wp).reshape(D.shape[:-1] + (self.nfilters,))
+        else:
+            m, c, oy, ox = D.shape
+            Z = np.matmul(Wp.T, D.reshape(m, c, oy*ox)).reshape(m, self.nfilters, oy, ox)
+        Z += self.biases
+        return D, Z
+
+    def feedforward(self, X):
+        self.inputs = X
+        self.depthwise_output, Z = self._separable_forward(X)
+        self.output = self.activation.forward(Z, out=Z)
+        return self.output
+
+    def predict(self, X):
+        Z = self._separable_forward(X)[1]
+        return self.activation.forward(Z, out=Z)
+
+    def backpropagate(self, delta):
+        delta = self.activation_backward(delta)
+        Fd, Wp = self._split_weights(self.weights)
+        D = self.depthwise_output
+        if self.layout == "NHWC":
+            E2 = delta.reshape(-1, self.nfilters)
+            nabla_p = np.dot(D.reshape(-1, self.depth).T, E2)
+            self.nabla_b = E2.sum(axis=0)
+            dD = np.dot(E2, Wp.T).reshape(D.shape)
+        else:
+            m, c, oy, ox = D.shape
+            E3 = delta.reshape(m, self.nfilters, oy*ox)
+            nabla_p = np.matmul(D.reshape(m, c, oy*ox), E3.transpose((0, 2, 1))).sum(axis=0)
+            self.nabla_b = delta.sum(axis=(0, 2, 3), keepdims=True)
+            dD = np.matmul(Wp, E3).reshape(D.shape)
+        nabla_d, _, dX = self.op.backward(
+            X=self.inputs, E=dD, F=Fd, mode=self.padding, stride=self.stride
+        )
+        if self.layout == "NHWC":
+            nabla_d = nabla_d.reshape(-1, self.depth).T
+        self.nabla_w = np.concatenate((nabla_d.reshape(self.depth, -1), nabla_p), axis=1)
+        return dX
+
+    @property
+    def outshape(self):
+        oshape = super().outshape
+        return oshape[:-1] + (self.nfilters,) if self.layout == "NHWC" else (self.nfilters,) + oshape[1:]
+
+    def __str__(self):
+        return "SeparableConv({}x{}x{})-{}".format(self.nfilters, self.fy, self.fx, str(self.activation)[:4])
+
+
 class GlobalAveragePooling(NoParamMixin, LayerBase):
 
     def __init__(self):
@@ -100,15 +312,19 @@ class GlobalAveragePooling(NoParamMixin, LayerBase):
         self.repeats = 0
 
     def feedforward(self, X):
-        self.repeats = np.prod(X.shape[2:])
-        return X.mean(axis=(2, 3))
+        axes = (1, 2) if self.layout == "NHWC" else (2, 3)
+        self.repeats = np.prod([X.shape[ax] for ax in axes])
+        return X.mean(axis=axes)
 
     def backpropagate(self, delta):
         m = len(delta)
-        delta = np.repeat(delta / scalX(self.repeats), self.repeats)
+        delta = delta / scalX(self.repeats)
+        if self.layout == "NHWC":
+            return np.broadcast_to(delta[:, None, None, :], (m,) + self.inshape).copy()
+        delta = np.repeat(delta, self.repeats)
         delta = delta.reshape((m,) + self.inshape)
         return delta
 
     @property
     def outshape(self):
-        return self.inshape[0],
+        return (self.inshape[-1],) if self.layout == "NHWC" else (self.inshape[0],)
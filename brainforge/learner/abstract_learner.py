@@ -1,8 +1,11 @@
 import time
 
+import numpy as np
+
+from ..atomic.tensor_op import batch_chunks, resolve_memory_budget
 from ..model.layerstack import LayerStack
 from ..metrics import costs as _costs, metrics as _metrics
-from ..util import batch_stream, logging
+from ..util import batch_stream, logging, asX
 
 
 class Learner:
@@ -11,7 +14,7 @@ class Learner:
         if not isinstance(layerstack, LayerStack):
             if "input_shape" not in kw:
                 raise RuntimeError("Please supply input_shape as a keyword argument!")
-            layerstack = LayerStack(kw["input_shape"], layers=layerstack)
+            layerstack = LayerStack(kw["input_shape"], layers=layerstack, layout=kw.get("layout", "NCHW"))
         self.layers = layerstack
         self.name = name
         self.age = 0
@@ -85,13 +88,35 @@ class Learner:
         self.age += updates_per_epoch
         return history
 
-    def predict(self, X):
-        return self.layers.feedforward(X)
+    def predict(self, X, batch_size=None, inference=False):
+        """Forward pass of X. If batch_size is set, X is streamed through the inference path
+        in chunks of batch_size samples (or chunks fitting the memory budget if it is "auto")
+        and the predictions are written into a single output array."""
+        if batch_size is None:
+            return self.layers.predict(X, inference)
+        chunks = self._chunks(len(X), batch_size)
+        preds = None
+        for chunk, pred in zip(chunks, self.predict_stream(X[chunk] for chunk in chunks)):
+            if preds is None:
+                preds = np.empty((len(X),) + pred.shape[1:], dtype=pred.dtype)
+            preds[chunk] = pred
+        return preds
+
+    def predict_stream(self, stream):
+        """Generator yielding the predictions for every batch of an iterable, using the inference path"""
+        for x in stream:
+            yield self.layers.predict(x, inference=True)
+
+    def _chunks(self, N, batch_size):
+        if batch_size == "auto":
+            return batch_chunks(N, self.layers.sample_bytes, resolve_memory_budget())
+        return [slice(start, min(start + batch_size, N)) for start in range(0, N, batch_size)]
 
     def evaluate_batch(self, x, y, metrics=()):
         m = len(x)
-        preds = self.predict(x)
-        eval_metrics = {"cost": self.cost(self.output, y) / m}
+        preds = self.predict(x, inference=True)
+        y = asX(y, self.layers.floatX)
+        eval_metrics = {"cost": self.cost(preds, y) / m}
         if metrics:
             for metric in metrics:
                 eval_metrics[str(metric).lower()] = metric(preds, y) / m
@@ -113,13 +138,9 @@ class Learner:
         return history
 
     def evaluate(self, X, Y, batch_size=32, metrics=(), verbose=False):
-        N = X.shape[0]
-        batch_size = min(batch_size, N)
-        steps = int(round(N / batch_size))
-
-        stream = batch_stream(X, Y, m=batch_size, shuffle=False, infinite=False)
-
-        return self.evaluate_stream(stream, steps, metrics, verbose)
+        chunks = self._chunks(len(X), batch_size)
+        stream = ((X[chunk], Y[chunk]) for chunk in chunks)
+        return self.evaluate_stream(stream, len(chunks), metrics, verbose)
 
     def learn_batch(self, X, Y, metrics=(), **kw) -> dict:
         raise NotImplementedError
@@ -1,7 +1,6 @@
-import numpy as np
-
 from .abstract_learner import Learner
 from ..optimizers import optimizers, GradientDescent
+from ..util.typing import asX
 
 
 class Backpropagation(Learner):
@@ -11,34 +10,31 @@ class Backpropagation(Learner):
         self.optimizer = (
             optimizer if isinstance(optimizer, GradientDescent) else optimizers[optimizer]()
         )
-        self.optimizer.initialize(nparams=self.layers.num_params)
+        # The optimizer state follows the dtype of the parameter arena, not the global floatX
+        self.optimizer.initialize(nparams=self.layers.num_params, dtype=self.layers.floatX)
 
     def learn_batch(self, X, Y, w=None, metrics=(), update=True):
         m = len(X)
         preds = self.predict(X)
-        delta = self.cost.derivative(preds, Y)
+        Y = asX(Y, self.layers.floatX)
+        cost, delta = self.cost.cost_and_derivative(preds, Y)
         if w is not None:
             delta *= w[:, None]
         self.backpropagate(delta)
         if update:
             self.update(m)
 
-        train_metrics = {"cost": self.cost(self.output, Y) / m}
+        train_metrics = {"cost": cost / m}
         if metrics:
             for metric in metrics:
                 train_metrics[str(metric).lower()] = metric(preds, Y) / m
         return train_metrics
 
     def backpropagate(self, error):
-        for layer in self.layers[-1:0:-1]:
-            error = layer.backpropagate(error)
-        return error
+        return self.layers.backpropagate(error)
 
     def update(self, m):
-        W = self.layers.get_weights(unfold=True)
-        gW = self.get_gradients(unfold=True)
-        oW = self.optimizer.optimize(W, gW, m)
-        self.layers.set_weights(oW, fold=True)
+        self.optimizer.optimize_inplace(self.layers.parameters, self.layers.gradients, m)
         self.zero_gradients()
 
     def get_weights(self, unfold=True):
@@ -48,29 +44,19 @@ class Backpropagation(Learner):
         self.layers.set_weights(ws=ws, fold=fold)
 
     def get_gradients(self, unfold=True):
-        grads = [l.gradients for l in self.layers if l.trainable]
         if unfold:
-            grads = np.concatenate(grads)
-        return grads
+            return self.layers.gradients.copy()
+        return [l.get_gradients(unfold=False) for l in self.layers if l.trainable]
 
     def set_gradients(self, gradients, fold=True):
-        trl = (l for l in self.layers if l.trainable)
         if fold:
-            start = 0
-            for layer in trl:
-                end = start + layer.num_params
-                layer.set_weights(gradients[start:end])
-                start = end
+            self.layers.gradients[...] = gradients
         else:
-            for w, layer in zip(gradients, trl):
-                layer.set_weights(w)
+            for nabla, layer in zip(gradients, self.layers.trainable_layers):
+                layer.set_gradients(nabla, fold=False)
 
     def zero_gradients(self):
-        for layer in self.layers:
-            if not layer.trainable:
-                continue
-            layer.nabla_w *= 0
-            layer.nabla_b *= 0
+        self.layers.gradients.fill(0.)
 
     @property
     def num_params(self):
@@ -1,4 +1,4 @@
 from .llcore_op import DenseOp
-from .lltensor_op import ConvolutionOp, MaxPoolOp
-from .llrecurrent_op import RecurrentOp, LSTMOp
-from .llactivation_op import Sigmoid, Tanh, ReLU, Sqrt
+from .lltensor_op import ConvolutionOp, DepthwiseConvolutionOp, MaxPoolOp
+from .llrecurrent_op import RecurrentOp, LSTMOp, GRUOp
+from .llactivation_op import Sigmoid, Tanh, ReLU, Sqrt, LeakyReLU, HardSigmoid, SoftMax, llactivations
@@ -1,65 +1,102 @@
 import numpy as np
 import numba as nb
 
-from ._llutil import floatX, Xd, nbfloatX
-from brainforge.util.typing import scalX
+from ._llutil import floatsigs
 
-s0 = scalX(0., floatX)
-s1 = scalX(1., floatX)
-s2 = scalX(2., floatX)
+s0 = 0.
+s05 = 0.5
+s1 = 1.
+s2 = 2.
 
-finfout = "{t}({t})".format(t=nbfloatX)
-jitsig = "{t}({t})".format(t=Xd(1))
+finfout = floatsigs("{t}({t})")
+finfout_param = floatsigs("{t}({t},{t})")
 
 
-@nb.vectorize(finfout, nopython=True)
-def sigmoid(Z):
-    return s1 / (s1 + np.exp(-Z))
+# Scalar kernels, the fused kernels (eg. the Dense ops in _llops) apply them elementwise themselves.
+# The ufuncs below are compiled from the same functions.
+
+@nb.jit(nopython=True)
+def _sigmoid(z):
+    return s1 / (s1 + np.exp(-z))
+
+
+@nb.jit(nopython=True)
+def _sigmoid_p(a):
+    return a * (s1 - a)
+
+
+@nb.jit(nopython=True)
+def _tanh(z):
+    return np.tanh(z)
+
+
+@nb.jit(nopython=True)
+def _tanh_p(a):
+    return s1 - a * a
 
 
-@nb.vectorize(finfout, nopython=True)
-def sigmoid_p(A):
-    return A * (s1 - A)
+@nb.jit(nopython=True)
+def _sqrt(z):
+    return np.sqrt(z)
 
 
 @nb.jit(nopython=True)
-def tanh(Z):
-    return np.tanh(Z)
+def _sqrt_p(a):
+    return s1 / (s2*a)
 
 
-@nb.vectorize(finfout, nopython=True)
-def tanh_p(A):
-    return s1 - A ** s2
+@nb.jit(nopython=True)
+def _relu(z):
+    return s0 if s0 >= z else z
 
 
-@nb.vectorize(finfout, nopython=True)
-def sqrt(Z):
-    return np.sqrt(Z)
+@nb.jit(nopython=True)
+def _relu_p(a):
+    return s0 if a <= s0 else s1
 
 
-@nb.vectorize(finfout, nopython=True)
-def sqrt_p(A):
-    return s1 / (s2*A)
+@nb.jit(nopython=True)
+def _leakyrelu(z, alpha):
+    return z if z > s0 else alpha * z
 
 
-@nb.vectorize(finfout, nopython=True)
-def relu(Z):
-    return s0 if s0 >= Z else Z
+@nb.jit(nopython=True)
+def _leakyrelu_p(a, alpha):
+    return s1 if a > s0 else alpha
 
 
-@nb.vectorize(finfout, nopython=True)
-def relu_p(A):
-    return s0 if A < s0 else s1
+@nb.jit(nopython=True)
+def _hard_sigmoid(z):
+    return min(max((z + s1) * s05, s0), s1)
 
 
-# @nb.jit("{f2}({f2})".format(f2=Xd(2)), nopython=True)
-# def softmax(Z):
-#     eZ = np.exp(Z)
-#     return eZ / np.sum(eZ, axis=1)
-#
-#
-# @nb.jit("{f2}({f2})".format(f2=Xd(2)), nopython=True)
-# def softmax_p(A):
-#     I = np.eye(A.shape[1], dtype=floatX)
-#     idx = np.arange(A.shape[1])
-#     return A * (A[..., None] - I[None, ...])[:, idx, idx]
+@nb.jit(nopython=True)
+def _hard_sigmoid_p(a):
+    return s05 if s0 < a < s1 else s0
+
+
+def _ufunc(kernel, signatures=finfout):
+    return nb.vectorize(signatures, nopython=True)(kernel.py_func)
+
+
+sigmoid, sigmoid_p = _ufunc(_sigmoid), _ufunc(_sigmoid_p)
+tanh, tanh_p = _ufunc(_tanh), _ufunc(_tanh_p)
+sqrt, sqrt_p = _ufunc(_sqrt), _ufunc(_sqrt_p)
+relu, relu_p = _ufunc(_relu), _ufunc(_relu_p)
+leakyrelu, leakyrelu_p = _ufunc(_leakyrelu, finfout_param), _ufunc(_leakyrelu_p, finfout_param)
+hard_sigmoid, hard_sigmoid_p = _ufunc(_hard_sigmoid), _ufunc(_hard_sigmoid_p)
+
+
+@nb.jit(floatsigs("void({t}[:, :],{t}[:, :])"), nopython=True)
+def softmax(Z, out):
+    # Row-wise, the row maximum is subtracted before exponentiation for numerical stability
+    for i in range(Z.shape[0]):
+        rowmax = Z[i, 0]
+        for j in range(1, Z.shape[1]):
+            rowmax = max(rowmax, Z[i, j])
+        rowsum = s0
+        for j in range(Z.shape[1]):
+            out[i, j] = np.exp(Z[i, j] - rowmax)
+            rowsum += out[i, j]
+        for j in range(Z.shape[1]):
+            out[i, j] /= rowsum
@@ -0,0 +1,92 @@
+import numba as nb
+import numpy as np
+from ._llactivation import sigmoid, tanh, relu
+from ._llrecurrent import project_inputs, sequence_dot, backproject
+
+
+def _gru(activation):
+    """Forward and inference kernels of the GRU with the candidate nonlinearity compiled in"""
+
+    @nb.jit(nopython=True)
+    def gru_forward(X, W, b, h0, active):
+        outdim = W.shape[-1] // 3
+        time, batch, indim = X.shape
+        Wur = np.ascontiguousarray(W[indim:, :2*outdim])
+        Wo = np.ascontiguousarray(W[indim:, 2*outdim:])
+
+        G = project_inputs(X, W[:indim], b)  # U[:o], R[o:2o], cand[2o:]
+        O = np.zeros((time, batch, outdim), dtype=G.dtype)
+
+        for t in range(time):
+            n = active[t]
+            h = O[t-1] if t else h0
+            G[t, :n, :2*outdim] += np.dot(h[:n], Wur)
+            G[t, :n, :2*outdim] = sigmoid(G[t, :n, :2*outdim])  # sigmoid to gates
+            G[t, :n, 2*outdim:] += np.dot(G[t, :n, outdim:2*outdim] * h[:n], Wo)  # reset gated state
+            G[t, :n, 2*outdim:] = activation(G[t, :n, 2*outdim:])  # nonlin to candidate
+            # O = U * h + (1 - U) * cand
+            O[t, :n] = G[t, :n, 2*outdim:] + G[t, :n, :outdim] * (h[:n] - G[t, :n, 2*outdim:])
+            O[t, n:] = h[n:]  # finished sequences carry their state
+        return np.concatenate((O.ravel(), G.ravel()))
+
+    @nb.jit(nopython=True)
+    def gru_predict(X, W, b, return_seq, h0, active):
+        outdim = W.shape[-1] // 3
+        time, batch, indim = X.shape
+        Wur = np.ascontiguousarray(W[indim:, :2*outdim])
+        Wo = np.ascontiguousarray(W[indim:, 2*outdim:])
+        XW = project_inputs(X, W[:indim], b)
+
+        O = np.zeros((time if return_seq else 1, batch, outdim), dtype=X.dtype)
+        h = h0.copy()
+
+        for t in range(time):
+            n = active[t]
+            gates = sigmoid(XW[t, :n, :2*outdim] + np.dot(h[:n], Wur))
+            U = gates[:, :outdim]
+            cand = activation(XW[t, :n, 2*outdim:] + np.dot(gates[:, outdim:] * h[:n], Wo))
+            h[:n] = U * h[:n] + (1. - U) * cand
+            if return_seq:
+                O[t] = h
+        if not return_seq:
+            O[0] = h
+        return O
+
+    return gru_forward, gru_predict
+
+
+gru_forward_tanh, gru_predict_tanh = _gru(tanh)
+gru_forward_relu, gru_predict_relu = _gru(relu)
+
+
+@nb.jit(nopython=True)
+def gru_backward(X, O, E, W, G, dG, h0, active):
+    # dG holds the gate derivatives on entry, they are turned into the preactivation deltas in place
+    dimo = W.shape[-1] // 3
+    indim = X.shape[-1]
+    Wur = np.ascontiguousarray(W[indim:, :2*dimo])
+    Wo = np.ascontiguousarray(W[indim:, 2*dimo:])
+    dh = np.zeros_like(O[-1])  # the carried state of finished sequences keeps its delta here
+    K = np.empty_like(O)  # the reset gated states seen by the candidate
+
+    for t in range(E.shape[0] - 1, -1, -1):
+        n = active[t]
+        dG[t, n:] = 0.
+        h = (O[t-1] if t else h0)[:n]
+        K[t] = G[t, :, dimo:2*dimo] * (O[t-1] if t else h0)
+        dh += E[t]
+        dhn = dh[:n]
+        dG[t, :n, 2*dimo:] *= dhn * (1. - G[t, :n, :dimo])  # dcand
+        dG[t, :n, :dimo] *= dhn * (h - G[t, :n, 2*dimo:])  # dU
+        dK = np.dot(np.ascontiguousarray(dG[t, :n, 2*dimo:]), Wo.T)
+        dG[t, :n, dimo:2*dimo] *= dK * h  # dR
+        if t:
+            dhn *= G[t, :n, :dimo]
+            dhn += dK * G[t, :n, dimo:2*dimo]
+            dhn += np.dot(np.ascontiguousarray(dG[t, :n, :2*dimo]), Wur.T)
+
+    nablaW = np.empty_like(W)
+    nablaW[indim:, :2*dimo] = sequence_dot(O[:-1], dG[1:, :, :2*dimo])
+    nablaW[indim:, :2*dimo] += np.dot(h0.T, np.ascontiguousarray(dG[0, :, :2*dimo]))
+    nablaW[indim:, 2*dimo:] = sequence_dot(K, dG[:, :, 2*dimo:])
+    return backproject(X, dG, W, nablaW)
@@ -1,67 +1,92 @@
 import numba as nb
 import numpy as np
 from ._llactivation import sigmoid, tanh, relu
+from ._llrecurrent import project_inputs, sequence_dot, backproject
 
 
-@nb.jit(nopython=True)
-def lstm_forward(X, W, b, activation):
-    outdim = W.shape[-1] // 4
-    time, batch, indim = X.shape
+def _lstm(activation):
+    """Forward and inference kernels of the LSTM with the candidate and state nonlinearity compiled in"""
 
-    Z = np.zeros((time, batch, indim+outdim))
-    O = np.zeros((time, batch, outdim))
-    T = np.zeros((time, 6, batch, outdim))  # C[0], Ca[1], cand[2], f[3], i[4], o[5]
+    @nb.jit(nopython=True)
+    def lstm_forward(X, W, b, h0, C0, active):
+        outdim = W.shape[-1] // 4
+        time, batch, indim = X.shape
+        Wh = W[indim:]
 
-    for t in range(time):
-        Z[t] = np.concatenate((X[t], O[t-1]), axis=-1)
-        p = np.dot(Z[t], W) + b
-        p[:, :outdim] = activation(p[:, :outdim])  # nonlin to candidate
+        G = project_inputs(X, W[:indim], b)  # cand[:o], f[o:2o], i[2o:3o], o[3o:]
+        O = np.zeros((time, batch, outdim), dtype=G.dtype)
+        C = np.zeros((time, batch, outdim), dtype=G.dtype)
+        Ca = np.zeros((time, batch, outdim), dtype=G.dtype)
 
-        p[:, outdim:] = sigmoid(p[:, outdim:])  # sigmoid to gates
-        T[t, 2] = p[:, :outdim]  # candidate
-        T[t, 3] = p[:, outdim:2*outdim]  # forget
-        T[t, 4] = p[:, 2*outdim:3*outdim]  # input
-        T[t, 5] = p[:, 3*outdim:]  # output
-        T[t, 0] = T[t-1, 0] * T[t, 3] + T[t, 2] * T[t, 4]  # Ct = Ct-1 * f + cand * i
+        for t in range(time):
+            n = active[t]
+            h = O[t-1] if t else h0
+            Cprev = C[t-1] if t else C0
+            G[t, :n] += np.dot(h[:n], Wh)
+            G[t, :n, :outdim] = activation(G[t, :n, :outdim])  # nonlin to candidate
+            G[t, :n, outdim:] = sigmoid(G[t, :n, outdim:])  # sigmoid to gates
+            C[t, :n] = G[t, :n, :outdim] * G[t, :n, 2*outdim:3*outdim]  # Ct = Ct-1 * f + cand * i
+            C[t, :n] += Cprev[:n] * G[t, :n, outdim:2*outdim]
+            Ca[t, :n] = activation(C[t, :n])  # nonlin to state
+            O[t, :n] = Ca[t, :n] * G[t, :n, 3*outdim:]  # O = f(C) * o
+            O[t, n:] = h[n:]  # finished sequences carry their state
+            C[t, n:] = Cprev[n:]
+        return np.concatenate((O.ravel(), C.ravel(), Ca.ravel(), G.ravel()))
 
-        T[t, 1] = activation(T[t, 0])  # nonlin to state
-        O[t] = T[t, 1] * T[t, 5]  # O = f(C) * o
-    return np.concatenate((O.ravel(), Z.ravel(), T.ravel()))
+    @nb.jit(nopython=True)
+    def lstm_predict(X, W, b, return_seq, h0, C0, active):
+        outdim = W.shape[-1] // 4
+        time, batch, indim = X.shape
+        XW = project_inputs(X, W[:indim], b)
+        Wh = W[indim:]
 
+        O = np.zeros((time if return_seq else 1, batch, outdim), dtype=X.dtype)
+        h = h0.copy()
+        C = C0.copy()
 
-@nb.jit(nopython=True)
-def lstm_backward(Z, bwO, E, W, cache, bwcache):
-    # bwcache: bwCa, bwcand, bwf, bwi, bwo
-    dimo = W.shape[-1] // 4
-    time, batch, zdim = Z.shape
-    indim = zdim - dimo
+        for t in range(time):
+            n = active[t]
+            p = XW[t, :n] + np.dot(h[:n], Wh)
+            cand = activation(p[:, :outdim])
+            gates = sigmoid(p[:, outdim:])
+            C[:n] = C[:n] * gates[:, :outdim] + cand * gates[:, outdim:2*outdim]  # Ct = Ct-1 * f + cand * i
+            h[:n] = activation(C[:n]) * gates[:, 2*outdim:]  # O = f(C) * o
+            if return_seq:
+                O[t] = h
+        if not return_seq:
+            O[0] = h
+        return np.concatenate((O.ravel(), C.ravel()))
 
-    C, Ca, cand, f, i, o = cache[0], cache[1], cache[2], cache[3], cache[4], cache[5]
+    return lstm_forward, lstm_predict
 
-    nablaW = np.zeros_like(W)
-    nablab = np.zeros(dimo*4)
-    deltaC = np.zeros_like(bwO[-1])
-    deltaX = np.zeros((time, batch, indim))
 
-    for t in range(time - 1, -1, -1):
-        deltaC += E[t] * o[t] * bwcache[t, :, :dimo]  # backwards Ca
-        state_yesterday = C[t-1]
-        if not t:
-            state_yesterday *= 0.
+lstm_forward_tanh, lstm_predict_tanh = _lstm(tanh)
+lstm_forward_relu, lstm_predict_relu = _lstm(relu)
 
-        do = Ca[t] * E[t]
-        df = deltaC * state_yesterday
-        di = deltaC * cand[t]
-        dcand = deltaC * i[t]
 
-        dgates = np.concatenate((dcand, df, di, do), axis=-1) * bwcache[t, :, dimo:]  # backwards gates
-        deltaC *= f[t]
+@nb.jit(nopython=True)
+def lstm_backward(X, O, E, W, C, Ca, G, bwCa, dG, h0, C0, active):
+    # dG holds the gate derivatives on entry, they are turned into the preactivation deltas in place
+    dimo = W.shape[-1] // 4
+    Wh = W[X.shape[-1]:]
+    deltaC = np.zeros_like(O[-1])
 
-        nablaW += np.dot(Z[t].T, dgates)
-        for ix in range(len(nablab)):
-            nablab[ix] += dgates[:, ix].sum()
-        deltaZ = np.dot(dgates, W.T)
-        deltaX[t] = deltaZ[:, :-dimo]
-        E[t-1] += deltaZ[:, indim:]
+    for t in range(E.shape[0] - 1, -1, -1):
+        n = active[t]
+        if t:
+            E[t-1, n:] += E[t, n:]  # the carried state passes its delta on unchanged
+        dG[t, n:] = 0.
+        Cprev = C[t-1] if t else C0
+        dC = deltaC[:n]
+        dC += E[t, :n] * G[t, :n, 3*dimo:] * bwCa[t, :n]  # backwards Ca
+        dG[t, :n, :dimo] *= dC * G[t, :n, 2*dimo:3*dimo]  # dcand
+        dG[t, :n, dimo:2*dimo] *= dC * Cprev[:n]  # df
+        dG[t, :n, 2*dimo:3*dimo] *= dC * G[t, :n, :dimo]  # di
+        dG[t, :n, 3*dimo:] *= Ca[t, :n] * E[t, :n]  # do
+        dC *= G[t, :n, dimo:2*dimo]
+        if t:
+            E[t-1, :n] += np.dot(dG[t, :n], Wh.T)
 
-    return np.concatenate((deltaX.ravel(), nablaW.ravel(), nablab.ravel()))
+    nablaW = np.empty_like(W)
+    nablaW[X.shape[-1]:] = sequence_dot(O[:-1], dG[1:]) + np.dot(h0.T, dG[0])
+    return backproject(X, dG, W, nablaW)
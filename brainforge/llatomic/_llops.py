@@ -1,9 +1,51 @@
 import numba as nb
 import numpy as np
 
-from ._llutil import Xd
+from ._llutil import floatsigs
+from ._llactivation import _sigmoid, _sigmoid_p, _tanh, _tanh_p, _relu, _relu_p
 
 
-@nb.jit("{f2}({f2},{f2},{f1})".format(f1=Xd(1), f2=Xd(2)), nopython=True)
+@nb.jit(floatsigs("{f2}({f2},{f2},{f1})", f1=1, f2=2), nopython=True)
 def dense_forward(X, W, b):
     return np.dot(X, W) + b
+
+
+@nb.jit(floatsigs("Tuple(({f2},{f1},{f2}))({f2},{f2},{f2})", f1=1, f2=2), nopython=True)
+def dense_backward(X, E, W):
+    dW = np.dot(X.T, E)
+    db = E.sum(axis=0)
+    dX = np.dot(E, W.T)
+    return dW, db, dX
+
+
+def _fused_dense(act, act_p):
+    """Dense kernels with the elementwise activation applied in the GEMM output buffer.
+
+    The forward pass never materializes a separate pre-activation array,
+    the backward pass scales E by the activation derivative in place."""
+
+    @nb.jit(nopython=True)
+    def forward(X, W, b):
+        A = np.dot(X, W)
+        for i in range(A.shape[0]):
+            for j in range(A.shape[1]):
+                A[i, j] = act(A[i, j] + b[j])
+        return A
+
+    @nb.jit(nopython=True)
+    def backward(X, E, W, A):
+        db = np.zeros(E.shape[1], dtype=E.dtype)
+        for i in range(E.shape[0]):
+            for j in range(E.shape[1]):
+                E[i, j] *= act_p(A[i, j])
+                db[j] += E[i, j]
+        dW = np.dot(X.T, E)
+        dX = np.dot(E, W.T)
+        return dW, db, dX
+
+    return forward, backward
+
+
+dense_forward_sigmoid, dense_backward_sigmoid = _fused_dense(_sigmoid, _sigmoid_p)
+dense_forward_tanh, dense_backward_tanh = _fused_dense(_tanh, _tanh_p)
+dense_forward_relu, dense_backward_relu = _fused_dense(_relu, _relu_p)
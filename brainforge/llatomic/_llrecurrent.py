@@ -4,45 +4,82 @@ from ._llactivation import relu, tanh
 
 
 @nb.jit(nopython=True)
-def recurrent_forward_relu(X, W, b):
-    outdim = W.shape[-1]
+def project_inputs(X, Wx, b):
+    """X.Wx + b for every timestep as a single GEMM"""
     time, batch, indim = X.shape
-    O = np.zeros((time, batch, outdim))
-    for t in range(time):
-        Z = np.concatenate((X[t], O[t-1]), axis=-1)
-        preact = np.dot(Z, W) + b
-        O[t] = relu(preact.ravel()).reshape(*preact.shape)
-    return O
+    P = np.dot(X.reshape(time*batch, indim), Wx) + b
+    return P.reshape(time, batch, Wx.shape[-1])
 
 
 @nb.jit(nopython=True)
-def recurrent_forward_tanh(X, W, b):
-    outdim = W.shape[-1]
+def sequence_dot(A, B):
+    """The sum of A[t].T.B[t] over all timesteps as a single GEMM"""
+    flatA = np.ascontiguousarray(A).reshape(A.shape[0]*A.shape[1], A.shape[2])
+    flatB = np.ascontiguousarray(B).reshape(B.shape[0]*B.shape[1], B.shape[2])
+    return np.dot(flatA.T, flatB)
+
+
+@nb.jit(nopython=True)
+def backproject(X, dP, W, nablaW):
+    """Fills the input half of nablaW and returns the flat (dX, nablaW, nablab) vector"""
     time, batch, indim = X.shape
-    O = np.zeros((time, batch, outdim))
-    Z = np.zeros((time, batch, indim+outdim))
-    for t in range(time):
-        Z[t] = np.concatenate((X[t], O[t-1]), axis=-1)
-        preact = np.dot(Z[t], W) + b
-        O[t] = tanh(preact.ravel()).reshape(*preact.shape)
-    return np.concatenate((O.ravel(), Z.ravel()))
+    flatdP = dP.reshape(time*batch, W.shape[-1])
+    nablaW[:indim] = sequence_dot(X, dP)
+    nablab = flatdP.sum(axis=0)
+    dX = np.dot(flatdP, W[:indim].T)
+    return np.concatenate((dX.ravel(), nablaW.ravel(), nablab))
+
+
+def _recurrent(activation):
+    """Forward and inference kernels of the simple RNN with the nonlinearity compiled in"""
+
+    @nb.jit(nopython=True)
+    def recurrent_forward(X, W, b, h0, active):
+        indim = X.shape[-1]
+        Wh = W[indim:]
+        O = project_inputs(X, W[:indim], b)
+        for t in range(O.shape[0]):
+            n = active[t]
+            h = O[t-1] if t else h0
+            O[t, :n] = activation(O[t, :n] + np.dot(h[:n], Wh))
+            O[t, n:] = h[n:]  # finished sequences carry their state
+        return O
+
+    @nb.jit(nopython=True)
+    def recurrent_predict(X, W, b, return_seq, h0, active):
+        time, batch, indim = X.shape
+        outdim = W.shape[-1]
+        XW = project_inputs(X, W[:indim], b)
+        Wh = W[indim:]
+        O = np.zeros((time if return_seq else 1, batch, outdim), dtype=X.dtype)
+        h = h0.copy()
+        for t in range(time):
+            n = active[t]
+            h[:n] = activation(XW[t, :n] + np.dot(h[:n], Wh))
+            if return_seq:
+                O[t] = h
+        if not return_seq:
+            O[0] = h
+        return O
+
+    return recurrent_forward, recurrent_predict
+
+
+recurrent_forward_relu, recurrent_predict_relu = _recurrent(relu)
+recurrent_forward_tanh, recurrent_predict_tanh = _recurrent(tanh)
 
 
 @nb.jit(nopython=True)
-def recurrent_backward(Z, bwO, E, W):
-    indim = Z.shape[-1] - bwO.shape[-1]
-    nablaW = np.zeros_like(W)
-    nablab = np.zeros((W.shape[-1],))
-    dX = np.zeros((Z.shape[0], Z.shape[1], Z.shape[2]-bwO.shape[-1]))
-
-    for t in range(Z.shape[0]-1, -1, -1):
-        E[t] *= bwO[t]
-        nablaW += np.dot(Z[t].T, E[t])
-        deltaZ = np.dot(E[t], W.T)
-        for i in range(len(nablab)):
-            nablab[i] += E[t, :, i].sum()
+def recurrent_backward(X, O, bwO, E, W, h0, active):
+    Wh = W[X.shape[-1]:]
+    for t in range(E.shape[0]-1, -1, -1):
+        n = active[t]
         if t:
-            E[t-1] += deltaZ[:, indim:]
-
-    dX += E[..., :indim]
-    return np.concatenate((dX.ravel(), nablaW.ravel(), nablab.ravel()))
+            E[t-1, n:] += E[t, n:]  # the carried state passes its delta on unchanged
+        E[t, n:] = 0.
+        E[t, :n] *= bwO[t, :n]
+        if t:
+            E[t-1, :n] += np.dot(E[t, :n], Wh.T)
+    nablaW = np.empty_like(W)
+    nablaW[X.shape[-1]:] = sequence_dot(O[:-1], E[1:]) + np.dot(h0.T, E[0])
+    return backproject(X, E, W, nablaW)
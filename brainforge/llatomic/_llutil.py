@@ -1,9 +1,31 @@
 import numba as nb
 
-from brainforge.config import floatX
+from brainforge.config import floatX, numeric
 
 nbfloatX = nb.float32 if floatX == "float32" else nb.float64
 
 
+nbfloats = (nb.float32, nb.float64)
+
+
 def Xd(X, t=nbfloatX):
     return "{t}[{0}]".format(",".join([":"]*(X-1) + ["::1"]), t=t)
+
+
+def floatsigs(template, **ndims):
+    """Instantiates a signature template for both float widths.
+
+    Kernels are compiled for float32 and float64 alike, so they follow the floatX policy
+    even if it changes after import. {t} is the scalar type, {i} is intp and every
+    keyword maps a placeholder to the dimensionality of a C-contiguous array."""
+    return [template.format(t=t, i=nb.intp, **{name: Xd(ndim, t) for name, ndim in ndims.items()})
+            for t in nbfloats]
+
+
+def use_parallel(parallel=None):
+    """Resolves the parallel flag against the config and applies the configured thread count"""
+    if parallel is None:
+        parallel = numeric.parallel
+    if parallel and numeric.threads > 0:
+        nb.set_num_threads(min(numeric.threads, nb.config.NUMBA_NUM_THREADS))
+    return parallel
@@ -1,28 +1,48 @@
 import abc
 
+import numpy as np
+
 from ._llactivation import (
     sigmoid, sigmoid_p,
     tanh, tanh_p,
+    sqrt, sqrt_p,
     relu, relu_p,
-    # softmax, softmax_p,
+    leakyrelu, leakyrelu_p,
+    hard_sigmoid, hard_sigmoid_p,
+    softmax,
 )
+from ..atomic.activation_op import Linear
 
 
 class LLActivation(abc.ABC):
+
+    """Compiled elementwise nonlinearity with the interface of atomic.ActivationFunction.
+
+    forward and backward write into out if it is given, which may be the input array itself."""
+
     type = ""
 
     def __init__(self):
         self.llact, self.llactp = {
             "sigmoid": (sigmoid, sigmoid_p),
             "tanh": (tanh, tanh_p),
-            "relu": (relu, relu_p)
+            "sqrt": (sqrt, sqrt_p),
+            "relu": (relu, relu_p),
+            "hardsigmoid": (hard_sigmoid, hard_sigmoid_p),
         }[self.type]
 
-    def forward(self, X):
-        return self.llact(X.ravel()).reshape(X.shape)
+    def forward(self, Z, out=None):
+        if out is None:
+            return self.llact(Z)
+        return self.llact(Z, out)
+
+    def backward(self, A, out=None):
+        if out is None:
+            return self.llactp(A)
+        return self.llactp(A, out)
 
-    def backward(self, A):
-        return self.llactp(A.ravel()).reshape(A.shape)
+    def __str__(self):
+        return self.type
 
 
 class Sigmoid(LLActivation):
@@ -41,13 +61,50 @@ class ReLU(LLActivation):
     type = "relu"
 
 
-# class SoftMax:
-#     type = "softmax"
-#     forward = softmax
-#     true_backward = softmax_p
-#
-#     def backward(self, A):
-#         return s1
+class HardSigmoid(LLActivation):
+    type = "hardsigmoid"
+
+
+class LeakyReLU(LLActivation):
+
+    type = "leakyrelu"
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.llact, self.llactp = leakyrelu, leakyrelu_p
+
+    def forward(self, Z, out=None):
+        # alpha is passed with the dtype of Z, so float32 arrays select the float32 loop
+        alpha = Z.dtype.type(self.alpha)
+        if out is None:
+            return self.llact(Z, alpha)
+        return self.llact(Z, alpha, out)
+
+    def backward(self, A, out=None):
+        alpha = A.dtype.type(self.alpha)
+        if out is None:
+            return self.llactp(A, alpha)
+        return self.llactp(A, alpha, out)
+
+
+class SoftMax:
+
+    type = "softmax"
+
+    def forward(self, Z, out=None):
+        if out is None:
+            out = np.empty_like(Z)
+        softmax(Z, out)
+        return out
+
+    def backward(self, A, out=None):
+        # The derivative is folded into the cross-entropy cost, like in atomic.SoftMax
+        return 1.
+
+    def __str__(self):
+        return self.type
 
 
-llactivations = {"sigmoid": Sigmoid, "tanh": Tanh, "relu": ReLU}
+llactivations = {"sigmoid": Sigmoid, "tanh": Tanh, "sqrt": Sqrt,
+                 "linear": Linear, "relu": ReLU, "leakyrelu": LeakyReLU,
+                 "softmax": SoftMax, "hard_sigmoid": HardSigmoid}
@@ -1,15 +1,40 @@
-from ._llops import dense_forward
+import numpy as np
+
+from . import _llops
+from ._llops import dense_forward, dense_backward
 from brainforge.util.typing import zX
 
 
 class DenseOp:
 
+    """Compiled affine transformation, optionally fused with its activation.
+
+    forward/backward compute the plain affine transformation and its gradients.
+    If activation is one of the fusable types, forward_activated/backward_activated
+    run the activation (and its derivative) inside the same compiled kernel."""
+
+    fusable = ("sigmoid", "tanh", "relu")
+
+    def __init__(self, activation="linear"):
+        self.activation = str(activation)
+        self.fused = self.activation in self.fusable
+        if self.fused:
+            self.fused_forward = getattr(_llops, "dense_forward_" + self.activation)
+            self.fused_backward = getattr(_llops, "dense_backward_" + self.activation)
+
     @staticmethod
     def forward(X, W, b=None):
         if b is None:
             b = zX(W.shape[-1])
-        return dense_forward(X, W, b)
+        return dense_forward(np.ascontiguousarray(X), W, b)
 
     @staticmethod
     def backward(X, E, W):
-        raise NotImplementedError("No backwards for DenseOp!")
+        return dense_backward(np.ascontiguousarray(X), np.ascontiguousarray(E), W)
+
+    def forward_activated(self, X, W, b):
+        return self.fused_forward(np.ascontiguousarray(X), W, b)
+
+    def backward_activated(self, X, E, W, A):
+        """E is scaled by the activation derivative at A in place, if it is contiguous"""
+        return self.fused_backward(np.ascontiguousarray(X), np.ascontiguousarray(E), W, A)
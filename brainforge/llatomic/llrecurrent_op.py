@@ -1,12 +1,23 @@
 import numpy as np
 
-from ._llrecurrent import recurrent_forward_relu, recurrent_forward_tanh, recurrent_backward
-from ._lllstm import lstm_forward, lstm_backward
+from ._llrecurrent import (
+    recurrent_forward_relu, recurrent_forward_tanh, recurrent_backward,
+    recurrent_predict_relu, recurrent_predict_tanh
+)
+from ._lllstm import lstm_forward_tanh, lstm_forward_relu, lstm_predict_tanh, lstm_predict_relu, lstm_backward
+from ._llgru import gru_forward_tanh, gru_forward_relu, gru_predict_tanh, gru_predict_relu, gru_backward
 from .llactivation_op import llactivations
+from ..atomic.recurrent_op import active_rows, lstm_preactivations
 
 sigmoid = llactivations["sigmoid"]()
 
 
+def _split_gradients(vector, Xshape, Wshape):
+    g = int(np.prod(Xshape))
+    w = int(np.prod(Wshape))
+    return vector[:g].reshape(Xshape), vector[g:g+w].reshape(Wshape), vector[g+w:]
+
+
 class ROpBase:
 
     def __init__(self, activation):
@@ -16,6 +27,17 @@ class ROpBase:
         self.bwlow = recurrent_backward
         self.fwlow = None
 
+    @staticmethod
+    def _initial_state(state, n, X, outdim):
+        """The carried state as contiguous arrays of the input dtype, zeros if there is no carried state"""
+        if state is None:
+            return tuple(np.zeros((n, X.shape[1], outdim), dtype=X.dtype))
+        return tuple(np.ascontiguousarray(s, dtype=X.dtype) for s in state)
+
+    @staticmethod
+    def _active(lengths, X):
+        return active_rows(lengths, *X.shape[:2])
+
 
 class RecurrentOp(ROpBase):
 
@@ -24,59 +46,109 @@ class RecurrentOp(ROpBase):
         self.fwlow = {
             "tanh": recurrent_forward_tanh, "relu": recurrent_forward_relu
         }[activation.lower()]
+        self.predlow = {
+            "tanh": recurrent_predict_tanh, "relu": recurrent_predict_relu
+        }[activation.lower()]
 
-    def forward(self, X, W, b):
-        t, m, di = X.shape
-        do, = b.shape
-        g = t*m*do
-        vector = self.fwlow(X, W, b)
-        O = vector[:g].reshape(t, m, do)
-        Z = vector[g:].reshape(t, m, di+do)
-        return O, Z
-
-    def backward(self, Z, O, E, W):
-        t, m, z = Z.shape
-        do = O.shape[-1]
-        di = z - do
-        g = t*m*di
-        vector = self.bwlow(Z, self.llact.backward(O), E, W)
-        dX = vector[:g].reshape(t, m, di)
-        gW = vector[g:g+W.size].reshape(W.shape)
-        gb = vector[g+W.size:]
-        return dX, gW, gb
+    def forward(self, X, W, b, state=None, lengths=None):
+        X = np.ascontiguousarray(X)
+        return self.fwlow(X, W, b, *self._initial_state(state, 1, X, W.shape[-1]), self._active(lengths, X))
 
+    def predict(self, X, W, b, return_seq=False, state=None, lengths=None):
+        X = np.ascontiguousarray(X)
+        O = self.predlow(X, W, b, return_seq, *self._initial_state(state, 1, X, W.shape[-1]), self._active(lengths, X))
+        return (O if return_seq else O[0]), (O[-1],)
 
-class LSTMOp(ROpBase):
+    def backward(self, X, O, E, W, state=None, lengths=None):
+        X = np.ascontiguousarray(X)
+        h0, = self._initial_state(state, 1, X, W.shape[-1])
+        vector = self.bwlow(X, O, self.llact.backward(O), np.ascontiguousarray(E), W, h0, self._active(lengths, X))
+        return _split_gradients(vector, X.shape, W.shape)
 
-    def forward(self, X, W, b):
-        do = W.shape[-1] // 4
-        t, m, di = X.shape
 
-        Oshape = (t, m, do)
-        Zshape = (t, m, do+di)
-        cacheshape = (t, 6, m, do)
-        Obord = np.prod(Oshape)
-        Zbord = np.prod(Zshape) + Obord
+class LSTMOp(ROpBase):
 
-        vector = lstm_forward(X, W, b, self.llact.llact)
+    def __init__(self, activation, checkpoint=False):
+        super().__init__(activation)
+        self.checkpoint = checkpoint
+        self.bwlow = lstm_backward
+        self.fwlow, self.predlow = {
+            "tanh": (lstm_forward_tanh, lstm_predict_tanh), "relu": (lstm_forward_relu, lstm_predict_relu)
+        }[activation.lower()]
 
-        O = vector[:Obord].reshape(*Oshape)
-        Z = vector[Obord:Zbord].reshape(*Zshape)
-        cache = vector[Zbord:].reshape(*cacheshape)
-        return O, Z, cache.transpose(1, 0, 2, 3)
+    def forward(self, X, W, b, state=None, lengths=None):
+        """Returns the output and the cache (C, Ca, G) of cell states, activated cell states and gates.
+
+        With checkpoint set only (C,) is cached, O and C are copied out so the rest of the result is freed."""
+        t, m, _ = X.shape
+        g = t*m*W.shape[-1] // 4
+        X = np.ascontiguousarray(X)
+        vector = self.fwlow(X, W, b, *self._initial_state(state, 2, X, W.shape[-1] // 4), self._active(lengths, X))
+        if self.checkpoint:
+            O, C = vector[:2*g].reshape(2, t, m, -1).copy()
+            return O, (C,)
+        O, C, Ca = vector[:3*g].reshape(3, t, m, -1)
+        G = vector[3*g:].reshape(t, m, -1)
+        return O, (C, Ca, G)
+
+    def predict(self, X, W, b, return_seq=False, state=None, lengths=None):
+        do = W.shape[-1] // 4
+        X = np.ascontiguousarray(X)
+        vector = self.predlow(X, W, b, return_seq, *self._initial_state(state, 2, X, do), self._active(lengths, X))
+        C = vector[-X.shape[1]*do:].reshape(X.shape[1], do)
+        O = vector[:-C.size].reshape(-1, X.shape[1], do)
+        return (O if return_seq else O[0]), (O[-1], C)
 
-    def backward(self, Z, O, E, W, cache):
+    def backward(self, X, O, E, W, cache, state=None, lengths=None, b=None):
         do = W.shape[-1] // 4
-        m, t, dz = Z.shape
-        di = dz - do
-        g = m*t*di
-
-        bwcache = cache[1:].copy()
-        bwcache[:2] = self.llact.backward(bwcache[:2])
-        bwcache[2:] = sigmoid.backward(bwcache[2:])
-        bwO = self.llact.backward(O)
-        vector = lstm_backward(Z, bwO, E, W, cache, np.concatenate(bwcache, axis=-1))
-        dX = vector[:g].reshape(t, m, di)
-        gW = vector[g:g+W.size].reshape(W.shape)
-        gb = vector[g+W.size:]
-        return dX, gW, gb
+        X = np.ascontiguousarray(X)
+        h0, C0 = self._initial_state(state, 2, X, do)
+        if len(cache) == 1:
+            # The gates are recomputed from the outputs, like in atomic.LSTMOp
+            C, = cache
+            G = lstm_preactivations(X, O, W, b, h0)
+            self.llact.forward(G[..., :do], out=G[..., :do])
+            sigmoid.forward(G[..., do:], out=G[..., do:])
+            cache = C, self.llact.forward(C), G
+        C, Ca, G = cache
+
+        dG = sigmoid.backward(G)
+        self.llact.backward(G[..., :do], out=dG[..., :do])
+        bwCa = self.llact.backward(Ca)
+        vector = self.bwlow(X, O, np.ascontiguousarray(E), W, C, Ca, G, bwCa, dG, h0, C0, self._active(lengths, X))
+        return _split_gradients(vector, X.shape, W.shape)
+
+
+class GRUOp(ROpBase):
+
+    def __init__(self, activation):
+        super().__init__(activation)
+        self.bwlow = gru_backward
+        self.fwlow, self.predlow = {
+            "tanh": (gru_forward_tanh, gru_predict_tanh), "relu": (gru_forward_relu, gru_predict_relu)
+        }[activation.lower()]
+
+    def forward(self, X, W, b, state=None, lengths=None):
+        """Returns the output and the activated gates G, the cache of the backward pass"""
+        t, m, _ = X.shape
+        g = t*m*W.shape[-1] // 3
+        X = np.ascontiguousarray(X)
+        vector = self.fwlow(X, W, b, *self._initial_state(state, 1, X, W.shape[-1] // 3), self._active(lengths, X))
+        return vector[:g].reshape(t, m, -1), vector[g:].reshape(t, m, -1)
+
+    def predict(self, X, W, b, return_seq=False, state=None, lengths=None):
+        X = np.ascontiguousarray(X)
+        O = self.predlow(X, W, b, return_seq, *self._initial_state(state, 1, X, W.shape[-1] // 3),
+                         self._active(lengths, X))
+        return (O if return_seq else O[0]), (O[-1],)
+
+    def backward(self, X, O, E, W, cache, state=None, lengths=None):
+        do = W.shape[-1] // 3
+        G = cache
+        X = np.ascontiguousarray(X)
+        h0, = self._initial_state(state, 1, X, do)
+
+        dG = sigmoid.backward(G)
+        self.llact.backward(G[..., 2*do:], out=dG[..., 2*do:])
+        vector = self.bwlow(X, O, np.ascontiguousarray(E), W, G, dG, h0, self._active(lengths, X))
+        return _split_gradients(vector, X.shape, W.shape)
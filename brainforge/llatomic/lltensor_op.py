@@ -1,145 +1,508 @@
 import numpy as np
 import numba as nb
 
-from ._llutil import nbfloatX, Xd
+from ._llutil import floatsigs, use_parallel
+from ..atomic.tensor_op import (
+    ConvolutionOp as NpConvolutionOp, DepthwiseConvolutionOp as NpDepthwiseConvolutionOp,
+    FilterTransformCache, check_layout, spatial_shape, conv_padding, pad_input, dilate, pool_argmax_dtype,
+    batch_chunks, chunked_backward, resolve_memory_budget
+)
 
-intX = nb.typeof(int())
 
+# Kernels below loop over the batch (and channel) dimensions with nb.prange.
+# They are compiled twice: the plain variant runs prange as an ordinary range,
+# the *_parallel variant distributes the iterations over numba's thread pool.
 
-@nb.jit("{f3}({f4},{f4})".format(f3=Xd(3), f4=Xd(4)),
-        nopython=True)
-def _reshape_receptive_fields(A, F):
+def _reshape_receptive_fields_kernel(A, F, stride):
     im, ic, iy, ix = A.shape
     # fx, fy, fc, nf = F.shape
     nf, fc, fy, fx = F.shape
-    oy, ox = iy - fy + 1, ix - fx + 1
+    oy, ox = (iy - fy) // stride + 1, (ix - fx) // stride + 1
     recfield_size = fx*fy*fc
-    rfields = np.zeros((im, oy * ox, recfield_size), dtype=nbfloatX)
-    for m in range(im):
-        for sy in range(oy):
-            for sx in range(ox):
-                rfields[m, sy * ox + sx] = A[m, :, sy:sy + fy, sx:sx + fx].ravel()
+    rfields = np.empty((im, oy * ox, recfield_size), dtype=A.dtype)
+    for m in nb.prange(im):
+        for y in range(oy):
+            for x in range(ox):
+                sy, sx = y * stride, x * stride
+                rfields[m, y * ox + x] = A[m, :, sy:sy + fy, sx:sx + fx].ravel()
     return rfields
 
 
-@nb.jit("{f3}({f4},{f4})".format(f3=Xd(3), f4=Xd(4)),
-        nopython=True)
-def correlate(A, F):
+def _correlate_kernel(A, F, stride):
     im, ic, iy, ix = A.shape
     nf, fc, fy, fx = F.shape
     # fx, fy, fc, nf = F.shape
-    oy, ox = iy - fy + 1, ix - fx + 1
-    rfields = _reshape_receptive_fields(A, F)
-    # output = np.zeros((im, oy*ox, nf), dtype=nbfloatX)
-    Frsh = F.reshape(nf, fx * fy * fc)
+    oy, ox = (iy - fy) // stride + 1, (ix - fx) // stride + 1
+    recfield_size = fx * fy * fc
+    Frsh = F.reshape(nf, recfield_size)
 
-    output = np.empty((im, oy*ox, nf))
-    for m in range(im):
-        output[m] = np.dot(rfields[m], Frsh.T)
+    output = np.empty((im, oy*ox, nf), dtype=A.dtype)
+    for m in nb.prange(im):
+        # receptive fields are unrolled one sample at a time
+        rfields = np.empty((oy * ox, recfield_size), dtype=A.dtype)
+        for y in range(oy):
+            for x in range(ox):
+                sy, sx = y * stride, x * stride
+                rfields[y * ox + x] = A[m, :, sy:sy + fy, sx:sx + fx].ravel()
+        output[m] = np.dot(rfields, Frsh.T)
 
     return output
 
 
-@nb.jit("{f1}({f4},{i})".format(f1=Xd(1), f4=Xd(4), i=intX),
-        nopython=True)
-def maxpool(A, fdim):
+def _col2im_kernel(cols, fy, fx, stride, A):
     im, ic, iy, ix = A.shape
-    oy, ox = iy // fdim, ix // fdim
-    output = np.empty((im, ic, oy, ox), dtype=nbfloatX)
-    filt = np.zeros_like(A, dtype=nbfloatX)
+    oy, ox = (iy - fy) // stride + 1, (ix - fx) // stride + 1
+    for m in nb.prange(im):
+        for y in range(oy):
+            for x in range(ox):
+                sy, sx = y * stride, x * stride
+                k = 0
+                for c in range(ic):
+                    for i in range(fy):
+                        for j in range(fx):
+                            A[m, c, sy + i, sx + j] += cols[m, y * ox + x, k]
+                            k += 1
+
+
+def _reshape_receptive_fields_nhwc_kernel(A, fy, fx, stride):
+    im, iy, ix, ic = A.shape
+    oy, ox = (iy - fy) // stride + 1, (ix - fx) // stride + 1
+    rfields = np.empty((im, oy * ox, fy * fx * ic), dtype=A.dtype)
+    for m in nb.prange(im):
+        for y in range(oy):
+            for x in range(ox):
+                sy, sx = y * stride, x * stride
+                rfields[m, y * ox + x] = A[m, sy:sy + fy, sx:sx + fx, :].ravel()
+    return rfields
+
+
+def _col2im_nhwc_kernel(cols, fy, fx, stride, A):
+    im, iy, ix, ic = A.shape
+    oy, ox = (iy - fy) // stride + 1, (ix - fx) // stride + 1
+    for m in nb.prange(im):
+        for y in range(oy):
+            for x in range(ox):
+                sy, sx = y * stride, x * stride
+                k = 0
+                for i in range(fy):
+                    for j in range(fx):
+                        for c in range(ic):
+                            A[m, sy + i, sx + j, c] += cols[m, y * ox + x, k]
+                            k += 1
+
+
+_convsig = floatsigs("{f3}({f4},{f4},{i})", f3=3, f4=4)
+_reshape_receptive_fields = nb.jit(_convsig, nopython=True)(_reshape_receptive_fields_kernel)
+_reshape_receptive_fields_parallel = nb.jit(nopython=True, parallel=True)(_reshape_receptive_fields_kernel)
+correlate = nb.jit(_convsig, nopython=True)(_correlate_kernel)
+correlate_parallel = nb.jit(nopython=True, parallel=True)(_correlate_kernel)
+col2im = nb.jit(nopython=True)(_col2im_kernel)
+col2im_parallel = nb.jit(nopython=True, parallel=True)(_col2im_kernel)
+_reshape_receptive_fields_nhwc = nb.jit(nopython=True)(_reshape_receptive_fields_nhwc_kernel)
+_reshape_receptive_fields_nhwc_parallel = nb.jit(nopython=True, parallel=True)(
+    _reshape_receptive_fields_nhwc_kernel
+)
+col2im_nhwc = nb.jit(nopython=True)(_col2im_nhwc_kernel)
+col2im_nhwc_parallel = nb.jit(nopython=True, parallel=True)(_col2im_nhwc_kernel)
+
+
+@nb.jit(floatsigs("{f3}({f4})", f3=3, f4=4), nopython=True)
+def winograd_filter_transform(F):
+    nf, fc, fy, fx = F.shape
+    # U: [4*4, nf, fc], so every tile element gets its own GEMM operand
+    U = np.empty((16, nf, fc), dtype=F.dtype)
+    Gg = np.empty((4, 3), dtype=F.dtype)
+    for f in range(nf):
+        for c in range(fc):
+            for j in range(3):
+                Gg[0, j] = F[f, c, 0, j]
+                Gg[1, j] = (F[f, c, 0, j] + F[f, c, 1, j] + F[f, c, 2, j]) * 0.5
+                Gg[2, j] = (F[f, c, 0, j] - F[f, c, 1, j] + F[f, c, 2, j]) * 0.5
+                Gg[3, j] = F[f, c, 2, j]
+            for i in range(4):
+                U[i*4, f, c] = Gg[i, 0]
+                U[i*4 + 1, f, c] = (Gg[i, 0] + Gg[i, 1] + Gg[i, 2]) * 0.5
+                U[i*4 + 2, f, c] = (Gg[i, 0] - Gg[i, 1] + Gg[i, 2]) * 0.5
+                U[i*4 + 3, f, c] = Gg[i, 2]
+    return U
+
+
+@nb.jit(floatsigs("{f4}({f4},{f3})", f3=3, f4=4), nopython=True)
+def winograd_correlate(A, U):
+    im, ic, iy, ix = A.shape
+    nf = U.shape[1]
+    oy, ox = iy - 2, ix - 2
+    ty, tx = (oy + 1) // 2, (ox + 1) // 2
+    ntiles = ty * tx
+
+    # V = B^T d B for every input tile: [4*4, ic, im*ty*tx]
+    V = np.empty((16, ic, im * ntiles), dtype=A.dtype)
+    d = np.empty((4, 4), dtype=A.dtype)
+    t = np.empty((4, 4), dtype=A.dtype)
     for m in range(im):
         for c in range(ic):
-            for y, sy in enumerate(range(0, iy, fdim)):
-                for x, sx in enumerate(range(0, ix, fdim)):
-                    recfield = A[m, c, sy:sy + fdim, sx:sx + fdim]
-                    value = recfield.max()
-                    output[m, c, y, x] = value
-                    filterfield = np.equal(recfield, value)
-                    filt[m, c, sy:sy + fdim, sx:sx + fdim] += filterfield
-    return np.concatenate((output.ravel(), filt.ravel()))
-
-
-@nb.jit(nopython=True)
-def inflate(A, filt):
-    em, ec, ey, ex = A.shape
-    fm, fc, fy, fx = filt.shape
-    fdim = fy // ey
-    for m in range(em):
-        for c in range(ec):
-            for i, y in enumerate(range(0, fy, fdim)):
-                for j, x in enumerate(range(0, fx, fdim)):
-                    filt[m, c, y:y + fdim, x:x + fdim] *= A[m, c, i, j]
-    return filt
+            for y in range(ty):
+                for x in range(tx):
+                    sy, sx = 2 * y, 2 * x
+                    n = m * ntiles + y * tx + x
+                    for i in range(4):
+                        for j in range(4):
+                            inside = sy + i < iy and sx + j < ix
+                            d[i, j] = A[m, c, sy + i, sx + j] if inside else 0.
+                    for j in range(4):
+                        t[0, j] = d[0, j] - d[2, j]
+                        t[1, j] = d[1, j] + d[2, j]
+                        t[2, j] = d[2, j] - d[1, j]
+                        t[3, j] = d[1, j] - d[3, j]
+                    for i in range(4):
+                        V[i*4, c, n] = t[i, 0] - t[i, 2]
+                        V[i*4 + 1, c, n] = t[i, 1] + t[i, 2]
+                        V[i*4 + 2, c, n] = t[i, 2] - t[i, 1]
+                        V[i*4 + 3, c, n] = t[i, 1] - t[i, 3]
 
+    # One [nf, ic] @ [ic, im*ty*tx] GEMM per tile element
+    M = np.empty((16, nf, im * ntiles), dtype=A.dtype)
+    for k in range(16):
+        M[k] = np.dot(U[k], V[k])
 
-class ConvolutionOp:
+    # Y = A^T M A, cropped to the valid output
+    output = np.empty((im, nf, oy, ox), dtype=A.dtype)
+    for m in range(im):
+        for f in range(nf):
+            for y in range(ty):
+                for x in range(tx):
+                    sy, sx = 2 * y, 2 * x
+                    n = m * ntiles + y * tx + x
+                    for j in range(4):
+                        t[0, j] = M[j, f, n] + M[4 + j, f, n] + M[8 + j, f, n]
+                        t[1, j] = M[4 + j, f, n] - M[8 + j, f, n] - M[12 + j, f, n]
+                    for i in range(2):
+                        if sy + i >= oy:
+                            continue
+                        output[m, f, sy + i, sx] = t[i, 0] + t[i, 1] + t[i, 2]
+                        if sx + 1 < ox:
+                            output[m, f, sy + i, sx + 1] = t[i, 1] - t[i, 2] - t[i, 3]
+    return output
 
-    _FLIP = {"valid": "full", "full": "valid", "same": "same"}
 
-    @staticmethod
-    def valid(X, F):
-        return correlate(X, F)
+def _maxpool_kernel(A, fdim, output, argmax):
+    im, ic, oy, ox = output.shape
+    for mc in nb.prange(im * ic):
+        m, c = mc // ic, mc % ic
+        for y in range(oy):
+            for x in range(ox):
+                sy, sx = y * fdim, x * fdim
+                value = A[m, c, sy, sx]
+                arg = 0
+                for dy in range(fdim):
+                    for dx in range(fdim):
+                        if A[m, c, sy + dy, sx + dx] > value:
+                            value = A[m, c, sy + dy, sx + dx]
+                            arg = dy * fdim + dx
+                output[m, c, y, x] = value
+                argmax[m, c, y, x] = arg
+
+
+def _maxpool_predict_kernel(A, fdim, output):
+    im, ic, oy, ox = output.shape
+    for mc in nb.prange(im * ic):
+        m, c = mc // ic, mc % ic
+        for y in range(oy):
+            for x in range(ox):
+                sy, sx = y * fdim, x * fdim
+                value = A[m, c, sy, sx]
+                for dy in range(fdim):
+                    for dx in range(fdim):
+                        value = max(value, A[m, c, sy + dy, sx + dx])
+                output[m, c, y, x] = value
+
+
+def _inflate_kernel(E, argmax, fdim, dX):
+    em, ec, ey, ex = E.shape
+    for mc in nb.prange(em * ec):
+        m, c = mc // ec, mc % ec
+        for y in range(ey):
+            for x in range(ex):
+                arg = argmax[m, c, y, x]
+                dX[m, c, y * fdim + arg // fdim, x * fdim + arg % fdim] = E[m, c, y, x]
+
+
+maxpool = nb.jit(nopython=True)(_maxpool_kernel)
+maxpool_parallel = nb.jit(nopython=True, parallel=True)(_maxpool_kernel)
+maxpool_predict = nb.jit(nopython=True)(_maxpool_predict_kernel)
+maxpool_predict_parallel = nb.jit(nopython=True, parallel=True)(_maxpool_predict_kernel)
+inflate = nb.jit(nopython=True)(_inflate_kernel)
+inflate_parallel = nb.jit(nopython=True, parallel=True)(_inflate_kernel)
+
+
+def _depthwise_correlate_kernel(A, F, stride, output):
+    im, ic, oy, ox = output.shape
+    fc, fy, fx = F.shape
+    for mc in nb.prange(im * ic):
+        m, c = mc // ic, mc % ic
+        for y in range(oy):
+            for x in range(ox):
+                sy, sx = y * stride, x * stride
+                acc = 0.
+                for i in range(fy):
+                    for j in range(fx):
+                        acc += A[m, c, sy + i, sx + j] * F[c, i, j]
+                output[m, c, y, x] = acc
 
-    @staticmethod
-    def full(X, F):
-        # fx, fy, fc, nf = F.shape
-        nf, fc, fy, fx = F.shape
-        py, px = fy - 1, fx - 1
-        pA = np.pad(X, pad_width=((0, 0), (0, 0), (py, py), (px, px)),
-                    mode="constant", constant_values=0.)
-        return correlate(pA, F)
 
-    def forward(self, X, F, mode="valid"):
+def _depthwise_backward_kernel(A, F, E, stride, dF, dX):
+    em, ec, oy, ox = E.shape
+    fc, fy, fx = F.shape
+    # Channels are independent, so both gradients can be accumulated in parallel over them
+    for c in nb.prange(ec):
+        for m in range(em):
+            for y in range(oy):
+                for x in range(ox):
+                    sy, sx = y * stride, x * stride
+                    e = E[m, c, y, x]
+                    for i in range(fy):
+                        for j in range(fx):
+                            dF[c, i, j] += A[m, c, sy + i, sx + j] * e
+                            dX[m, c, sy + i, sx + j] += F[c, i, j] * e
+
+
+depthwise_correlate = nb.jit(nopython=True)(_depthwise_correlate_kernel)
+depthwise_correlate_parallel = nb.jit(nopython=True, parallel=True)(_depthwise_correlate_kernel)
+depthwise_backward = nb.jit(nopython=True)(_depthwise_backward_kernel)
+depthwise_backward_parallel = nb.jit(nopython=True, parallel=True)(_depthwise_backward_kernel)
+
+
+def _winograd_filter_transform(F):
+    return winograd_filter_transform(np.ascontiguousarray(F))
+
+
+class ConvolutionOp:
+
+    algorithms = ("im2col", "winograd")
+
+    def __init__(self, algorithm="im2col", parallel=None, layout="NCHW", memory_budget=None):
+        if algorithm not in self.algorithms:
+            raise ValueError("Unsupported compiled convolution algorithm: {}".format(algorithm))
+        if check_layout(layout) == "NHWC" and algorithm != "im2col":
+            raise ValueError("Only the im2col algorithm supports the NHWC layout!")
+        self.algorithm = algorithm
+        self.layout = layout
+        self.memory_budget = resolve_memory_budget(memory_budget)
+        self.parallel = use_parallel(parallel)
+        self.correlate = correlate_parallel if self.parallel else correlate
+        if layout == "NHWC":
+            self.im2col = _reshape_receptive_fields_nhwc_parallel if self.parallel else _reshape_receptive_fields_nhwc
+            self.col2im = col2im_nhwc_parallel if self.parallel else col2im_nhwc
+        else:
+            self.im2col = _reshape_receptive_fields_parallel if self.parallel else _reshape_receptive_fields
+            self.col2im = col2im_parallel if self.parallel else col2im
+        self.transformed_filter = FilterTransformCache(_winograd_filter_transform)
+
+    def valid(self, X, F, stride=1):
         if not X.flags["C_CONTIGUOUS"]:
             X = X.copy()
+        if self.algorithm == "winograd" and F.shape[-2:] == (3, 3) and stride == 1:
+            return winograd_correlate(X, self.transformed_filter(F))
         if not F.flags["C_CONTIGUOUS"]:
             F = F.copy()
-        Z = self.valid(X, F) if mode == "valid" else self.full(X, F)
-        oc, oy, ox = self.outshape(X.shape, F.shape, mode=mode)
+        Z = self.correlate(X, F, stride)
+        oc, oy, ox = self.outshape(X.shape, F.shape, stride=stride)
         # Z: [im, oy*ox, nf]
         return Z.transpose((0, 2, 1)).reshape((-1, oc, oy, ox))
 
-    def backward(self, E, X, F, mode="valid"):
-        X_transposed = X.transpose((1, 0, 2, 3))
-        E_transposed = E.transpose((1, 0, 2, 3))
-        dF = self.forward(X_transposed, E_transposed, mode).transpose((1, 0, 2, 3))
+    def full(self, X, F):
+        # fx, fy, fc, nf = F.shape
+        nf, fc, fy, fx = F.shape
+        py, px = fy - 1, fx - 1
+        return self.valid(pad_input(X, (py, py), (px, px)), F)
+
+    batch_chunks = NpConvolutionOp.batch_chunks
+
+    def forward(self, X, F, mode="valid", stride=1):
+        chunks = self.batch_chunks(X.shape, F.shape, mode, stride, X.itemsize)
+        if len(chunks) == 1:
+            return self._forward(X, F, mode, stride)
+        return np.concatenate([self._forward(X[chunk], F, mode, stride) for chunk in chunks])
+
+    def backward(self, E, X, F, mode="valid", stride=1):
+        chunks = self.batch_chunks(X.shape, F.shape, mode, stride, X.itemsize)
+        if len(chunks) == 1:
+            return self._backward(E, X, F, mode, stride)
+        return chunked_backward(lambda x, e: self._backward(e, x, F, mode, stride), X, E, chunks)
+
+    def _forward(self, X, F, mode="valid", stride=1):
+        if self.layout == "NHWC":
+            outshape = self.outshape(X.shape, F.shape, mode, stride, self.layout)
+            return self.forward_fields(self.receptive_fields(X, F, mode, stride), F, outshape)
+        nf, fc, fy, fx = F.shape
+        pady, padx = conv_padding(mode, fy, fx, *X.shape[-2:], stride=stride)
+        return self.valid(pad_input(X, pady, padx), F, stride)
+
+    def _backward(self, E, X, F, mode="valid", stride=1):
+        if self.layout == "NHWC":
+            return self.backward_fields(self.receptive_fields(X, F, mode, stride), E, F, X.shape, mode, stride)
+        nf, fc, fy, fx = F.shape
+        im, ic, iy, ix = X.shape
+        pady, padx = conv_padding(mode, fy, fx, iy, ix, stride=stride)
+        pX = pad_input(X, pady, padx)
+        py, px = pX.shape[-2:]
+
+        dE = dilate(E, stride, py - fy + 1, px - fx + 1)
+        X_transposed = pX.transpose((1, 0, 2, 3))
+        E_transposed = dE.transpose((1, 0, 2, 3))
+        dF = self._forward(X_transposed, E_transposed).transpose((1, 0, 2, 3))
         F_flipped = F[..., ::-1, ::-1].transpose((1, 0, 2, 3))
-        dX = self.forward(E, F_flipped, mode=self._FLIP[mode])
-        db = E.sum(axis=(0, 2, 3))
-        return dF, db, dX
+        dX = self._forward(dE, F_flipped, mode="full")
+        db = E.sum(axis=(0, 2, 3), keepdims=True)
+        return dF, db, dX[:, :, pady[0]:pady[0]+iy, padx[0]:padx[0]+ix]
 
-    @staticmethod
-    def outshape(inshape, fshape, mode="valid"):
-        ic, iy, ix = inshape[-3:]
-        # fx, fy, fc, nf = fshape
-        nf, fc, fy, fx = fshape
-        if mode == "valid":
-            return nf, iy - fy + 1, ix - fx + 1
+    def receptive_fields(self, A, F, mode="valid", stride=1):
+        """Unrolled receptive fields of the padded input: [im, oy*ox, fc*fy*fx]
+
+        In NHWC the last axis is ordered (fy, fx, fc) instead."""
+        if self.layout == "NHWC":
+            fy, fx, fc, nf = F.shape
+            pady, padx = conv_padding(mode, fy, fx, *A.shape[1:3], stride=stride)
+            A = np.ascontiguousarray(pad_input(A, pady, padx, self.layout))
+            return self.im2col(A, fy, fx, stride)
+        nf, fc, fy, fx = F.shape
+        pady, padx = conv_padding(mode, fy, fx, *A.shape[-2:], stride=stride)
+        A = pad_input(A, pady, padx)
+        if not A.flags["C_CONTIGUOUS"]:
+            A = A.copy()
+        if not F.flags["C_CONTIGUOUS"]:
+            F = F.copy()
+        return self.im2col(A, F, stride)
+
+    def forward_fields(self, rfields, F, outshape):
+        im, P, K = rfields.shape
+        if self.layout == "NHWC":
+            oy, ox, nf = outshape
+            # [im*oy*ox, K] @ [K, nf] is already the [im, oy, ox, nf] output
+            return np.dot(rfields.reshape(im * P, K), F.reshape(K, nf)).reshape(im, oy, ox, nf)
+        nf, oy, ox = outshape
+        Z = np.dot(rfields.reshape(im * P, K), F.reshape(nf, K).T)
+        return Z.reshape(im, P, nf).transpose((0, 2, 1)).reshape((im, nf, oy, ox))
+
+    def backward_fields(self, rfields, E, F, inshape, mode="valid", stride=1):
+        """Backward pass reusing the receptive fields of the forward pass.
+
+        dF is a single GEMM against the cached fields,
+        dX is scattered back from the unrolled error with col2im."""
+        im, P, K = rfields.shape
+        if self.layout == "NHWC":
+            fy, fx, fc, nf = F.shape
+            im, iy, ix, ic = inshape
+            E2 = E.reshape(im * P, nf)
+            Frsh = F.reshape(K, nf).T
+            db = E2.sum(axis=0)
         else:
-            return nf, iy + fy - 1, ix + fx - 1
+            nf, fc, fy, fx = F.shape
+            im, ic, iy, ix = inshape
+            E2 = E.transpose((0, 2, 3, 1)).reshape(im * P, nf)
+            Frsh = F.reshape(nf, K)
+            db = E.sum(axis=(0, 2, 3), keepdims=True)
+        pady, padx = conv_padding(mode, fy, fx, iy, ix, stride=stride)
+
+        dF = np.dot(E2.T, rfields.reshape(im * P, K))
+        dF = (dF.T if self.layout == "NHWC" else dF).reshape(F.shape)
+        dcols = np.dot(E2, Frsh).reshape(im, P, K)
+        py, px = iy + sum(pady), ix + sum(padx)
+        if self.layout == "NHWC":
+            dX = np.zeros((im, py, px, ic), dtype=dcols.dtype)
+            self.col2im(dcols, fy, fx, stride, dX)
+            return dF, db, dX[:, pady[0]:pady[0]+iy, padx[0]:padx[0]+ix]
+        dX = np.zeros((im, ic, py, px), dtype=dcols.dtype)
+        self.col2im(dcols, fy, fx, stride, dX)
+        return dF, db, dX[:, :, pady[0]:pady[0]+iy, padx[0]:padx[0]+ix]
+
+    outshape = staticmethod(NpConvolutionOp.outshape)
 
     def __str__(self):
         return "Convolution"
 
 
+class DepthwiseConvolutionOp:
+
+    def __init__(self, parallel=None, layout="NCHW"):
+        self.layout = check_layout(layout)
+        self.parallel = use_parallel(parallel)
+        self.correlate = depthwise_correlate_parallel if self.parallel else depthwise_correlate
+        self.correlate_backward = depthwise_backward_parallel if self.parallel else depthwise_backward
+
+    def _nchw_view(self, A):
+        # The kernels index images as [m, c, y, x] and filters as [c, fy, fx]
+        if self.layout == "NHWC":
+            return A.transpose((2, 0, 1)) if A.ndim == 3 else A.transpose((0, 3, 1, 2))
+        return A
+
+    def _pad(self, A, F, mode, stride):
+        fy, fx = F.shape[:2] if self.layout == "NHWC" else F.shape[1:]
+        pady, padx = conv_padding(mode, fy, fx, *spatial_shape(A.shape, self.layout), stride=stride)
+        return pad_input(A, pady, padx, self.layout), pady, padx
+
+    def forward(self, X, F, mode="valid", stride=1):
+        pX = self._pad(X, F, mode, stride)[0]
+        output = np.empty((len(X),) + self.outshape(X.shape, F.shape, mode, stride, self.layout), dtype=X.dtype)
+        self.correlate(self._nchw_view(pX), self._nchw_view(F), stride, self._nchw_view(output))
+        return output
+
+    def backward(self, E, X, F, mode="valid", stride=1):
+        pX, pady, padx = self._pad(X, F, mode, stride)
+        dF = np.zeros_like(F)
+        dX = np.zeros_like(pX)
+        self.correlate_backward(self._nchw_view(pX), self._nchw_view(F), self._nchw_view(E),
+                                stride, self._nchw_view(dF), self._nchw_view(dX))
+        if self.layout == "NHWC":
+            iy, ix = X.shape[1:3]
+            return dF, E.sum(axis=(0, 1, 2)), dX[:, pady[0]:pady[0]+iy, padx[0]:padx[0]+ix]
+        iy, ix = X.shape[2:]
+        return dF, E.sum(axis=(0, 2, 3), keepdims=True), dX[:, :, pady[0]:pady[0]+iy, padx[0]:padx[0]+ix]
+
+    outshape = staticmethod(NpDepthwiseConvolutionOp.outshape)
+
+    def __str__(self):
+        return "DepthwiseConvolution"
+
+
 class MaxPoolOp:
 
-    def __init__(self):
-        self.backward = inflate
+    def __init__(self, parallel=None, layout="NCHW"):
+        self.layout = check_layout(layout)
+        self.parallel = use_parallel(parallel)
+        self.maxpool = maxpool_parallel if self.parallel else maxpool
+        self.maxpool_predict = maxpool_predict_parallel if self.parallel else maxpool_predict
+        self.inflate = inflate_parallel if self.parallel else inflate
 
     def __str__(self):
         return "MaxPool"
 
-    @staticmethod
-    def forward(A, fdim):
-        if not A.flags["C_CONTIGUOUS"]:
-            A = A.copy()
-        im, ic, iy, ix = A.shape
-        oy, ox = iy // fdim, ix // fdim
-        outarr = maxpool(A, fdim)
-        output = outarr[:-A.size].reshape(im, ic, oy, ox)
-        filt = outarr[-A.size:].reshape(A.shape)
-        return output, filt
+    def _nchw_view(self, A):
+        # The kernels index [m, c, y, x], a transposed view lets them run on NHWC buffers in place
+        return A.transpose((0, 3, 1, 2)) if self.layout == "NHWC" else A
+
+    def forward(self, A, fdim):
+        oshape = tuple(dim // fdim if ax in self._spatial_axes else dim for ax, dim in enumerate(A.shape))
+        output = np.empty(oshape, dtype=A.dtype)
+        argmax = np.empty(oshape, dtype=pool_argmax_dtype(fdim))
+        self.maxpool(self._nchw_view(A), fdim, self._nchw_view(output), self._nchw_view(argmax))
+        return output, argmax
+
+    def predict(self, A, fdim):
+        oshape = tuple(dim // fdim if ax in self._spatial_axes else dim for ax, dim in enumerate(A.shape))
+        output = np.empty(oshape, dtype=A.dtype)
+        self.maxpool_predict(self._nchw_view(A), fdim, self._nchw_view(output))
+        return output
+
+    def backward(self, E, argmax, fdim):
+        ishape = tuple(dim * fdim if ax in self._spatial_axes else dim for ax, dim in enumerate(E.shape))
+        dX = np.zeros(ishape, dtype=E.dtype)
+        self.inflate(self._nchw_view(E), self._nchw_view(argmax), fdim, self._nchw_view(dX))
+        return dX
+
+    @property
+    def _spatial_axes(self):
+        return (1, 2) if self.layout == "NHWC" else (2, 3)
 
     @staticmethod
     def outshape(inshape, fdim):
@@ -1,3 +1,4 @@
 from .costs import mean_squared_error, categorical_crossentropy, binary_crossentropy, hinge
-from .costs import mse, cxent, bxent
+from .costs import softmax_crossentropy, sigmoid_crossentropy
+from .costs import mse, cxent, bxent, softmax_cxent, sigmoid_bxent
 from .metrics import accuracy
@@ -1,5 +1,6 @@
 import numpy as np
 
+from ..atomic.activation_op import SoftMax, Sigmoid
 from ..util.typing import scalX
 
 s0 = scalX(0.)
@@ -20,6 +21,10 @@ class CostFunction:
     def derivative(outputs, targets):
         return outputs - targets
 
+    def cost_and_derivative(self, outputs, targets):
+        """The cost and its derivative wrt. outputs, subclasses compute them in a single pass if they can"""
+        return self(outputs, targets), self.derivative(outputs, targets)
+
 
 class _MeanSquaredError(CostFunction):
 
@@ -53,6 +58,60 @@ class _BinaryCrossEntropy(CostFunction):
         raise NotImplementedError
 
 
+class _SoftmaxCrossEntropy(CostFunction):
+
+    """Categorical cross-entropy of softmax(logits), to be used on an output layer with linear activation.
+
+    The log-probabilities are computed with log-sum-exp, so confident predictions don't underflow.
+    The derivative wrt. the logits is softmax(logits) - targets, targets should sum to 1 in every row."""
+
+    activation = SoftMax()
+
+    @staticmethod
+    def log_softmax(logits):
+        L = logits - logits.max(axis=1, keepdims=True)
+        L -= np.log(np.exp(L).sum(axis=1, keepdims=True))
+        return L
+
+    def __call__(self, logits, targets):
+        return -(targets * self.log_softmax(logits)).sum()
+
+    def derivative(self, logits, targets):
+        return self.cost_and_derivative(logits, targets)[1]
+
+    def cost_and_derivative(self, logits, targets):
+        L = self.log_softmax(logits)
+        cost = -(targets * L).sum()
+        delta = np.exp(L, out=L)
+        delta -= targets
+        return cost, delta
+
+
+class _SigmoidCrossEntropy(CostFunction):
+
+    """Binary cross-entropy of sigmoid(logits), to be used on an output layer with linear activation.
+
+    Evaluated as max(z, 0) - z*y + log(1 + exp(-|z|)), which is stable for logits of any magnitude.
+    The derivative wrt. the logits is sigmoid(logits) - targets."""
+
+    activation = Sigmoid()
+
+    def __call__(self, logits, targets):
+        return self.cost_and_derivative(logits, targets)[0]
+
+    def derivative(self, logits, targets):
+        return self.cost_and_derivative(logits, targets)[1]
+
+    def cost_and_derivative(self, logits, targets):
+        E = np.exp(-np.abs(logits))
+        cost = (np.maximum(logits, s0) - logits * targets + np.log1p(E)).sum()
+        # sigmoid(z) is 1 / (1 + exp(-|z|)) for z >= 0 and exp(-|z|) / (1 + exp(-|z|)) otherwise
+        delta = np.where(logits >= s0, s1, E)
+        delta /= E + s1
+        delta -= targets
+        return cost, delta
+
+
 class _Hinge(CostFunction):
 
     def __call__(self, outputs, targets):
@@ -72,13 +131,17 @@ class _Hinge(CostFunction):
 mean_squared_error = _MeanSquaredError()
 categorical_crossentropy = _CategoricalCrossEntropy()
 binary_crossentropy = _BinaryCrossEntropy()
+softmax_crossentropy = _SoftmaxCrossEntropy()
+sigmoid_crossentropy = _SigmoidCrossEntropy()
 hinge = _Hinge()
 
 mse = mean_squared_error
 cxent = categorical_crossentropy
 bxent = binary_crossentropy
+softmax_cxent = softmax_crossentropy
+sigmoid_bxent = sigmoid_crossentropy
 
-_costs = {k: v for k, v in locals().items() if k[0] != "_" and k != "CostFunction"}
+_costs = {k: v for k, v in locals().items() if isinstance(v, CostFunction)}
 
 
 def get(cost_function):
@@ -1,12 +1,16 @@
 import abc
 
+from ..atomic.tensor_op import check_layout
+from ..config import numeric
+
 
 class Model(abc.ABC):
 
     def __init__(self, input_shape, **kw):
         self.input_shape = input_shape
-        self.floatX = kw.get("floatX", "float64")
+        self.floatX = kw.get("floatX", numeric.floatX)
         self.compiled = kw.get("compiled", False)
+        self.layout = check_layout(kw.get("layout", "NCHW"))
 
     @abc.abstractmethod
     def feedforward(self, X):
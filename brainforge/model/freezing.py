@@ -0,0 +1,108 @@
+import copy
+
+import numpy as np
+
+from ..layers.core import Dense, Activation, Reshape
+from ..layers.fancy import DropOut
+from ..layers.tensor import ConvLayer, DepthwiseConv, SeparableConv
+
+
+def _is_linear(layer):
+    return layer.activation.type == "linear"
+
+
+def _drop_noops(layers):
+    """Removes linear Activation layers and merges or removes reshapes"""
+    kept = []
+    for layer in layers:
+        if isinstance(layer, Activation) and _is_linear(layer):
+            continue
+        if isinstance(layer, Reshape):
+            if kept and isinstance(kept[-1], Reshape):
+                # Only the last of consecutive reshapes is needed
+                layer.inshape = kept.pop().inshape
+            if tuple(layer.outshape) == tuple(layer.inshape):
+                continue
+        kept.append(layer)
+    return kept
+
+
+def _detached(layer):
+    """Shallow copy of a connected layer owning a copy of its parameters"""
+    clone = copy.copy(layer)
+    clone.__dict__.update(brain=None, inputs=None, arena_bound=False, _buffers={})
+    for name, gname in (("weights", "nabla_w"), ("biases", "nabla_b")):
+        value = getattr(layer, name)
+        if value is None:
+            continue
+        setattr(clone, name, value.copy())
+        setattr(clone, gname, np.zeros_like(value))
+    return clone
+
+
+def _fold_dropouts(layers):
+    """DropOut only scales at inference time, the scale is moved into a neighbouring linear map"""
+    folded = []
+    for i, layer in enumerate(layers):
+        if not isinstance(layer, DropOut):
+            folded.append(layer)
+            continue
+        following = layers[i+1] if i+1 < len(layers) else None
+        previous = folded[-1] if folded else None
+        if isinstance(following, SeparableConv):
+            # Only the depthwise filters are scaled, the pointwise weights see the scaled channels
+            W = following.weights.copy()
+            W[:, :following.fy*following.fx] *= layer.dropchance
+            following.weights = W
+        elif isinstance(following, (Dense, ConvLayer, DepthwiseConv)):
+            following.weights = following.weights * layer.dropchance
+        elif isinstance(previous, Dense) and _is_linear(previous):
+            previous.weights = previous.weights * layer.dropchance
+            previous.biases = previous.biases * layer.dropchance
+        else:
+            folded.append(layer)
+    return folded
+
+
+def _folding_shrinks(W1, W2):
+    # A bottleneck (eg. 1000 -> 10 -> 1000) is cheaper to evaluate as two GEMMs
+    return W1.shape[0] * W2.shape[1] <= W1.size + W2.size
+
+
+def _fold_dense_chains(layers):
+    """Dense(linear) -> Dense(f) computes f(X.W1.W2 + b1.W2 + b2), a single Dense layer does the same"""
+    folded = []
+    for layer in layers:
+        previous = folded[-1] if folded else None
+        if isinstance(layer, Dense) and isinstance(previous, Dense) and _is_linear(previous) and \
+                _folding_shrinks(previous.weights, layer.weights):
+            layer.biases = previous.biases @ layer.weights + layer.biases
+            layer.weights = previous.weights @ layer.weights
+            layer.inshape = previous.inshape
+            layer.nabla_w = np.zeros_like(layer.weights)
+            folded[-1] = layer
+            continue
+        folded.append(layer)
+    return folded
+
+
+def freeze(stack):
+    """Builds an inference-only copy of a LayerStack with fewer layers.
+
+    Linear Activation layers and redundant reshapes are dropped, DropOut scaling is
+    folded into the weights of the next (or the previous linear) Dense or convolution layer
+    and chains of linear Dense layers are multiplied into a single Dense layer.
+    The returned stack owns its parameters and always runs the inference path."""
+    from .layerstack import LayerStack
+
+    layers = [_detached(layer) for layer in stack.layers[1:]]
+    layers = _fold_dense_chains(_fold_dropouts(_drop_noops(layers)))
+
+    frozen = LayerStack(stack.input_shape, floatX=stack.floatX, compiled=stack.compiled, layout=stack.layout)
+    for layer in layers:
+        layer.brain = frozen
+        frozen.layers.append(layer)
+        frozen.architecture.append(str(layer))
+    frozen._bind_parameters()
+    frozen.inference = True
+    return frozen
@@ -1,17 +1,30 @@
+import contextlib
+import copy
+
 import numpy as np
 
 from .abstract_model import Model
 from ..layers.abstract_layer import LayerBase
+from ..util.typing import asX
 
 
 class LayerStack(Model):
 
-    def __init__(self, input_shape, layers=()):
-        super().__init__(input_shape)
+    def __init__(self, input_shape, layers=(), **kw):
+        super().__init__(input_shape, **kw)
         self.layers = []
         self.architecture = []
         self.learning = False
+        self.inference = False
         self._iterme = None
+        # Flat buffers holding every trainable parameter and gradient, layers keep views into them.
+        # They are bound on first access or on the first feedforward, which also casts the layers
+        # to floatX, so building a stack doesn't copy the layers over and over
+        self._parameters = None
+        self._gradients = None
+        # With more than one segment the training pass keeps only the segment inputs, see feedforward
+        self.checkpoint_segments = kw.get("checkpoint_segments", 1)
+        self._checkpoints = []
 
         self._add_input_layer(input_shape)
         for layer in layers:
@@ -29,33 +42,144 @@ class LayerStack(Model):
         layer.connect(self)
         self.layers.append(layer)
         self.architecture.append(str(layer))
+        if layer.trainable:
+            self._unbind_parameters()
 
     def pop(self):
-        self.layers.pop()
+        layer = self.layers.pop()
         self.architecture.pop()
+        if layer.trainable:
+            layer.arena_bound = False
+            self._unbind_parameters()
+
+    def _bind_parameters(self):
+        layers = self.trainable_layers
+        self._parameters = np.empty(self.num_params, dtype=self.floatX)
+        self._gradients = np.zeros(self.num_params, dtype=self.floatX)
+        start = 0
+        for layer in layers:
+            end = start + layer.num_params
+            layer.bind_parameters(self._parameters[start:end], self._gradients[start:end])
+            start = end
+
+    def _unbind_parameters(self):
+        # The layers keep their views into the old arena until the next access copies them into a new one
+        self._parameters = self._gradients = None
+
+    @property
+    def parameters(self):
+        if self._parameters is None:
+            self._bind_parameters()
+        return self._parameters
+
+    @property
+    def gradients(self):
+        if self._gradients is None:
+            self._bind_parameters()
+        return self._gradients
 
     def feedforward(self, X):
+        if self._parameters is None:
+            self._bind_parameters()
+        X = asX(X, self.floatX)
+        if self.inference:
+            for layer in self.layers:
+                X = layer.predict(X)
+            # The layers may hand back their reused output buffers
+            return X.copy()
+        self._checkpoints = []
+        if self.learning and self.checkpoint_segments > 1:
+            return self._checkpointed_feedforward(X)
         for layer in self.layers:
             X = layer.feedforward(X)
         return X
 
+    def segments(self):
+        """The layers after the input layer, split into checkpoint_segments contiguous runs"""
+        layers = self.layers[1:]
+        bounds = np.linspace(0, len(layers), min(self.checkpoint_segments, len(layers)) + 1).round().astype(int)
+        return [layers[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def _checkpointed_feedforward(self, X):
+        """Training pass releasing the activations of every segment but the last.
+
+        For each released segment its input, the random state and shallow copies of its layers
+        taken before the pass are kept, backpropagate runs the segment forward again on the copies.
+        The layers themselves advance as usual, eg. stateful recurrent layers carry their state."""
+        # feedforward has bound the arena, the copies write their gradients into the shared views
+        X = self.layers[0].feedforward(X)
+        *released, last = self.segments()
+        for segment in released:
+            for layer in segment:
+                layer.release()
+            self._checkpoints.append((X, np.random.get_state(), [copy.copy(layer) for layer in segment]))
+            for layer in segment:
+                X = layer.feedforward(X)
+            for layer in segment:
+                layer.release()
+        for layer in last:
+            X = layer.feedforward(X)
+        return X
+
+    def backpropagate(self, error):
+        """Backpropagates through every layer but the input layer and returns the delta of the input.
+
+        Segments released by a checkpointed feedforward are recomputed one at a time, from their
+        input and with the random state of the original pass, so DropOut draws the same masks.
+        The copies share the parameter and gradient views of the layers."""
+        checkpoints, self._checkpoints = self._checkpoints, []
+        last = self.segments()[-1] if checkpoints else self.layers[1:]
+        for layer in last[::-1]:
+            error = layer.backpropagate(error)
+        while checkpoints:
+            X, random_state, segment = checkpoints.pop()
+            current_state = np.random.get_state()
+            np.random.set_state(random_state)
+            for layer in segment:
+                X = layer.feedforward(X)
+            np.random.set_state(current_state)
+            for layer in segment[::-1]:
+                error = layer.backpropagate(error)
+        return error
+
+    def predict(self, X, inference=False):
+        if not inference:
+            return self.feedforward(X)
+        with self.inference_mode():
+            return self.feedforward(X)
+
+    @contextlib.contextmanager
+    def inference_mode(self):
+        """Within this context feedforward keeps nothing for backpropagation.
+
+        No layer inputs, outputs, recurrent caches or pooling masks are stored
+        and Dense layers write into output buffers reused across calls."""
+        inference, self.inference = self.inference, True
+        try:
+            yield self
+        finally:
+            self.inference = inference
+
+    def freeze(self):
+        """Returns a compact, inference-only copy of the stack, see model.freezing"""
+        from .freezing import freeze
+        return freeze(self)
+
+    optimize_for_inference = freeze
+
     def get_states(self, unfold=True):
         hs = [layer.output for layer in self.layers]
         return np.concatenate(hs) if unfold else hs
 
     def get_weights(self, unfold=True):
-        ws = [layer.get_weights(unfold=unfold) for
-              layer in self.layers if layer.trainable]
-        return np.concatenate(ws) if unfold else ws
+        if unfold:
+            return self.parameters.copy()
+        return [layer.get_weights(unfold=False) for layer in self.layers if layer.trainable]
 
     def set_weights(self, ws, fold=True):
         trl = (l for l in self.layers if l.trainable)
         if fold:
-            start = 0
-            for layer in trl:
-                end = start + layer.num_params
-                layer.set_weights(ws[start:end])
-                start = end
+            self.parameters[...] = ws
         else:
             for w, layer in zip(ws, trl):
                 layer.set_weights(w)
@@ -67,6 +191,12 @@ class LayerStack(Model):
         for layer in (l for l in self.layers if l.trainable):
             layer.reset()
 
+    def reset_state(self):
+        """Forgets the state stateful recurrent layers carried over from previous batches"""
+        for layer in self.layers:
+            if hasattr(layer, "reset_state"):
+                layer.reset_state()
+
     @property
     def outshape(self):
         return self.layers[-1].outshape
@@ -75,6 +205,13 @@ class LayerStack(Model):
     def num_params(self):
         return sum(layer.num_params for layer in self.layers if layer.trainable)
 
+    @property
+    def sample_bytes(self):
+        """Bytes of the outputs of all layers for a single sample, used to estimate how many
+        samples fit into the memory budget during inference"""
+        size = sum(int(np.prod(layer.outshape)) for layer in self.layers)
+        return size * np.dtype(self.floatX).itemsize
+
     @property
     def output(self):
         return self.layers[-1].output
@@ -99,5 +236,4 @@ class LayerStack(Model):
     def __getitem__(self, item):
         return self.layers.__getitem__(item)
 
-    predict = feedforward
     output_shape = outshape
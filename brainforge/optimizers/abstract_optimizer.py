@@ -1,5 +1,7 @@
 import abc
 
+import numpy as np
+
 
 class Optimizer(abc.ABC):
 
@@ -21,10 +23,21 @@ class GradientDescent(Optimizer):
     def __init__(self, eta=0.01):
         self.eta = eta
         self.nparams = None
+        self._scratch = ()
 
     def initialize(self, **kw):
         pass
 
-    @abc.abstractmethod
     def optimize(self, W, gW, m):
+        return self.optimize_inplace(W.copy(), gW, m)
+
+    @abc.abstractmethod
+    def optimize_inplace(self, W, gW, m):
+        """Updates W in place without allocating parameter-sized temporaries, returns W"""
         raise NotImplementedError
+
+    def scratch(self, gW, n=1):
+        """n reusable work buffers shaped like gW, gW itself is never written"""
+        if len(self._scratch) < n or self._scratch[0].shape != gW.shape or self._scratch[0].dtype != gW.dtype:
+            self._scratch = tuple(np.empty_like(gW) for _ in range(n))
+        return self._scratch[:n]
@@ -1,5 +1,7 @@
 import numpy as np
+
 from .gradient_descent import SGD as _SGD
+from ..util.typing import zX
 
 
 class Adagrad(_SGD):
@@ -9,14 +11,22 @@ class Adagrad(_SGD):
         self.epsilon = epsilon
         self.memory = None
 
-    def initialize(self, nparams, memory=None):
-        self.memory = np.zeros((nparams,)) if memory is None else memory
+    def initialize(self, nparams, memory=None, dtype=None):
+        self.memory = zX(nparams, dtype=dtype) if memory is None else memory
+
+    def optimize_inplace(self, W, gW, m):
+        nabla, buffer = self.scratch(gW, 2)
+        np.divide(gW, m, out=nabla)
+        self.memory += np.square(nabla, out=buffer)
+        return self._descend(W, nabla, buffer)
 
-    def optimize(self, W, gW, m):
-        nabla = gW / m
-        self.memory += nabla**2
-        updates = (self.eta / np.sqrt(self.memory + self.epsilon)) * nabla
-        return W - updates
+    def _descend(self, W, nabla, buffer):
+        """W -= eta * nabla / sqrt(memory + epsilon), computed in the scratch buffers"""
+        np.sqrt(np.add(self.memory, self.epsilon, out=buffer), out=buffer)
+        np.divide(nabla, buffer, out=buffer)
+        buffer *= self.eta
+        W -= buffer
+        return W
 
     def __str__(self):
         return "Adagrad"
@@ -67,12 +77,14 @@ class RMSprop(Adagrad):
         super().__init__(eta, epsilon)
         self.decay = decay
 
-    def optimize(self, W, gW, m):
-        nabla = gW / m
+    def optimize_inplace(self, W, gW, m):
+        nabla, buffer = self.scratch(gW, 2)
+        np.divide(gW, m, out=nabla)
         self.memory *= self.decay
-        self.memory += (1. - self.decay) * (nabla ** 2.)
-        updates = (self.eta * nabla) / np.sqrt(self.memory + self.epsilon)
-        return W - updates
+        np.square(nabla, out=buffer)
+        buffer *= 1. - self.decay
+        self.memory += buffer
+        return self._descend(W, nabla, buffer)
 
     def __str__(self):
         return "RMSprop"
@@ -87,19 +99,26 @@ class Adam(_SGD):
         self.epsilon = epsilon
         self.velocity, self.memory = None, None
 
-    def initialize(self, nparams, velocity=None, memory=None):
-        self.velocity = np.zeros((nparams,)) if velocity is None else velocity
-        self.memory = np.zeros((nparams,)) if memory is None else memory
-
-    def optimize(self, W, gW, m):
-        eta = self.eta / m
-        self.velocity = self.decay_velocity * self.velocity + (1. - self.decay_velocity) * gW
-        self.memory = (self.decay_memory * self.memory + (1. - self.decay_memory) * (gW ** 2))
-        update = (eta * self.velocity) / np.sqrt(self.memory + self.epsilon)
-        return W - update
+    def initialize(self, nparams, velocity=None, memory=None, dtype=None):
+        self.velocity = zX(nparams, dtype=dtype) if velocity is None else velocity
+        self.memory = zX(nparams, dtype=dtype) if memory is None else memory
+
+    def optimize_inplace(self, W, gW, m):
+        buffer, = self.scratch(gW)
+        self.velocity *= self.decay_velocity
+        self.velocity += np.multiply(gW, 1. - self.decay_velocity, out=buffer)
+        self.memory *= self.decay_memory
+        np.square(gW, out=buffer)
+        buffer *= 1. - self.decay_memory
+        self.memory += buffer
+        np.sqrt(np.add(self.memory, self.epsilon, out=buffer), out=buffer)
+        np.divide(self.velocity, buffer, out=buffer)
+        buffer *= self.eta / m
+        W -= buffer
+        return W
 
     def __str__(self):
         return "Adam"
 
 agdopt = {k.lower(): v for k, v in locals().items()
-          if k not in ("_SGD", "np") and k[0] != "_"}
+          if k not in ("_SGD", "np", "zX") and k[0] != "_"}
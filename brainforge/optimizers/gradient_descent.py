@@ -1,12 +1,16 @@
 import numpy as np
 
+from ..util.typing import zX
+
 from .abstract_optimizer import GradientDescent
 
 
 class SGD(GradientDescent):
 
-    def optimize(self, W, gW, m):
-        return W - gW * (self.eta / m)
+    def optimize_inplace(self, W, gW, m):
+        buffer, = self.scratch(gW)
+        W -= np.multiply(gW, self.eta / m, out=buffer)
+        return W
 
     def __str__(self):
         return "SGD"
@@ -19,13 +23,15 @@ class Momentum(SGD):
         self.mu = mu
         self.velocity = None
 
-    def initialize(self, nparams, velocity=None):
-        self.velocity = np.zeros((nparams,)) if velocity is None else velocity
+    def initialize(self, nparams, velocity=None, dtype=None):
+        self.velocity = zX(nparams, dtype=dtype) if velocity is None else velocity
 
-    def optimize(self, W, gW, m):
-        eta = self.eta / m
-        self.velocity = self.velocity * self.mu + gW * eta
-        return W - self.velocity
+    def optimize_inplace(self, W, gW, m):
+        buffer, = self.scratch(gW)
+        self.velocity *= self.mu
+        self.velocity += np.multiply(gW, self.eta / m, out=buffer)
+        W -= self.velocity
+        return W
 
     def __str__(self):
         return "Momentum"
@@ -37,17 +43,22 @@ class Nesterov(Momentum):
         super().__init__(eta, mu)
         self.memory = None
 
-    def initialize(self, nparams, velocity=None, memory=None):
-        super().initialize(nparams, velocity)
+    def initialize(self, nparams, velocity=None, memory=None, dtype=None):
+        super().initialize(nparams, velocity, dtype)
         self.memory = np.zeros_like(self.velocity) if memory is None else memory
 
-    def optimize(self, W, gW, m):
-        nabla = gW * (self.eta / m)
-        W_ = self.memory - self.velocity + nabla
-        self.memory = W
+    def optimize_inplace(self, W, gW, m):
+        nabla, = self.scratch(gW)
+        np.multiply(gW, self.eta / m, out=nabla)
+        self.memory -= self.velocity
+        self.memory += nabla
         self.velocity *= self.mu
         self.velocity += nabla
-        return W_
+        # The new weights are in memory, which has to memorize the old weights: swap them via the buffer
+        nabla[...] = W
+        W[...] = self.memory
+        self.memory[...] = nabla
+        return W
 
     def __str__(self):
         return "Nesterov"
@@ -1,5 +1,7 @@
 import numpy as np
 
+from ..util.typing import asX
+
 
 class Experience:
 
@@ -44,6 +46,7 @@ class Experience:
         self._adder(X, Y)
 
     def remember(self, X, Y):
+        X, Y = asX(X), asX(Y)
         if self.downsample > 1:
             X, Y = X[::self.downsample], Y[::self.downsample]
         assert len(X) == len(Y)
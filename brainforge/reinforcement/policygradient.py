@@ -2,6 +2,7 @@ import numpy as np
 
 from .abstract_agent import AgentBase
 from ..util.rl_util import discount_rewards
+from ..util.typing import zX, asX
 
 
 class PG(AgentBase):
@@ -13,11 +14,11 @@ class PG(AgentBase):
     def __init__(self, network, nactions, agentconfig=None, **kw):
         super().__init__(network, agentconfig, **kw)
         self.actions = np.arange(nactions)
-        self.action_labels = np.eye(nactions)
+        self.action_labels = np.eye(nactions, dtype=self.net.layers.floatX)
         self.X = []
         self.Y = []
         self.rewards = []
-        self.grad = np.zeros((network.num_params,))
+        self.grad = zX(network.num_params, dtype=self.net.layers.floatX)
 
     def reset(self):
         self.X = []
@@ -33,7 +34,7 @@ class PG(AgentBase):
         return action
 
     def accumulate(self, state, reward):
-        R = np.array(self.rewards[1:] + [reward])
+        R = asX(self.rewards[1:] + [reward])
         if self.cfg.gamma > 0.:
             R = discount_rewards(R, self.cfg.gamma)
             R -= R.mean()
@@ -2,5 +2,5 @@ from ._nnutil import *
 from ._etalon import etalon
 
 from .typing import (
-    scalX, ctx1, zX, zX_like, white, white_like, emptyX
+    scalX, ctx1, zX, zX_like, asX, white, white_like, emptyX
 )
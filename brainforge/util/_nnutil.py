@@ -1,13 +1,17 @@
 import numpy as np
 
+from .typing import asX
+
 
 def batch_stream(*arrays, m, shuffle=True, infinite=True):
+    arrays = tuple(map(asX, arrays))
     N = arrays[0].shape[0]
     while 1:
-        arg = np.arange(N)
+        shuffled = arrays
         if shuffle:
+            arg = np.arange(N)
             np.random.shuffle(arg)
-        shuffled = tuple(map(lambda ary: ary[arg], arrays))
+            shuffled = tuple(map(lambda ary: ary[arg], arrays))
         for start in range(0, N, m):
             minibatch = tuple(map(lambda ary: ary[start:start+m], shuffled))
             yield minibatch
@@ -15,6 +19,42 @@ def batch_stream(*arrays, m, shuffle=True, infinite=True):
             break
 
 
+def pad_sequences(sequences, length=None, value=0.):
+    """Stacks variable-length sequences into a (batch, time, ...) array, padded at the end with value"""
+    length = length or max(len(seq) for seq in sequences)
+    first = np.asarray(sequences[0])
+    padded = np.full((len(sequences), length) + first.shape[1:], value, dtype=first.dtype)
+    for i, seq in enumerate(sequences):
+        padded[i, :len(seq)] = seq
+    return padded
+
+
+def bucket_stream(X, Y, m, pad_value=0., shuffle=True, infinite=True):
+    """Minibatches of variable-length sequences, grouped by length to minimize padding.
+
+    X is a list of (time, features) arrays. The sequences are sorted by length and cut into
+    batches of m, every batch is padded with pad_value only up to its own longest sequence.
+    Ragged targets (eg. for return_seq) are padded the same way, otherwise Y is indexed as is.
+    Use the recurrent layers with mask_value=pad_value, so the padding is not computed on.
+    A full epoch is ceil(len(X) / m) batches."""
+    X = [asX(x) for x in X]
+    ragged = isinstance(Y, (list, tuple)) and np.ndim(Y[0]) > 0 and len({len(y) for y in Y}) > 1
+    Y = [asX(y) for y in Y] if ragged else asX(Y)
+    lengths = np.array([len(x) for x in X])
+    while 1:
+        # Random tie-breaking keeps batches of equal-length sequences from always being the same
+        order = np.lexsort((np.random.random(len(X)), lengths)) if shuffle else np.argsort(lengths, kind="stable")
+        batches = [order[start:start+m] for start in range(0, len(X), m)]
+        if shuffle:
+            np.random.shuffle(batches)
+        for batch in batches:
+            x = pad_sequences([X[i] for i in batch], value=pad_value)
+            y = pad_sequences([Y[i] for i in batch], value=pad_value) if ragged else Y[batch]
+            yield x, y
+        if not infinite:
+            break
+
+
 def rtm(A):
     """Converts an ndarray to a 2d array (matrix) by keeping the first dimension as the rows
     and flattening all the other dimensions to columns"""
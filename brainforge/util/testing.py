@@ -1,4 +1,5 @@
 class NoBrainer:
 
-    def __init__(self, outshape):
+    def __init__(self, outshape, layout="NCHW"):
         self.outshape = outshape
+        self.layout = layout
@@ -1,24 +1,37 @@
 import numpy as np
 
-from ..config import floatX
+from ..config import numeric
+
+
+def _dtype(dtype=None):
+    # The dtype policy is read at call time, so it follows config.numeric.floatX when it changes
+    return numeric.floatX if dtype is None else dtype
 
 
 def ctx1(*arrays):
     return np.concatenate(arrays, axis=1)
 
 
-def scalX(scalar, dtype=floatX):
-    return np.array([scalar], dtype=dtype).item()
+def scalX(scalar, dtype=None):
+    return np.array([scalar], dtype=_dtype(dtype)).item()
 
 
-def zX(*dims, dtype=floatX):
-    return np.zeros(dims, dtype=dtype)
+def zX(*dims, dtype=None):
+    return np.zeros(dims, dtype=_dtype(dtype))
 
 
-def zX_like(array, dtype=floatX):
+def zX_like(array, dtype=None):
     return zX(*array.shape, dtype=dtype)
 
 
+def asX(array, dtype=None):
+    """Casts floating point arrays to floatX, without copying if they already match"""
+    array = np.asarray(array)
+    if array.dtype.kind != "f":
+        return array
+    return array.astype(_dtype(dtype), copy=False)
+
+
 def _densewhite(fanin, fanout):
     return np.random.randn(fanin, fanout) * np.sqrt(2. / float(fanin + fanout))
 
@@ -27,15 +40,20 @@ def _convwhite(nf, fc, fy, fx):
     return np.random.randn(nf, fc, fy, fx) * np.sqrt(2. / float(nf*fy*fx + fc*fy*fx))
 
 
-def white(*dims, dtype=floatX) -> np.ndarray:
+def _depthwhite(fc, fy, fx):
+    # Every channel is a separate single-filter convolution
+    return np.random.randn(fc, fy, fx) * np.sqrt(1. / float(fy*fx))
+
+
+def white(*dims, dtype=None) -> np.ndarray:
     """Returns a white noise tensor"""
-    tensor = _densewhite(*dims) if len(dims) == 2 else _convwhite(*dims)
-    return tensor.astype(dtype)
+    tensor = {2: _densewhite, 3: _depthwhite}.get(len(dims), _convwhite)(*dims)
+    return tensor.astype(_dtype(dtype))
 
 
-def white_like(array, dtype=floatX):
+def white_like(array, dtype=None):
     return white(*array.shape, dtype=dtype)
 
 
 def emptyX(*dims):
-    return np.empty(dims, dtype=floatX)
+    return np.empty(dims, dtype=_dtype())
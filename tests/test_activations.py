@@ -0,0 +1,40 @@
+import unittest
+
+import numpy as np
+
+from brainforge.atomic import activations
+
+
+class TestActivationOutParameter(unittest.TestCase):
+
+    def setUp(self):
+        self.Z = np.random.randn(7, 5)
+
+    def test_out_and_in_place_match_allocating_call(self):
+        for name, activation in activations.items():
+            act = activation()
+            Z = np.abs(self.Z) if name == "sqrt" else self.Z
+            A = act.forward(Z)
+            out = np.empty_like(Z)
+            self.assertIs(act.forward(Z, out=out), out, name)
+            np.testing.assert_allclose(out, A, err_msg=name)
+            inplace = Z.copy()
+            self.assertIs(act.forward(inplace, out=inplace), inplace, name)
+            np.testing.assert_allclose(inplace, A, err_msg=name)
+            dA = act.backward(A) * np.ones_like(A)
+            inplace = A.copy()
+            slope = act.backward(inplace, out=inplace)
+            if np.ndim(slope):
+                self.assertIs(slope, inplace, name)
+                np.testing.assert_allclose(inplace, dA, err_msg=name)
+            else:
+                # Constant slopes are returned as scalars, out is left untouched
+                self.assertEqual(slope, 1., name)
+                np.testing.assert_array_equal(inplace, A, err_msg=name)
+
+    def test_derivatives_match_finite_differences(self):
+        eps = 1e-6
+        for name in ("sigmoid", "tanh", "relu", "leakyrelu", "hard_sigmoid"):
+            act = activations[name]()
+            numerical = (act.forward(self.Z + eps) - act.forward(self.Z - eps)) / (2 * eps)
+            np.testing.assert_allclose(act.backward(act.forward(self.Z)), numerical, atol=1e-5, err_msg=name)
@@ -0,0 +1,39 @@
+import unittest
+
+import numpy as np
+
+from brainforge import LayerStack, Backpropagation
+from brainforge.layers import Dense
+from brainforge.metrics import costs
+
+
+class TestLogitHeads(unittest.TestCase):
+
+    def setUp(self):
+        self.Z = np.random.randn(6, 4) * 3.
+        self.Y = np.eye(4)[np.random.randint(0, 4, size=6)]
+
+    def test_heads_match_the_probability_costs(self):
+        P = costs.softmax_cxent.activation.forward(self.Z)
+        cost, delta = costs.softmax_cxent.cost_and_derivative(self.Z, self.Y)
+        np.testing.assert_allclose(cost, costs.cxent(P, self.Y))
+        np.testing.assert_allclose(delta, P - self.Y)
+
+        S = costs.sigmoid_bxent.activation.forward(self.Z)
+        cost, delta = costs.sigmoid_bxent.cost_and_derivative(self.Z, self.Y)
+        np.testing.assert_allclose(cost, costs.bxent(S, self.Y))
+        np.testing.assert_allclose(delta, S - self.Y)
+
+    def test_confident_predictions_dont_underflow(self):
+        Z = np.array([[800., -800.]])
+        Y = np.array([[0., 1.]])
+        for head in (costs.softmax_cxent, costs.sigmoid_bxent):
+            cost, delta = head.cost_and_derivative(Z, Y)
+            self.assertTrue(np.isfinite(cost) and np.all(np.isfinite(delta)))
+            self.assertGreaterEqual(cost, 1600.)
+
+    def test_learn_batch_reports_the_cost_of_the_batch(self):
+        net = Backpropagation(LayerStack(3, [Dense(4)]), cost="softmax_cxent")
+        X = np.random.randn(6, 3)
+        cost = costs.softmax_cxent(net.predict(X), self.Y) / 6
+        self.assertAlmostEqual(net.learn_batch(X, self.Y, update=False)["cost"], cost)
@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+
+from brainforge import LayerStack, Backpropagation
+from brainforge.config import numeric
+from brainforge.layers import ConvLayer, PoolLayer, Flatten, Dense, LSTM, RLayer, DropOut
+from brainforge.util import batch_stream
+
+
+class TestFloat32Policy(unittest.TestCase):
+
+    def setUp(self):
+        self.floatX = numeric.floatX
+        numeric.floatX = "float32"
+
+    def tearDown(self):
+        numeric.floatX = self.floatX
+
+    def _assert_float32(self, *arrays, msg=None):
+        for array in arrays:
+            if isinstance(array, np.ndarray) and array.dtype.kind == "f":
+                self.assertEqual(array.dtype, np.float32, msg=msg)
+
+    def _watch(self, layer):
+        """Checks every array a layer produces, on both the forward and the backward pass"""
+        feedforward, backpropagate = layer.feedforward, layer.backpropagate
+
+        def checked_feedforward(X):
+            output = feedforward(X)
+            self._assert_float32(output, msg="{} forward".format(layer))
+            return output
+
+        def checked_backpropagate(delta):
+            self._assert_float32(delta, msg="{} delta".format(layer))
+            dX = backpropagate(delta)
+            self._assert_float32(dX, *vars(layer).values(), msg="{} backward".format(layer))
+            return dX
+
+        layer.feedforward, layer.backpropagate = checked_feedforward, checked_backpropagate
+
+    def _run_model(self, layers, X, Y, cost, optimizer, **kw):
+        net = Backpropagation(LayerStack(X.shape[1:], layers=layers, **kw), cost=cost, optimizer=optimizer)
+        for layer in net.layers:
+            self._watch(layer)
+        # The arena is only read after training, so the very first pass runs on a fresh stack
+        stream = batch_stream(X, Y, m=4)
+        for _ in range(2):
+            net.learn_batch(*next(stream))
+        self._assert_float32(net.layers.parameters, net.layers.gradients,
+                             *vars(net.optimizer).values(), *net.optimizer._scratch)
+        self._assert_float32(net.predict(X))
+
+    def test_convolutional_model(self):
+        for compiled in (False, True):
+            X = np.random.randn(8, 2, 8, 8)
+            Y = np.eye(3)[np.random.randint(0, 3, size=8)]
+            self._run_model([
+                ConvLayer(3, compiled=compiled, padding="same", activation="relu"),
+                PoolLayer(2, compiled=compiled), Flatten(),
+                Dense(6, activation="tanh", compiled=compiled), DropOut(0.5),
+                Dense(3, activation="softmax")
+            ], X, Y, cost="cxent", optimizer="adam")
+
+    def test_recurrent_model(self):
+        for compiled in (False, True):
+            X = np.random.randn(8, 5, 3)
+            Y = np.random.randn(8, 2)
+            self._run_model([
+                RLayer(4, "tanh", return_seq=True, compiled=compiled),
+                LSTM(4, "tanh", compiled=compiled),
+                Dense(2)
+            ], X, Y, cost="mse", optimizer="momentum")
+
+
+class TestStackFloatX(TestFloat32Policy):
+
+    """A float32 stack under the float64 default, the stack's floatX has to win everywhere"""
+
+    def setUp(self):
+        self.floatX = numeric.floatX
+        numeric.floatX = "float64"
+
+    def _run_model(self, layers, X, Y, cost, optimizer, **kw):
+        super()._run_model(layers, X, Y, cost, optimizer, floatX="float32")
+
+    def test_optimizers(self):
+        for optimizer in ("sgd", "momentum", "nesterov", "adagrad", "rmsprop", "adam"):
+            self._run_model([Dense(4, activation="tanh"), Dense(2)],
+                            np.random.randn(8, 3), np.random.randn(8, 2), cost="mse", optimizer=optimizer)
+
+    def test_fresh_stack_runs_in_its_floatX(self):
+        # Nothing reads the parameter arena before the first pass, feedforward has to bind it
+        X, Y = np.random.randn(4, 1, 5, 5), np.random.randn(4, 3)
+        for compiled in (False, True):
+            for train in (False, True):
+                layers = [ConvLayer(2, compiled=compiled), Flatten(), Dense(3, compiled=compiled)]
+                net = Backpropagation(LayerStack(X.shape[1:], layers=layers, floatX="float32"), optimizer="adam")
+                if train:
+                    net.fit(X, Y, batch_size=2, epochs=1, verbose=0)
+                self._assert_float32(net.predict(X), net.layers.parameters)
@@ -3,7 +3,7 @@ import unittest
 import numpy as np
 
 from brainforge import layers
-from brainforge.util import testing
+from brainforge.util import testing, bucket_stream, pad_sequences
 
 
 class TestGlobalAveragePooling(unittest.TestCase):
@@ -28,3 +28,123 @@ class TestGlobalAveragePooling(unittest.TestCase):
         delta = self.layer.backpropagate(self.outputs[None, ...])[0]
 
         np.testing.assert_allclose(delta, self.inputs / 25)
+
+
+class TestConvLayer(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.inputs = np.random.randn(2, 3, 8, 8)
+        self.brain = testing.NoBrainer(outshape=self.inputs.shape[1:])
+
+    def _run_shape_test(self, expected_shape, **kw):
+        layer = layers.ConvLayer(4, 3, 3, compiled=False, **kw)
+        layer.connect(self.brain)
+        output = layer.feedforward(self.inputs)
+        self.assertEqual(layer.outshape, expected_shape)
+        self.assertEqual(output.shape[1:], expected_shape)
+        delta = layer.backpropagate(np.ones_like(output))
+        self.assertEqual(delta.shape, self.inputs.shape)
+
+    def test_valid_padding(self):
+        self._run_shape_test((4, 6, 6))
+
+    def test_same_padding(self):
+        self._run_shape_test((4, 8, 8), padding="same")
+
+    def test_strided_same_padding(self):
+        self._run_shape_test((4, 4, 4), padding="same", stride=2)
+
+    def test_channels_last(self):
+        self.inputs = self.inputs.transpose((0, 2, 3, 1)).copy()
+        self.brain = testing.NoBrainer(outshape=self.inputs.shape[1:], layout="NHWC")
+        self._run_shape_test((4, 4, 4), padding="same", stride=2)
+
+    def test_large_filters_use_fft(self):
+        layer = layers.ConvLayer(4, 7, 7, compiled=True)
+        layer.connect(self.brain)
+        self.assertEqual(layer.algorithm, "fft")
+        self.assertEqual(layer.feedforward(self.inputs).shape[1:], layer.outshape)
+
+
+class TestSeparableConv(unittest.TestCase):
+
+    def test_depthwise_then_pointwise_shapes(self):
+        inputs = np.random.randn(2, 3, 8, 8)
+        brain = testing.NoBrainer(outshape=inputs.shape[1:])
+        for layer, expected_shape in ((layers.DepthwiseConv(compiled=False), (3, 6, 6)),
+                                      (layers.SeparableConv(5, padding="same", compiled=True), (5, 8, 8))):
+            layer.connect(brain)
+            output = layer.feedforward(inputs)
+            self.assertEqual(output.shape[1:], expected_shape)
+            self.assertEqual(layer.outshape, expected_shape)
+            delta = layer.backpropagate(np.ones_like(output))
+            self.assertEqual(delta.shape, inputs.shape)
+            self.assertEqual(layer.nabla_w.shape, layer.weights.shape)
+
+
+class TestStatefulRecurrence(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.inputs = np.random.randn(3, 10, 2)
+        self.brain = testing.NoBrainer(outshape=self.inputs.shape[1:])
+
+    def _build(self, layer_type, **kw):
+        layer = layer_type(4, "tanh", compiled=False, **kw)
+        layer.connect(self.brain)
+        return layer
+
+    def test_carried_state_continues_the_sequence(self):
+        for layer_type in (layers.RLayer, layers.LSTM, layers.GRU):
+            full = self._build(layer_type, return_seq=True)
+            stateful = self._build(layer_type, return_seq=True, stateful=True)
+            stateful.weights, stateful.biases = full.weights, full.biases
+
+            expected = full.feedforward(self.inputs)
+            stateful.feedforward(self.inputs[:, :6])
+            np.testing.assert_allclose(stateful.feedforward(self.inputs[:, 6:]), expected[:, 6:])
+
+            stateful.reset_state()
+            stateful.predict(self.inputs[:, :6])
+            np.testing.assert_allclose(stateful.predict(self.inputs[:, 6:]), expected[:, 6:])
+
+    def test_bptt_window_truncates_the_gradient(self):
+        for layer_type in (layers.RLayer, layers.LSTM, layers.GRU):
+            full = self._build(layer_type)
+            truncated = self._build(layer_type, bptt_window=4)
+            truncated.weights, truncated.biases = full.weights, full.biases
+
+            output = truncated.feedforward(self.inputs)
+            np.testing.assert_allclose(output, full.feedforward(self.inputs))
+            self.assertEqual(truncated.output.shape[0], 4)
+
+            delta = truncated.backpropagate(np.ones_like(output))
+            self.assertEqual(delta.shape, self.inputs.shape)
+            np.testing.assert_equal(delta[:, :6], 0.)
+            np.testing.assert_allclose(delta[:, 6:], full.backpropagate(np.ones_like(output))[:, 6:])
+
+
+class TestMaskedRecurrence(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.sequences = [np.random.randn(length, 2) + 3. for length in (5, 2, 7, 3, 1)]
+        self.brain = testing.NoBrainer(outshape=(7, 2))
+
+    def test_padding_is_skipped(self):
+        for layer_type in (layers.RLayer, layers.LSTM, layers.GRU):
+            masked = layer_type(4, "tanh", compiled=False, mask_value=0.)
+            masked.connect(self.brain)
+            unmasked = layer_type(4, "tanh", compiled=False)
+            unmasked.connect(self.brain)
+            unmasked.weights, unmasked.biases = masked.weights, masked.biases
+
+            output = masked.feedforward(pad_sequences(self.sequences))
+            delta = masked.backpropagate(np.ones_like(output))
+            for i, sequence in enumerate(self.sequences):
+                np.testing.assert_allclose(output[i], unmasked.feedforward(sequence[None])[0])
+                np.testing.assert_allclose(delta[i, :len(sequence)], unmasked.backpropagate(np.ones((1, 4)))[0])
+                np.testing.assert_equal(delta[i, len(sequence):], 0.)
+
+    def test_bucket_stream_pads_per_batch(self):
+        stream = bucket_stream(self.sequences, np.arange(5), m=2, shuffle=False, infinite=False)
+        shapes = [(x.shape, list(y)) for x, y in stream]
+        self.assertEqual(shapes, [((2, 2, 2), [4, 1]), ((2, 5, 2), [3, 0]), ((1, 7, 2), [2])])
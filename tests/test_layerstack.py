@@ -0,0 +1,184 @@
+import unittest
+
+import numpy as np
+
+from brainforge import LayerStack, Backpropagation
+from brainforge.layers import (
+    Dense, Activation, ConvLayer, Flatten, Reshape, PoolLayer, DropOut, SeparableConv, DepthwiseConv, RLayer, LSTM
+)
+
+
+class TestParameterArena(unittest.TestCase):
+
+    def setUp(self):
+        self.net = Backpropagation(LayerStack((1, 6, 6), [
+            ConvLayer(2, compiled=False), Flatten(), Dense(5, activation="tanh"), Dense(2)
+        ]), cost="mse", optimizer="momentum")
+
+    def test_parameters_are_views_of_the_arena(self):
+        stack = self.net.layers
+        self.assertEqual(stack.parameters.size, stack.num_params)
+        for layer in stack.trainable_layers:
+            for param in (layer.weights, layer.biases, layer.nabla_w, layer.nabla_b):
+                self.assertTrue(np.shares_memory(param, stack.parameters) or
+                                np.shares_memory(param, stack.gradients))
+
+    def test_arena_is_bound_lazily(self):
+        stack = LayerStack(3, [Dense(4), Dense(2)])
+        self.assertIsNone(stack._parameters)
+        parameters = stack.parameters
+        self.assertIs(stack.parameters, parameters)
+        # Adding a layer invalidates the arena, the next access rebinds it with the old values
+        stack.add(Dense(5))
+        self.assertEqual(stack.parameters.size, stack.num_params)
+        np.testing.assert_array_equal(stack.parameters[:parameters.size], parameters)
+
+    def test_training_updates_the_arena_in_place(self):
+        stack = self.net.layers
+        parameters, gradients = stack.parameters, stack.gradients
+        W = stack.get_weights()
+        self.net.learn_batch(np.random.randn(4, 1, 6, 6), np.random.randn(4, 2))
+        self.assertIs(stack.parameters, parameters)
+        self.assertIs(stack.gradients, gradients)
+        self.assertFalse(np.allclose(W, stack.parameters))
+        self.assertTrue(np.all(gradients == 0.))
+        # Assignments are copied into the arena instead of rebinding the layer attributes
+        stack[-1].weights = np.zeros_like(stack[-1].weights)
+        self.assertTrue(np.shares_memory(stack[-1].weights, parameters))
+        self.assertEqual(np.abs(stack.parameters[-stack[-1].num_params:-2]).sum(), 0.)
+
+
+class TestInferenceMode(unittest.TestCase):
+
+    def _assert_inference_matches(self, stack, X):
+        expected = stack.feedforward(X)
+        for layer in stack:
+            layer.inputs = layer.output = None
+            layer.argmax = layer.cache = None
+        output = stack.predict(X, inference=True)
+        np.testing.assert_allclose(output, expected, rtol=1e-5, atol=1e-8)
+        self.assertFalse(stack.inference)
+        for layer in stack:
+            self.assertIsNone(layer.inputs)
+            self.assertIsNone(getattr(layer, "argmax", None))
+            self.assertIsNone(getattr(layer, "cache", None))
+        # Dense output buffers are reused, the returned array is not one of them
+        self.assertIsNot(stack.predict(X, inference=True), stack.predict(X, inference=True))
+        np.testing.assert_allclose(stack.predict(X, inference=True), expected, rtol=1e-5, atol=1e-8)
+
+    def test_tensor_stack(self):
+        for compiled in (False, True):
+            stack = LayerStack((2, 8, 8), [
+                ConvLayer(3, compiled=compiled, activation="relu"), SeparableConv(4, compiled=compiled, padding="same"),
+                PoolLayer(2, compiled=compiled), Flatten(), DropOut(0.5), Dense(5, activation="tanh"), Dense(2)
+            ])
+            self._assert_inference_matches(stack, np.random.randn(4, 2, 8, 8))
+
+    def test_recurrent_stack(self):
+        for compiled in (False, True):
+            for return_seq in (False, True):
+                stack = LayerStack((5, 3), [
+                    LSTM(4, "tanh", return_seq=True, compiled=compiled),
+                    RLayer(3, "tanh", return_seq=return_seq, compiled=compiled)
+                ])
+                self._assert_inference_matches(stack, np.random.randn(6, 5, 3))
+
+
+class TestChunkedPrediction(unittest.TestCase):
+
+    def setUp(self):
+        self.net = Backpropagation(LayerStack(6, [Dense(5, activation="tanh"), Dense(3)]), cost="mse")
+        self.X = np.random.randn(23, 6)
+        self.Y = np.random.randn(23, 3)
+
+    def test_chunked_predict_matches_full_batch(self):
+        expected = self.net.predict(self.X)
+        for batch_size in (1, 5, 23, 100, "auto"):
+            np.testing.assert_allclose(self.net.predict(self.X, batch_size=batch_size), expected, rtol=1e-6)
+        stream = (self.X[start:start+10] for start in range(0, 23, 10))
+        preds = list(self.net.predict_stream(stream))
+        self.assertEqual([len(pred) for pred in preds], [10, 10, 3])
+        np.testing.assert_allclose(np.concatenate(preds), expected, rtol=1e-6)
+
+    def test_evaluate_covers_every_sample(self):
+        history = self.net.evaluate(self.X, self.Y, batch_size=10)
+        self.assertEqual(history._step, 3)
+        full = self.net.evaluate(self.X, self.Y, batch_size=23)
+        np.testing.assert_allclose(full["cost"], self.net.cost(self.net.predict(self.X), self.Y) / 23)
+
+
+class TestFreeze(unittest.TestCase):
+
+    def test_frozen_stack_is_smaller_and_equivalent(self):
+        stack = LayerStack((2, 6, 6), [
+            DropOut(0.2), ConvLayer(3, compiled=False, activation="relu"), PoolLayer(2, compiled=False),
+            Flatten(), Flatten(),
+            Dense(20), Activation("linear"), DropOut(0.5), Dense(10), Dense(4, activation="tanh"),
+            Reshape((4,)), Dense(3)
+        ])
+        X = np.random.randn(5, 2, 6, 6)
+        frozen = stack.freeze()
+        self.assertEqual([str(layer) for layer in frozen],
+                         ["Activation-linear", str(stack[2]), "Pool-2x2", "Flatten", str(stack[10]), str(stack[12])])
+        self.assertEqual(frozen.outshape, stack.outshape)
+        self.assertEqual(frozen.num_params, frozen.parameters.size)
+        np.testing.assert_allclose(frozen.predict(X), stack.predict(X, inference=True), rtol=1e-6, atol=1e-10)
+        # The frozen stack owns its parameters
+        frozen.parameters[:] = 0.
+        self.assertNotEqual(np.abs(stack.parameters).sum(), 0.)
+
+    def test_dropout_folds_into_depthwise_convolutions(self):
+        for layout in ("NCHW", "NHWC"):
+            shape = (2, 6, 6) if layout == "NCHW" else (6, 6, 2)
+            stack = LayerStack(shape, [
+                DropOut(0.2), SeparableConv(3, compiled=False, activation="relu"),
+                DropOut(0.5), DepthwiseConv(compiled=False, activation="tanh"), Flatten(), Dense(2)
+            ], layout=layout)
+            X = np.random.randn(4, *shape)
+            frozen = stack.freeze()
+            self.assertEqual(len(frozen.layers), 5)
+            self.assertFalse(any(isinstance(layer, DropOut) for layer in frozen))
+            np.testing.assert_allclose(frozen.predict(X), stack.predict(X, inference=True), rtol=1e-6, atol=1e-10)
+
+
+class TestCheckpointing(unittest.TestCase):
+
+    def _gradients(self, layers, X, Y, **kw):
+        np.random.seed(1)
+        net = Backpropagation(LayerStack(X.shape[1:], layers(), **kw), cost="mse", optimizer="sgd")
+        net.layers.learning = True
+        grads = []
+        for _ in range(2):
+            net.learn_batch(X, Y, update=False)
+            grads.append(net.get_gradients())
+            net.zero_gradients()
+        return net, grads
+
+    def _assert_same_gradients(self, layers, X, Y, **kw):
+        _, expected = self._gradients(layers, X, Y)
+        net, grads = self._gradients(layers, X, Y, checkpoint_segments=3, **kw)
+        for e, g in zip(expected, grads):
+            np.testing.assert_allclose(g, e, rtol=1e-6, atol=1e-10)
+        return net
+
+    def test_segments_match_the_full_pass(self):
+        layers = lambda: [
+            ConvLayer(3, compiled=False, activation="relu"), PoolLayer(2, compiled=False), Flatten(),
+            Dense(12, activation="tanh"), DropOut(0.5), Dense(8, activation="tanh"), Dense(2)
+        ]
+        net = self._assert_same_gradients(layers, np.random.randn(5, 2, 6, 6), np.random.randn(5, 2))
+        self.assertEqual([len(segment) for segment in net.layers.segments()], [2, 3, 2])
+        # Only the last segment keeps its activations between the passes
+        net.layers.feedforward(np.random.randn(5, 2, 6, 6))
+        self.assertIsNone(net.layers[4].inputs)
+        self.assertIsNotNone(net.layers[6].inputs)
+
+    def test_checkpointed_lstm_in_segments(self):
+        layers = lambda: [
+            LSTM(5, "tanh", return_seq=True, checkpoint=True, stateful=True),
+            LSTM(4, "tanh", stateful=True), Dense(3, activation="tanh"), Dense(2)
+        ]
+        net = self._assert_same_gradients(layers, np.random.randn(4, 6, 3), np.random.randn(4, 2))
+        # The released LSTM still carries its state over to the next batch
+        self.assertIsNone(net.layers[1].cache)
+        self.assertEqual(net.layers[1].state[0].shape, (4, 5))
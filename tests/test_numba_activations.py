@@ -2,34 +2,31 @@ import unittest
 
 import numpy as np
 
-from brainforge.atomic.activation_op import (
-    Sigmoid as NpSigm, Tanh as NpTanh, ReLU as NpReLU
-)
-from brainforge.llatomic.llactivation_op import (
-    Sigmoid as NbSigm, Tanh as NbTanh, ReLU as NbReLU
-)
+from brainforge.atomic import activations
+from brainforge.llatomic import llactivations
 
 
 np.random.seed(1337)
 
-ops = {
-    "sigmoid": (NpSigm(), NbSigm()),
-    "tanh": (NpTanh(), NbTanh()),
-    "relu": (NpReLU(), NbReLU())
-}
-
 
 class TestActivationFunctions(unittest.TestCase):
 
     def _run_function_test(self, func):
-        npop, nbop = ops[func]
-        npO = npop.forward(self.X)
-        nbO = nbop.forward(self.X)
+        npop, nbop = activations[func](), llactivations[func]()
+        X = np.abs(self.X) if func == "sqrt" else self.X
+        npO = npop.forward(X)
+        nbO = nbop.forward(X)
 
         self.assertTrue(np.allclose(npO, nbO))
+        self.assertTrue(np.allclose(npop.backward(npO) * np.ones_like(npO), nbop.backward(nbO) * np.ones_like(nbO)))
+
+        out = X.copy()
+        self.assertIs(nbop.forward(out, out=out), out)
+        self.assertTrue(np.allclose(out, npO))
+        self.assertEqual(nbop.forward(X.astype("float32")).dtype, np.float32)
 
     def setUp(self):
-        self.X = np.random.randn(100)
+        self.X = np.random.randn(20, 10)
 
     def test_sigmoid(self):
         self._run_function_test("sigmoid")
@@ -39,3 +36,20 @@ class TestActivationFunctions(unittest.TestCase):
 
     def test_relu(self):
         self._run_function_test("relu")
+
+    def test_sqrt(self):
+        self._run_function_test("sqrt")
+
+    def test_leakyrelu(self):
+        self._run_function_test("leakyrelu")
+
+    def test_hard_sigmoid(self):
+        self._run_function_test("hard_sigmoid")
+
+    def test_softmax(self):
+        self.X[0] += 1000.
+        self._run_function_test("softmax")
+        self.assertTrue(np.allclose(llactivations["softmax"]().forward(self.X).sum(axis=1), 1.))
+
+    def test_linear(self):
+        self._run_function_test("linear")
@@ -5,18 +5,24 @@ from matplotlib import pyplot as plt
 
 from brainforge.atomic import (
     ConvolutionOp as NpConv,
+    DepthwiseConvolutionOp as NpDepthwise,
     MaxPoolOp as NpPool,
     DenseOp as NpDense,
     RecurrentOp as NpRec,
-    LSTMOp as NpLSTM
+    LSTMOp as NpLSTM,
+    GRUOp as NpGRU,
+    activations
 )
 from brainforge.llatomic import (
     ConvolutionOp as NbConv,
+    DepthwiseConvolutionOp as NbDepthwise,
     MaxPoolOp as NbPool,
     DenseOp as NbDense,
     RecurrentOp as NbRec,
-    LSTMOp as NbLSTM
+    LSTMOp as NbLSTM,
+    GRUOp as NbGRU
 )
+from brainforge.llatomic.lltensor_op import correlate
 
 
 VISUAL = False
@@ -39,25 +45,176 @@ class TestNumbaTensorOps(unittest.TestCase):
         if VISUAL:
             visualize(A, npO, nbO, supt="Testing Convolutions")
 
+    def test_convolution_op_valid(self):
+        npop = NpConv()
+        nbop = NbConv()
+
+        A = np.random.uniform(size=(4, 3, 12, 10))
+        F = np.random.uniform(size=(5, 3, 3, 2))
+
+        npO = npop.forward(A, F, mode="valid")
+        nbO = nbop.forward(A, F, mode="valid")
+
+        self.assertEqual(npO.shape, (4, 5, 10, 9))
+        self.assertTrue(np.allclose(npO, nbO))
+
+    def test_convolution_op_backward(self):
+        npop = NpConv()
+        nbop = NbConv()
+
+        X = np.random.uniform(size=(4, 3, 8, 8))
+        F = np.random.uniform(size=(5, 3, 3, 3))
+        E = np.random.uniform(size=(4, 5, 6, 6))
+
+        npdF, npdb, npdX = npop.backward(X=X, E=E, F=F)
+        nbdF, nbdb, nbdX = nbop.backward(X=X, E=E, F=F)
+
+        self.assertTrue(np.allclose(npdF, nbdF))
+        self.assertTrue(np.allclose(npdb.ravel(), nbdb.ravel()))
+        self.assertTrue(np.allclose(npdX, nbdX))
+
+    def test_convolution_op_strided_padded(self):
+        npop = NpConv()
+        nbop = NbConv()
+
+        X = np.random.uniform(size=(2, 3, 9, 8))
+        F = np.random.uniform(size=(4, 3, 3, 3))
+
+        for mode, stride in (("same", 1), ("same", 2), ("valid", 2), (1, 3)):
+            npO = npop.forward(X, F, mode, stride)
+            nbO = nbop.forward(X, F, mode, stride)
+            self.assertEqual(npO.shape[1:], npop.outshape(X.shape, F.shape, mode, stride))
+            self.assertTrue(np.allclose(npO, nbO))
+
+            E = np.random.uniform(size=npO.shape)
+            npdF, npdb, npdX = npop.backward(X=X, E=E, F=F, mode=mode, stride=stride)
+            nbdF, nbdb, nbdX = nbop.backward(X=X, E=E, F=F, mode=mode, stride=stride)
+            self.assertEqual(npdX.shape, X.shape)
+            self.assertTrue(np.allclose(npdF, nbdF))
+            self.assertTrue(np.allclose(npdX, nbdX))
+
+        self.assertEqual(npop.outshape(X.shape, F.shape, "same", 2), (4, 5, 4))
+
+    def test_cached_receptive_fields_backward(self):
+        X = np.random.uniform(size=(3, 2, 9, 8))
+        F = np.random.uniform(size=(4, 2, 3, 3))
+
+        for op in (NpConv(), NbConv()):
+            for mode, stride in (("valid", 1), ("same", 2), (1, 3)):
+                outshape = op.outshape(X.shape, F.shape, mode, stride)
+                rfields = op.receptive_fields(X, F, mode, stride)
+                O = op.forward_fields(rfields, F, outshape)
+                self.assertTrue(np.allclose(O, op.forward(X, F, mode, stride)))
+
+                E = np.random.uniform(size=O.shape)
+                cached = op.backward_fields(rfields, E, F, X.shape, mode, stride)
+                reference = NpConv().backward(X, E, F, mode, stride)
+                for grad, refgrad in zip(cached, reference):
+                    self.assertEqual(grad.shape, refgrad.shape)
+                    self.assertTrue(np.allclose(grad, refgrad))
+
+    def test_winograd_convolution_matches_correlate(self):
+        X = np.random.uniform(size=(3, 4, 11, 8))
+        F = np.random.uniform(size=(5, 4, 3, 3))
+
+        reference = correlate(X, F, 1).transpose((0, 2, 1)).reshape(3, 5, 9, 6)
+        for op in (NpConv("winograd"), NbConv("winograd")):
+            O = op.forward(X, F)
+            self.assertEqual(O.shape, reference.shape)
+            np.testing.assert_allclose(O, reference, rtol=1e-10, atol=1e-10)
+
+            E = np.random.uniform(size=O.shape)
+            for grad, refgrad in zip(op.backward(X=X, E=E, F=F), NbConv().backward(X=X, E=E, F=F)):
+                np.testing.assert_allclose(grad, refgrad, rtol=1e-10, atol=1e-10)
+
+    def test_winograd_filter_transform_is_cached(self):
+        op = NbConv("winograd")
+        F = np.random.uniform(size=(2, 1, 3, 3))
+        U = op.transformed_filter(F)
+        self.assertIs(op.transformed_filter(F), U)
+        F += 1.
+        self.assertIsNot(op.transformed_filter(F), U)
+
+    def test_parallel_kernels_match_serial(self):
+        X = np.random.uniform(size=(4, 3, 10, 10))
+        F = np.random.uniform(size=(5, 3, 3, 3))
+        E = np.random.uniform(size=(4, 5, 8, 8))
+
+        serial, parallel = NbConv(parallel=False), NbConv(parallel=True)
+        self.assertTrue(np.allclose(serial.forward(X, F), parallel.forward(X, F)))
+        for sgrad, pgrad in zip(serial.backward(E, X, F), parallel.backward(E, X, F)):
+            self.assertTrue(np.allclose(sgrad, pgrad))
+
+        serial, parallel = NbPool(parallel=False), NbPool(parallel=True)
+        (sO, sF), (pO, pF) = serial.forward(X, 2), parallel.forward(X, 2)
+        self.assertTrue(np.allclose(sO, pO))
+        self.assertTrue(np.all(sF == pF))
+        self.assertTrue(np.allclose(serial.backward(sO, sF, 2), parallel.backward(pO, pF, 2)))
+
+    def test_channels_last_ops(self):
+        A = np.random.randn(2, 9, 8, 3)
+        F = np.random.randn(3, 3, 3, 4)
+        npconv, nbconv = NpConv(layout="NHWC"), NbConv(layout="NHWC")
+        npO = npconv.forward(A, F, "same", 2)
+        nbO = nbconv.forward(A, F, "same", 2)
+        self.assertTrue(np.allclose(npO, nbO))
+
+        E = np.random.randn(*npO.shape)
+        for npgrad, nbgrad in zip(npconv.backward(A, E, F, "same", 2), nbconv.backward(E, A, F, "same", 2)):
+            self.assertTrue(np.allclose(npgrad, nbgrad))
+
+        A = A[:, :8]
+        npO, npF = NpPool(layout="NHWC").forward(A, 2)
+        nbO, nbF = NbPool(layout="NHWC").forward(A, 2)
+        self.assertTrue(np.allclose(npO, nbO))
+        self.assertTrue(np.all(npF == nbF))
+
+    def test_depthwise_convolution_op(self):
+        A = np.random.randn(2, 3, 9, 8)
+        F = np.random.randn(3, 3, 3)
+        npop, nbop = NpDepthwise(), NbDepthwise()
+
+        npO = npop.forward(A, F, "same", 2)
+        nbO = nbop.forward(A, F, "same", 2)
+        self.assertTrue(np.allclose(npO, nbO))
+        # Every output channel only sees its own input channel
+        self.assertTrue(np.allclose(npO[:, 1], NpConv().forward(A[:, 1:2], F[None, 1:2], "same", 2)[:, 0]))
+
+        E = np.random.randn(*npO.shape)
+        for npgrad, nbgrad in zip(npop.backward(A, E, F, "same", 2), nbop.backward(E, A, F, "same", 2)):
+            self.assertEqual(npgrad.shape, nbgrad.shape)
+            self.assertTrue(np.allclose(npgrad, nbgrad))
+
     def test_pooling_op(self):
         npop = NpPool()
         nbop = NbPool()
 
-        A = np.random.uniform(0., 1., (1, 1, 12, 12))
+        A = np.random.uniform(0., 1., (2, 3, 12, 12))
+        E = np.random.uniform(0., 1., (2, 3, 6, 6))
 
         npO, npF = npop.forward(A, 2)
         nbO, nbF = nbop.forward(A, 2)
 
-        npbF = npop.backward(npO, npF)
-        nbbF = nbop.backward(nbO, nbF)
+        npbF = npop.backward(E, npF, 2)
+        nbbF = nbop.backward(E, nbF, 2)
 
-        self.assertTrue(np.allclose(npF, nbF))
+        self.assertEqual(npF.dtype, np.int8)
+        self.assertTrue(np.all(npF == nbF))
         self.assertTrue(np.allclose(npbF, nbbF))
         self.assertTrue(np.allclose(npO, nbO))
+        self.assertTrue(np.allclose(npO, A.reshape(2, 3, 6, 2, 6, 2).max(axis=(3, 5))))
 
         if VISUAL:
             visualize(A, npO, nbO, supt="Testing Pooling")
 
+    def test_pooling_op_routes_ties_once(self):
+        A = np.ones((1, 1, 4, 4))
+        E = np.ones((1, 1, 2, 2))
+        for op in (NpPool(), NbPool()):
+            O, F = op.forward(A, 2)
+            dX = op.backward(E, F, 2)
+            self.assertEqual(dX.sum(), E.sum())
+
     def test_dense_op(self):
         npop = NpDense()
         nbop = NbDense()
@@ -73,6 +230,31 @@ class TestNumbaTensorOps(unittest.TestCase):
         if VISUAL:
             visualize(A[None, None, ...], npO[None, None, ...], nbO[None, None, ...], "Testing Dense")
 
+        E = np.random.uniform(size=(12, 12))
+        for npgrad, nbgrad in zip(npop.backward(A, E, W), nbop.backward(A, E, W)):
+            self.assertTrue(np.allclose(npgrad, nbgrad))
+
+    def test_fused_dense_op(self):
+        npop = NpDense()
+        A = np.random.randn(12, 8)
+        W = np.random.randn(8, 5)
+        b = np.random.randn(5)
+        E = np.random.randn(12, 5)
+
+        for act in ("sigmoid", "tanh", "relu"):
+            activation = activations[act]()
+            nbop = NbDense(act)
+            self.assertTrue(nbop.fused)
+
+            npO = activation.forward(npop.forward(A, W, b))
+            nbO = nbop.forward_activated(A, W, b)
+            self.assertTrue(np.allclose(npO, nbO))
+
+            npgrads = npop.backward(A, E * activation.backward(npO), W)
+            nbgrads = nbop.backward_activated(A, E.copy(), W, nbO)
+            for npgrad, nbgrad in zip(npgrads, nbgrads):
+                self.assertTrue(np.allclose(npgrad, nbgrad))
+
     def test_recurrent_op(self):
 
         npop = NpRec("tanh")
@@ -82,11 +264,15 @@ class TestNumbaTensorOps(unittest.TestCase):
         W = np.random.uniform(size=(20, 10))
         b = np.random.uniform(size=(10,))
 
-        npO, npZ = npop.forward(A, W, b)
-        nbO, nbZ = nbop.forward(A, W, b)
-
+        npO = npop.forward(A, W, b)
+        nbO = nbop.forward(A, W, b)
         self.assertTrue(np.allclose(npO, nbO))
-        self.assertTrue(np.allclose(npZ, nbZ))
+
+        E = np.random.randn(*npO.shape)
+        npgrads = npop.backward(A, npO, E.copy(), W)
+        nbgrads = nbop.backward(A, nbO, E.copy(), W)
+        for npgrad, nbgrad in zip(npgrads, nbgrads):
+            self.assertTrue(np.allclose(npgrad, nbgrad))
 
     def test_lstm_op(self):
         npop = NpLSTM("tanh")
@@ -102,18 +288,48 @@ class TestNumbaTensorOps(unittest.TestCase):
         b = np.random.randn(NEUR * 4)
         # E = np.random.randn(BSZE, TIME, NEUR)
 
-        npO, npZ, npcache = npop.forward(X, W, b)
-        nbO, nbZ, nbcache = nbop.forward(X, W, b)
+        npO, npcache = npop.forward(X, W, b)
+        nbO, nbcache = nbop.forward(X, W, b)
 
-        # visualize(X, npZ, nbZ)
-        for i, array_type in enumerate(["C", "Ca", "cand", "f", "i", "o"]):
+        for array_type, npa, nba in zip(["C", "Ca", "G"], npcache, nbcache):
             for t in range(TIME):
-                d = np.sum(np.abs(npcache[i, t] - nbcache[i, t]))
+                d = np.sum(np.abs(npa[t] - nba[t]))
                 print("{} diff @ t {}: {}".format(array_type, t, d))
-        self.assertTrue(np.allclose(npcache, nbcache))
-        self.assertTrue(np.allclose(npZ, nbZ))
+            self.assertTrue(np.allclose(npa, nba))
         self.assertTrue(np.allclose(npO, nbO))
 
+        E = np.random.randn(*npO.shape)
+        npgrads = npop.backward(X, npO, E.copy(), W, npcache)
+        nbgrads = nbop.backward(X, nbO, E.copy(), W, nbcache)
+        for npgrad, nbgrad in zip(npgrads, nbgrads):
+            self.assertTrue(np.allclose(npgrad, nbgrad))
+
+        # Checkpointed ops keep only the cell states and recompute the gates in backward
+        for op in (NpLSTM("tanh", checkpoint=True), NbLSTM("tanh", checkpoint=True)):
+            O, cache = op.forward(X, W, b)
+            self.assertEqual(len(cache), 1)
+            for grad, npgrad in zip(op.backward(X, O, E.copy(), W, cache, b=b), npgrads):
+                self.assertTrue(np.allclose(grad, npgrad))
+
+    def test_gru_op(self):
+        X = np.random.randn(3, 20, 10)
+        W = np.random.randn(15 + 10, 15 * 3)
+        b = np.random.randn(15 * 3)
+        E = np.random.randn(3, 20, 15)
+
+        for act in ("tanh", "relu"):
+            npop, nbop = NpGRU(act), NbGRU(act)
+            npO, npG = npop.forward(X, W, b)
+            nbO, nbG = nbop.forward(X, W, b)
+            self.assertTrue(np.allclose(npO, nbO))
+            self.assertTrue(np.allclose(npG, nbG))
+            self.assertTrue(np.allclose(npop.predict(X, W, b)[0], nbop.predict(X, W, b)[0]))
+
+            npgrads = npop.backward(X, npO, E.copy(), W, npG)
+            nbgrads = nbop.backward(X, nbO, E.copy(), W, nbG)
+            for npgrad, nbgrad in zip(npgrads, nbgrads):
+                self.assertTrue(np.allclose(npgrad, nbgrad))
+
 
 def visualize(A, O1, O2, supt=None):
     TAKE = 0
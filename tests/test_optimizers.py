@@ -0,0 +1,25 @@
+import unittest
+
+import numpy as np
+
+from brainforge.optimizers import optimizers
+
+
+class TestInplaceOptimizers(unittest.TestCase):
+
+    def test_inplace_matches_optimize(self):
+        W = np.random.randn(50)
+        for name, optimizer_type in optimizers.items():
+            reference, inplace = optimizer_type(), optimizer_type()
+            reference.initialize(nparams=W.size)
+            inplace.initialize(nparams=W.size)
+            refW, inW = W.copy(), W.copy()
+            for step in range(3):
+                gW = np.random.randn(W.size)
+                refW = reference.optimize(refW, gW.copy(), m=4)
+                result = inplace.optimize_inplace(inW, gW, m=4)
+                self.assertIs(result, inW, msg=name)
+                self.assertTrue(np.allclose(refW, inW), msg=name)
+            scratch = inplace._scratch
+            inplace.optimize_inplace(inW, gW, m=4)
+            self.assertTrue(all(a is b for a, b in zip(scratch, inplace._scratch)), msg=name)
@@ -0,0 +1,102 @@
+import unittest
+
+import numpy as np
+
+from brainforge.atomic import ConvolutionOp, MaxPoolOp
+
+
+class TestConvolutionAlgorithms(unittest.TestCase):
+
+    def setUp(self):
+        self.X = np.random.randn(3, 2, 16, 13)
+        self.F = np.random.randn(4, 2, 7, 7)
+        self.reference = ConvolutionOp("im2col")
+
+    def _run_algorithm_test(self, op, mode="valid", stride=1):
+        refO = self.reference.forward(self.X, self.F, mode, stride)
+        O = op.forward(self.X, self.F, mode, stride)
+        self.assertEqual(O.shape, refO.shape)
+        self.assertTrue(np.allclose(O, refO))
+
+        E = np.random.randn(*O.shape)
+        for grad, refgrad in zip(op.backward(self.X, E, self.F, mode, stride),
+                                 self.reference.backward(self.X, E, self.F, mode, stride)):
+            self.assertEqual(grad.shape, refgrad.shape)
+            self.assertTrue(np.allclose(grad, refgrad))
+
+    def test_fft(self):
+        self._run_algorithm_test(ConvolutionOp("fft"))
+
+    def test_fft_strided_same(self):
+        self._run_algorithm_test(ConvolutionOp("fft"), mode="same", stride=2)
+
+    def test_fft_1d_signal(self):
+        self.X = np.random.randn(3, 2, 1, 200)
+        self.F = np.random.randn(4, 2, 1, 31)
+        self._run_algorithm_test(ConvolutionOp("fft"))
+
+    def test_algorithm_selection(self):
+        self.assertEqual(ConvolutionOp.choose_algorithm(3, 3), "im2col")
+        self.assertEqual(ConvolutionOp.choose_algorithm(7, 7), "fft")
+        with self.assertRaises(ValueError):
+            ConvolutionOp("nonexistent")
+
+
+class TestChannelsLastLayout(unittest.TestCase):
+
+    def setUp(self):
+        self.X = np.random.randn(3, 2, 8, 6)
+        self.F = np.random.randn(4, 2, 3, 3)
+        self.Xh = self.X.transpose((0, 2, 3, 1)).copy()
+        self.Fh = self.F.transpose((2, 3, 1, 0)).copy()
+
+    def test_convolution_matches_nchw(self):
+        nchw, nhwc = ConvolutionOp(), ConvolutionOp(layout="NHWC")
+        O = nchw.forward(self.X, self.F, "same", 2)
+        Oh = nhwc.forward(self.Xh, self.Fh, "same", 2)
+        self.assertTrue(np.allclose(O.transpose((0, 2, 3, 1)), Oh))
+
+        E = np.random.randn(*O.shape)
+        dF, db, dX = nchw.backward(self.X, E, self.F, "same", 2)
+        dFh, dbh, dXh = nhwc.backward(self.Xh, E.transpose((0, 2, 3, 1)), self.Fh, "same", 2)
+        self.assertTrue(np.allclose(dF.transpose((2, 3, 1, 0)), dFh))
+        self.assertTrue(np.allclose(db.ravel(), dbh))
+        self.assertTrue(np.allclose(dX.transpose((0, 2, 3, 1)), dXh))
+
+    def test_maxpool_matches_nchw(self):
+        nchw, nhwc = MaxPoolOp(), MaxPoolOp(layout="NHWC")
+        O, argmax = nchw.forward(self.X, 2)
+        Oh, argmaxh = nhwc.forward(self.Xh, 2)
+        self.assertTrue(np.allclose(O.transpose((0, 2, 3, 1)), Oh))
+
+        E = np.random.randn(*O.shape)
+        dX = nchw.backward(E, argmax, 2)
+        dXh = nhwc.backward(E.transpose((0, 2, 3, 1)), argmaxh, 2)
+        self.assertTrue(np.allclose(dX.transpose((0, 2, 3, 1)), dXh))
+
+    def test_unsupported_layouts(self):
+        with self.assertRaises(ValueError):
+            ConvolutionOp(layout="CHWN")
+        with self.assertRaises(ValueError):
+            ConvolutionOp("fft", layout="NHWC")
+
+
+class TestBatchChunking(unittest.TestCase):
+
+    def test_chunks_respect_the_budget(self):
+        op = ConvolutionOp(memory_budget=3 * 2*3*3 * 6*6 * 8)
+        chunks = op.batch_chunks((8, 2, 8, 8), (4, 2, 3, 3))
+        self.assertEqual([c.stop - c.start for c in chunks], [3, 3, 2])
+        self.assertEqual(len(ConvolutionOp(memory_budget=0).batch_chunks((8, 2, 8, 8), (4, 2, 3, 3))), 1)
+
+    def test_chunked_matches_unchunked(self):
+        X = np.random.randn(7, 2, 9, 8)
+        F = np.random.randn(4, 2, 3, 3)
+        unchunked, chunked = ConvolutionOp(memory_budget=0), ConvolutionOp(memory_budget=5000)
+        O = unchunked.forward(X, F, "same", 2)
+        self.assertTrue(np.allclose(O, chunked.forward(X, F, "same", 2)))
+
+        E = np.random.randn(*O.shape)
+        for grad, refgrad in zip(chunked.backward(X, E, F, "same", 2), unchunked.backward(X, E, F, "same", 2)):
+            self.assertEqual(grad.shape, refgrad.shape)
+            self.assertTrue(np.allclose(grad, refgrad))